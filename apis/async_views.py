@@ -0,0 +1,195 @@
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from apis.game import answer_running_game, end_running_game
+from apis.serializers import AnswerQuestionSerializer
+from apps.async_question import agenerate_question
+from apps.models import Game, GameQuestion, QuestionHistory, QuestionCategory, GameMode
+from apps.question import FailedToGenerateQuestion
+from apps.question_buffer import question_buffer
+from apps.utils import acreate_weight_from_database
+
+logger = logging.getLogger(__name__)
+
+# Async version of the game API for ASGI server (e.g. uvicorn gemusaba.asgi:application). Question generation waits on
+# the knowledge base without blocking the worker, so one worker can serve many players at the same time.
+# DRF views are sync only, so these are plain Django views that only accept JWT (Authorization: Bearer <token>) and
+# don't need CSRF token.
+
+jwt_authentication = JWTAuthentication()
+
+
+async def aauthenticate(request):
+    """
+    Authenticate the user from JWT in the Authorization header
+    :param request: HttpRequest
+    :return: User instance, None if the token is missing or invalid
+    """
+    try:
+        result = await sync_to_async(jwt_authentication.authenticate)(request)
+    except (InvalidToken, AuthenticationFailed):
+        return None
+    if result is None:
+        return None
+    return result[0]
+
+
+def get_payload(request) -> dict:
+    """
+    Get the request payload from JSON or form body
+    :param request: HttpRequest
+    :return: Payload dict
+    """
+    if request.content_type == 'application/json':
+        return json.loads(request.body or b'{}')
+    return request.POST
+
+
+def not_authenticated():
+    return JsonResponse({
+        'message': 'User is not authenticated'
+    }, status=401)
+
+
+@csrf_exempt
+@require_POST
+async def async_start_new_game(request):
+    """
+    Start a new game for user
+    """
+    user = await aauthenticate(request)
+    if user is None:
+        return not_authenticated()
+    await Game.objects.filter(user=user, finished=False).aupdate(
+        finished=True, completed=False, end_time=timezone.now()
+    )
+    game = await Game.objects.acreate(user=user)
+    question_buffer.request_refill(user, await acreate_weight_from_database(user.id))
+    return JsonResponse({
+        'message': 'Game started successfully',
+        'game_id': game.id
+    })
+
+
+@csrf_exempt
+@require_POST
+async def async_get_new_question(request):
+    """
+    Get a new question for user
+    """
+    user = await aauthenticate(request)
+    if user is None:
+        return not_authenticated()
+    try:
+        # find running game
+        game = await Game.objects.filter(user=user, finished=False).afirst()
+        if not game:
+            return JsonResponse({
+                'message': 'No game is running'
+            }, status=400)
+        # find question that's not answered yet
+        if await GameQuestion.objects.filter(game=game, answered=False).aexists():
+            return JsonResponse({
+                'message': 'There are questions left',
+            }, status=400)
+        # generate new question, use the pre-generated question if it's ready
+        weight = game.get_weight() if game.weight else await acreate_weight_from_database(user.id)
+        random_question = question_buffer.pop(user.id, weight)
+        if random_question is None:
+            random_question = await agenerate_question(target_user=user, custom_weight=weight)
+        question_buffer.request_refill(user, weight)
+        new_question = await QuestionHistory.objects.acreate(
+            question_mode=random_question['question_mode'],
+            category=await QuestionCategory.objects.aget(name=random_question['question_category']),
+            difficulty_level=random_question['difficulty_level'],
+            question=random_question['rendered_question'],
+            choice=random_question['choices'],
+            answer=random_question['answer'],
+            type=random_question['type'],
+            full_json=random_question
+        )
+        game_mode = await GameMode.objects.aget(name=random_question['game_mode']['name'])
+        await GameQuestion.objects.acreate(
+            game=game,
+            question=new_question,
+            game_mode=game_mode
+        )
+        return JsonResponse({
+            'message': 'New question generated',
+            'question_id': new_question.id,
+            'game_mode': game_mode.name,
+            'question': random_question,
+            'choice': new_question.choice,
+            'answer': new_question.answer
+        })
+    except FailedToGenerateQuestion as e:
+        logger.error(f'Failed to generate question for user {user} (FailedToGenerateQuestion) with error: {str(e)}')
+        logger.exception(e)
+        return JsonResponse({
+            'message': str(e)
+        }, status=400)
+    except Exception as e:
+        logger.error(f'Error when getting new question for user {user} with error: {str(e)}')
+        logger.exception(e)
+        return JsonResponse({
+            'message': 'Internal server error'
+        }, status=500)
+
+
+@csrf_exempt
+@require_POST
+async def async_answer_question(request):
+    """
+    Answer a question for user
+    """
+    user = await aauthenticate(request)
+    if user is None:
+        return not_authenticated()
+    try:
+        payload = AnswerQuestionSerializer(data=get_payload(request))
+        if not payload.is_valid():
+            return JsonResponse({
+                'message': 'Invalid payload',
+                'score': 0,
+                'errors': payload.errors
+            }, status=400)
+        # The answer is saved in a transaction that lock the game, transaction can only be used in sync code
+        response, status = await sync_to_async(answer_running_game)(
+            user, payload.data['answer'], payload.data['duration']
+        )
+        return JsonResponse(response, status=status)
+    except Exception as e:
+        logger.error(f'Error when answering question for user {user} with error: {str(e)}')
+        logger.exception(e)
+        return JsonResponse({
+            'message': 'Internal server error'
+        }, status=500)
+
+
+@csrf_exempt
+@require_POST
+async def async_end_game(request):
+    """
+    End a game for user
+    """
+    user = await aauthenticate(request)
+    if user is None:
+        return not_authenticated()
+    try:
+        response, status = await sync_to_async(end_running_game)(user)
+        return JsonResponse(response, status=status)
+    except Exception as e:
+        logger.error(f'Error when ending game for user {user} with error: {str(e)}')
+        logger.exception(e)
+        return JsonResponse({
+            'message': 'Internal server error'
+        }, status=500)
@@ -0,0 +1,67 @@
+from django.db import transaction
+
+from apps.models import Game, GameQuestion
+from apps.question_buffer import question_buffer
+from apps.utils import apply_answer_to_game, record_answer, finish_game
+
+# Game actions shared by the sync and async game API, each return the response payload and status code
+
+
+def answer_running_game(user, answer: str, duration: float) -> tuple[dict, int]:
+    """
+    Answer the unanswered question of the user's running game
+    :param user: User instance
+    :param answer: Answer of the user
+    :param duration: Seconds that the user took to answer
+    :return: Tuple of (response payload, status code)
+    """
+    with transaction.atomic():
+        # find running game, lock it so concurrent answers don't lose the update of the accumulators
+        game = Game.objects.select_for_update().filter(user=user, finished=False).first()
+        if not game:
+            return {
+                'message': 'No game is running'
+            }, 400
+        # find question that's not answered yet
+        question = GameQuestion.objects.select_related('question').filter(game=game, answered=False).first()
+        if not question:
+            return {
+                'message': 'No question to answer'
+            }, 400
+        is_true = record_answer(question, answer, duration)
+        # Add this answer to the running weight and score of this game
+        apply_answer_to_game(game, question)
+        game.save()
+        # Check for end game
+        if game.has_lose():
+            finish_game(game)
+            question_buffer.clear(user.id)
+        else:
+            question_buffer.request_refill(user, game.weight)
+    if is_true:
+        return {
+            'message': "Right answer",
+            'score': question.get_score()
+        }, 200
+    return {
+        'message': "Wrong answer",
+        'score': 0
+    }, 200
+
+
+def end_running_game(user) -> tuple[dict, int]:
+    """
+    End the running game of the user
+    :param user: User instance
+    :return: Tuple of (response payload, status code)
+    """
+    game = Game.objects.filter(user=user, finished=False).first()
+    if not game:
+        return {
+            'message': 'No game is running'
+        }, 400
+    finish_game(game)
+    question_buffer.clear(user.id)
+    return {
+        'message': 'Game ended successfully'
+    }, 200
@@ -1,7 +1,17 @@
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
-from apps.models import Game, QuestionCategory, ImageCustomQuestion, GameMode, TextCustomQuestion, GameQuestion
+from apps.models import Game, QuestionCategory, ImageCustomQuestion, GameMode, TextCustomQuestion, GameQuestion, \
+    QuestionHistory, LeaderboardEntry, UserCategoryWeight
+from apps.question_pool import question_pool
+from apps.utils import calculate_total_score, create_total_weight_with_game, encode_game_cursor
+from users.models import Profile
 
 
 class TestObtainAuthToken(TestCase):
@@ -37,6 +47,8 @@ class TestObtainAuthToken(TestCase):
 
 class BaseAPITestCase(TestCase):
     def setUp(self):
+        # Question pool is kept in memory between tests while the database is rolled back
+        question_pool.invalidate()
         self.user = User.objects.create_user(
             username='testuser',
             password='testpassword'
@@ -48,22 +60,23 @@ class BaseAPITestCase(TestCase):
         self.client = Client(
             HTTP_AUTHORIZATION=f'Bearer {response_json["access"]}'
         )
+        self.async_header = {'Authorization': f'Bearer {response_json["access"]}'}
 
     def generate_dummy_question(self):
         question_category = QuestionCategory.objects.create(name="Dummy category")
         for i in range(5):
             ImageCustomQuestion.objects.create(
                 question="Dummy question",
-                choices=f'["{i}","{i + 1}","{i + 2}","{i + 3}"]',
-                answer=f'["{i}"]',
+                choices=[f"{i}", f"{i + 1}", f"{i + 2}", f"{i + 3}"],
+                answer=[f"{i}"],
                 difficulty_level="easy",
                 category=question_category,
                 active=True
             )
             TextCustomQuestion.objects.create(
                 question="Dummy question",
-                choices=f'["{i}","{i + 1}","{i + 2}","{i + 3}"]',
-                answer=f'["{i}"]',
+                choices=[f"{i}", f"{i + 1}", f"{i + 2}", f"{i + 3}"],
+                answer=[f"{i}"],
                 difficulty_level="easy",
                 category=question_category,
                 active=True
@@ -94,6 +107,13 @@ class TestStartNewGame(BaseAPITestCase):
         self.assertEqual(Game.objects.filter(completed=False, finished=False).count(), 1)
         self.assertEqual(Game.objects.filter(completed=False, finished=True).count(), 1)
 
+    def test_start_new_game_keep_other_user_game(self):
+        other_user = User.objects.create_user(username='otheruser', password='testpassword')
+        Game.objects.create(user=other_user, completed=False, finished=False)
+        response = self.client.post('/api/game/start')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Game.objects.filter(user=other_user, finished=False).count(), 1)
+
 
 class TestGenerateQuestionInGame(BaseAPITestCase):
     def test_generate_question_in_game(self):
@@ -204,6 +224,23 @@ class TestAnswerQuestion(BaseAPITestCase):
         game.refresh_from_db()
         self.assertEqual(game.has_lose(), True)
 
+    def test_answer_question_accumulate_score_and_weight(self):
+        self.generate_dummy_question()
+        game = Game.objects.create(user=self.user, completed=False, finished=False)
+        for answer_right in [True, False, True, False]:
+            response = self.client.post('/api/game/question', **self.header)
+            self.assertEqual(response.status_code, 200)
+            question = game.gamequestion_set.get(answered=False)
+            answer = question.question.answer if answer_right else ''
+            response = self.client.post('/api/game/answer', {'answer': answer, 'duration': 5}, **self.header)
+            self.assertEqual(response.status_code, 200)
+        game.refresh_from_db()
+        # Running totals must be the same as recomputing from all answered questions
+        self.assertEqual(game.score, calculate_total_score(game.id))
+        self.assertEqual(game.get_weight(), create_total_weight_with_game(game.id))
+        self.assertEqual(game.wrong_count, 2)
+        self.assertEqual(game.has_lose(), False)
+
     def test_answer_question_no_running_game(self):
         self.generate_dummy_question()
         response = self.client.post('/api/game/answer', {'answer': '["0"]', 'duration': 5}, **self.header)
@@ -255,6 +292,48 @@ class TestEndGame(BaseAPITestCase):
         self.assertEqual(response.status_code, 400)
 
 
+class TestAsyncGameAPI(BaseAPITestCase):
+    def async_post(self, path, data=None, **kwargs):
+        return self.async_client.post(path, data, headers=self.async_header, **kwargs)
+
+    async def test_async_game(self):
+        await sync_to_async(self.generate_dummy_question)()
+        response = await self.async_post('/api/async/game/start')
+        self.assertEqual(response.status_code, 200)
+        game = await Game.objects.aget(id=response.json()['game_id'])
+        response = await self.async_post('/api/async/game/question')
+        self.assertEqual(response.status_code, 200)
+        response = await self.async_post('/api/async/game/question')
+        self.assertEqual(response.status_code, 400)
+        question = await GameQuestion.objects.select_related('question').aget(game=game)
+        response = await self.async_post(
+            '/api/async/game/answer', {'answer': question.question.answer, 'duration': 5}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['message'], 'Right answer')
+        score = response.json()['score']
+        response = await self.async_post('/api/async/game/end')
+        self.assertEqual(response.status_code, 200)
+        await game.arefresh_from_db()
+        self.assertEqual(game.completed, True)
+        self.assertEqual(game.score, score)
+
+    async def test_async_game_without_auth(self):
+        self.async_header = {}
+        for url in ['/api/async/game/start', '/api/async/game/question', '/api/async/game/answer', '/api/async/game/end']:
+            response = await self.async_post(url)
+            self.assertEqual(response.status_code, 401)
+        self.assertEqual(await Game.objects.acount(), 0)
+
+    async def test_async_game_no_running_game(self):
+        response = await self.async_post('/api/async/game/question')
+        self.assertEqual(response.status_code, 400)
+        response = await self.async_post('/api/async/game/answer', {'answer': '', 'duration': 5})
+        self.assertEqual(response.status_code, 400)
+        response = await self.async_post('/api/async/game/end')
+        self.assertEqual(response.status_code, 400)
+
+
 class TestGetUserInfo(BaseAPITestCase):
     def test_get_user_info(self):
         response = self.client.get('/api/user', **self.header)
@@ -275,6 +354,26 @@ class TestGetLeaderboard(BaseAPITestCase):
         response_json = response.json()
         self.assertIsInstance(response_json, dict)
 
+    def test_get_leaderboard_updated_on_game_end(self):
+        game = Game.objects.create(user=self.user, completed=False, finished=False, score=150)
+        response = self.client.post('/api/game/end')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/api/leaderboard', **self.header)
+        self.assertEqual(response.status_code, 200)
+        response_json = response.json()
+        self.assertEqual(response_json['username1'], 'testuser')
+        self.assertEqual(response_json['score1'], 150)
+        game.refresh_from_db()
+        self.assertEqual(game.rank_after, 1)
+
+    def test_get_leaderboard_keep_best_score(self):
+        Game.objects.create(user=self.user, completed=False, finished=False, score=300)
+        self.client.post('/api/game/end')
+        Game.objects.create(user=self.user, completed=False, finished=False, score=100)
+        self.client.post('/api/game/end')
+        response = self.client.get('/api/leaderboard', **self.header)
+        self.assertEqual(response.json()['score1'], 300)
+
 
 class TestGetPlayHistory(BaseAPITestCase):
     def test_get_play_history(self):
@@ -284,6 +383,146 @@ class TestGetPlayHistory(BaseAPITestCase):
         response_json = response.json()
         self.assertEqual(response_json['score'], game.score)
 
+    def test_get_play_history_answer_count(self):
+        game = Game.objects.create(user=self.user, completed=True, finished=True)
+        question = QuestionHistory.objects.create(question_mode="text_custom_question", difficulty_level="easy",
+                                                  question="Dummy question", answer="0", type="text")
+        game_mode = GameMode.objects.create(name="Dummy mode", allow_answer_mode="single_right")
+        GameQuestion.objects.bulk_create(
+            [GameQuestion(game=game, question=question, game_mode=game_mode, answered=True, is_true=True)] * 3 +
+            [GameQuestion(game=game, question=question, game_mode=game_mode, answered=True, is_true=False)] * 2 +
+            [GameQuestion(game=game, question=question, game_mode=game_mode, answered=False)]
+        )
+        response_json = self.client.get(f'/api/history/{game.id}', **self.header).json()
+        self.assertEqual((response_json['right'], response_json['wrong']), (3, 2))
+
     def test_get_play_history_invalid_game_id(self):
         response = self.client.get(f'/api/history/0', **self.header)
         self.assertEqual(response.status_code, 404)
+
+
+class TestGetUserGames(BaseAPITestCase):
+    def create_games(self, count: int):
+        end_time = timezone.now()
+        # Games that end at the same time are ordered by ID
+        return Game.objects.bulk_create([
+            Game(user=self.user, score=i, finished=True, completed=True, end_time=end_time - timedelta(minutes=i // 2))
+            for i in range(count)
+        ])
+
+    def test_get_user_games(self):
+        games = self.create_games(45)
+        Game.objects.create(user=self.user, finished=False)
+        expected = [game.id for game in sorted(games, key=lambda g: (g.end_time, g.id), reverse=True)]
+        game_ids = []
+        cursor = None
+        for _ in range(3):
+            response = self.client.get(f'/api/user/{self.user.id}/games', {'cursor': cursor} if cursor else {})
+            self.assertEqual(response.status_code, 200)
+            game_ids.extend(game['id'] for game in response.json()['games'])
+            cursor = response.json()['next']
+        self.assertIsNone(cursor)
+        self.assertEqual(game_ids, expected)
+
+    def test_get_user_games_invalid_cursor(self):
+        response = self.client.get(f'/api/user/{self.user.id}/games', {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_user_games_invalid_user_id(self):
+        response = self.client.get('/api/user/0/games')
+        self.assertEqual(response.status_code, 404)
+
+
+class TestQueryBudget(BaseAPITestCase):
+    """
+    Number of queries of each endpoint must not grow with the data size, the budgets are checked on a large dataset
+    """
+    USER_COUNT = 2000
+    QUESTION_PER_GAME = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories = QuestionCategory.objects.bulk_create(
+            [QuestionCategory(name=f"Dummy category {i}") for i in range(10)]
+        )
+        cls.game_mode = GameMode.objects.create(name="Dummy mode", allow_answer_mode="single_right")
+        cls.questions = QuestionHistory.objects.bulk_create([
+            QuestionHistory(
+                question_mode="text_custom_question", category=cls.categories[i % 10], difficulty_level="easy",
+                question="Dummy question", choice=str(["0", "1", "2", "3"]), answer="0", type="text"
+            ) for i in range(1000)
+        ])
+        # Signals are not sent by bulk_create, so the related rows of the users are created here
+        users = User.objects.bulk_create(
+            [User(username=f"player{i}", password="!") for i in range(cls.USER_COUNT)]
+        )
+        Profile.objects.bulk_create([Profile(user=user) for user in users])
+        LeaderboardEntry.objects.bulk_create([LeaderboardEntry(user=user, best_score=i * 10) for i, user in enumerate(users)])
+        UserCategoryWeight.objects.bulk_create(
+            [UserCategoryWeight(user=user, category=category, weight=1.0) for user in users[:200] for category in cls.categories]
+        )
+        games = Game.objects.bulk_create(
+            [Game(user=user, score=i * 10, finished=True, completed=True) for i, user in enumerate(users)]
+        )
+        GameQuestion.objects.bulk_create([
+            GameQuestion(game=game, question=cls.questions[(i + j) % 1000], game_mode=cls.game_mode, selected="0",
+                         answered=True, is_true=j % 2 == 0)
+            for i, game in enumerate(games) for j in range(cls.QUESTION_PER_GAME)
+        ])
+
+    def create_game(self, answered: int, unanswered: int = 0, **kwargs) -> Game:
+        game = Game.objects.create(user=self.user, **kwargs)
+        GameQuestion.objects.bulk_create(
+            [GameQuestion(game=game, question=self.questions[i], game_mode=self.game_mode, selected="0",
+                          answered=True, is_true=True) for i in range(answered)] +
+            [GameQuestion(game=game, question=self.questions[answered + i], game_mode=self.game_mode)
+             for i in range(unanswered)]
+        )
+        return game
+
+    def assertQueryBudget(self, budget: int, method: str, path: str, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(path, data)
+        self.assertLess(response.status_code, 400)
+        self.assertLessEqual(
+            len(queries), budget,
+            f'{method.upper()} {path} ran {len(queries)} queries:\n' + '\n'.join(q['sql'] for q in queries.captured_queries)
+        )
+
+    def test_leaderboard(self):
+        self.assertQueryBudget(2, 'get', '/api/leaderboard')
+
+    def test_answer_question(self):
+        self.create_game(answered=200, unanswered=1, weight={str(c.id): 3.0 for c in self.categories})
+        self.assertQueryBudget(7, 'post', '/api/game/answer', {'answer': '0', 'duration': 5})
+
+    def test_answer_question_lose(self):
+        self.create_game(answered=200, unanswered=1, wrong_count=2)
+        self.assertQueryBudget(20, 'post', '/api/game/answer', {'answer': 'wrong', 'duration': 5})
+
+    def test_end_game(self):
+        self.create_game(answered=200, weight={str(c.id): 3.0 for c in self.categories})
+        self.assertQueryBudget(14, 'post', '/api/game/end')
+
+    def test_api_play_history(self):
+        game = self.create_game(answered=200, finished=True, completed=True)
+        self.assertQueryBudget(3, 'get', f'/api/history/{game.id}')
+
+    def test_user_profile(self):
+        self.create_game(answered=10, finished=True, completed=True)
+        self.assertQueryBudget(5, 'get', f'/profile/{self.user.id}')
+
+    def test_user_games_deep_page(self):
+        Game.objects.bulk_create([
+            Game(user=self.user, score=i, finished=True, completed=True, end_time=timezone.now()) for i in range(500)
+        ])
+        self.assertQueryBudget(3, 'get', f'/api/user/{self.user.id}/games')
+        last_game = Game.objects.filter(user=self.user).order_by('end_time', 'id')[1]
+        self.assertQueryBudget(3, 'get', f'/api/user/{self.user.id}/games', {'cursor': encode_game_cursor(last_game)})
+        self.assertQueryBudget(5, 'get', f'/profile/{self.user.id}')
+
+    def test_play_history(self):
+        game = self.create_game(answered=200, finished=True, completed=True)
+        self.assertQueryBudget(3, 'get', f'/history/{game.id}')
+        short_game = self.create_game(answered=1, finished=True, completed=True)
+        self.assertQueryBudget(3, 'get', f'/history/{short_game.id}')
@@ -1,6 +1,7 @@
 from django.urls import path
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView, TokenVerifyView
 
+from apis.async_views import async_start_new_game, async_get_new_question, async_answer_question, async_end_game
 from apis.views import *
 
 urlpatterns = [
@@ -15,7 +16,14 @@ urlpatterns = [
     path("game/answer", answer_question, name="api_answer_question"),
     path("game/end", end_game, name="api_end_game"),
 
+    # Async version of the game API, serve with ASGI server
+    path("async/game/start", async_start_new_game, name="api_async_start_new_game"),
+    path("async/game/question", async_get_new_question, name="api_async_get_new_question"),
+    path("async/game/answer", async_answer_question, name="api_async_answer_question"),
+    path("async/game/end", async_end_game, name="api_async_end_game"),
+
     path("user", get_user_info, name="api_get_user_info"),
+    path("user/<int:user_id>/games", get_user_games, name="api_get_user_games"),
 
     path("leaderboard", get_leaderboard, name="api_get_leaderboard"),
     path("history/<int:game_id>", get_play_history, name="api_get_play_history"),
@@ -1,13 +1,17 @@
 import logging
 
+from django.contrib.auth.models import User
 from django.utils import timezone
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 
+from apis.game import answer_running_game, end_running_game
 from apis.serializers import AnswerQuestionSerializer
-from apps.models import Game, GameQuestion, QuestionHistory, QuestionCategory, GameMode, UserCategoryWeight
+from apps.models import Game, GameQuestion, QuestionHistory, QuestionCategory, GameMode
 from apps.question import generate_question, FailedToGenerateQuestion
-from apps.utils import create_total_weight_with_game, calculate_total_score, generate_leaderboard, get_user_rank
+from apps.question_buffer import question_buffer
+from apps.utils import generate_leaderboard, create_weight_from_database, get_game_weight, get_answer_count, \
+    get_game_history
 from users.models import Profile
 
 logger = logging.getLogger(__name__)
@@ -47,8 +51,8 @@ def start_new_game(request):
         return Response({
             'message': 'User is not authenticated'
         }, status=401)
-    if Game.objects.filter(finished=False):
-        for game in Game.objects.filter(finished=False):
+    if Game.objects.filter(user=request.user, finished=False):
+        for game in Game.objects.filter(user=request.user, finished=False):
             game.finished = True
             game.completed = False
             game.end_time = timezone.now()
@@ -56,6 +60,7 @@ def start_new_game(request):
     game = Game.objects.create(
         user=request.user
     )
+    question_buffer.request_refill(request.user, create_weight_from_database(request.user.id))
     return Response({
         'message': 'Game started successfully',
         'game_id': game.id
@@ -84,8 +89,12 @@ def get_new_question(request):
             return Response({
                 'message': 'There are questions left',
             }, status=400)
-        # generate new question
-        random_question = generate_question(target_user=request.user, custom_weight=create_total_weight_with_game(game.id))
+        # generate new question, use the pre-generated question if it's ready
+        weight = get_game_weight(game)
+        random_question = question_buffer.pop(request.user.id, weight)
+        if random_question is None:
+            random_question = generate_question(target_user=request.user, custom_weight=weight)
+        question_buffer.request_refill(request.user, weight)
         new_question = QuestionHistory.objects.create(
             question_mode=random_question['question_mode'],
             category=QuestionCategory.objects.get(name=random_question['question_category']),
@@ -135,63 +144,8 @@ def answer_question(request):
     try:
         payload = AnswerQuestionSerializer(data=request.data)
         if payload.is_valid():
-            # find running game
-            game = Game.objects.filter(user=request.user, finished=False).first()
-            if not game:
-                return Response({
-                    'message': 'No game is running'
-                }, status=400)
-            # find question that's not answered yet
-            question = GameQuestion.objects.filter(game=game, answered=False).first()
-            if not question:
-                return Response({
-                    'message': 'No question to answer'
-                }, status=400)
-            if question.question.answer == payload.data['answer']:
-                question.is_true = True
-                question.answered = True
-                question.selected = payload.data['answer']
-                question.duration = payload.data['duration']
-                question.save()
-                is_true = True
-            else:
-                question.is_true = False
-                question.answered = True
-                question.selected = payload.data['answer']
-                question.duration = payload.data['duration']
-                question.save()
-                is_true = False
-            # Calculate all weight and score of this game
-            game.weight = create_total_weight_with_game(game.id)
-            game.score = calculate_total_score(game.id)
-            game.save()
-            # Check for end game
-            if game.has_lose():
-                for k, v in game.weight.items():
-                    category = QuestionCategory.objects.get(id=k)
-                    try:
-                        weight = UserCategoryWeight.objects.get(user=request.user, category=category)
-                    except UserCategoryWeight.DoesNotExist:
-                        weight = UserCategoryWeight.objects.create(user=request.user, category=category, weight=v)
-                    weight.weight = v
-                    weight.save()
-                game.rank_before = get_user_rank(game.user.id)
-                game.finished = True
-                game.completed = True
-                game.end_time = timezone.now()
-                game.save()
-                game.rank_after = get_user_rank(game.user.id)
-                game.save()
-            if is_true:
-                return Response({
-                    'message': "Right answer",
-                    'score': question.get_score()
-                })
-            else:
-                return Response({
-                    'message': "Wrong answer",
-                    'score': 0
-                })
+            response, status = answer_running_game(request.user, payload.data['answer'], payload.data['duration'])
+            return Response(response, status=status)
         else:
             return Response({
                 'message': 'Invalid payload',
@@ -218,29 +172,8 @@ def end_game(request):
             'message': 'User is not authenticated'
         }, status=401)
     try:
-        game = Game.objects.filter(user=request.user, finished=False).first()
-        if not game:
-            return Response({
-                'message': 'No game is running'
-            }, status=400)
-        for k, v in game.weight.items():
-            category = QuestionCategory.objects.get(id=k)
-            try:
-                weight = UserCategoryWeight.objects.get(user=request.user, category=category)
-            except UserCategoryWeight.DoesNotExist:
-                weight = UserCategoryWeight.objects.create(user=request.user, category=category, weight=v)
-            weight.weight = v
-            weight.save()
-        game.end_time = timezone.now()
-        game.rank_before = get_user_rank(game.user.id)
-        game.finished = True
-        game.completed = True
-        game.save()
-        game.rank_after = get_user_rank(game.user.id)
-        game.save()
-        return Response({
-            'message': 'Game ended successfully'
-        })
+        response, status = end_running_game(request.user)
+        return Response(response, status=status)
     except Exception as e:
         logger.error(f'Error when ending game for user {request.user} with error: {str(e)}')
         logger.exception(e)
@@ -292,15 +225,44 @@ def get_play_history(request, game_id):
     Get play history
     """
     try:
-        game = Game.objects.get(id=game_id)
+        game = Game.objects.only('score', 'rank_before', 'rank_after').get(id=game_id)
     except Game.DoesNotExist:
         return Response({
             'message': 'Game not found'
         }, status=404)
+    right, wrong = get_answer_count(game.id)
     return Response({
         'score': game.score,
         'rank_before': game.rank_before,
         'rank_after': game.rank_after,
-        'right': GameQuestion.objects.filter(game=game, answered=True, is_true=True).count(),
-        'wrong': GameQuestion.objects.filter(game=game, answered=True, is_true=False).count()
+        'right': right,
+        'wrong': wrong
+    })
+
+
+@api_view(['GET'])
+def get_user_games(request, user_id):
+    """
+    Get completed games of the user, latest first. Pass the "next" cursor of the response as "cursor" query parameter
+    to get the next page, "next" is null on the last page.
+    """
+    if not User.objects.filter(id=user_id).exists():
+        return Response({
+            'message': 'User not found'
+        }, status=404)
+    try:
+        games, next_cursor = get_game_history(user_id, request.query_params.get('cursor'))
+    except ValueError:
+        return Response({
+            'message': 'Invalid cursor'
+        }, status=400)
+    return Response({
+        'games': [
+            {
+                'id': game.id,
+                'end_time': game.end_time,
+                'score': game.score
+            } for game in games
+        ],
+        'next': next_cursor
     })
@@ -11,3 +11,9 @@ admin.site.register(ImageCustomQuestion)
 admin.site.register(Game)
 admin.site.register(GameQuestion)
 admin.site.register(QuestionHistory)
+admin.site.register(LeaderboardEntry)
+admin.site.register(KnowledgeBaseClass)
+admin.site.register(KnowledgeBasePropertyType)
+admin.site.register(KnowledgeBaseInstance)
+admin.site.register(KnowledgeBasePropertyValue)
+admin.site.register(KnowledgeBaseSync)
@@ -0,0 +1,127 @@
+import logging
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+
+from apps.models import QuestionModel, GameMode
+from apps.question import FailedToGenerateQuestion, GenerationAttempts, SingleRightQuestionBuilder, \
+    get_all_question_mode, select_question, build_text_question, generate_text_custom_question, \
+    generate_image_custom_question, get_question_queryset
+from apps.question_pool import question_pool, QUESTION_MODE_MODEL
+from apps.knowledge_base_snapshot import async_knowledge_base_snapshot
+from apps.seed_api import async_knowledge_base
+from apps.utils import acreate_weight_from_database
+
+logger = logging.getLogger(__name__)
+
+# Async version of apps.question for the async game API, the knowledge base is called with the non-blocking client
+# so the event loop can serve other players while waiting on it.
+# Note : Seed question is tested against the local knowledge base stub, see apps/knowledge_base_stub.py
+
+
+def get_async_seed_knowledge_base():
+    """
+    Get the async knowledge base that seed question is generated from, see apps.question.get_seed_knowledge_base
+    :return: AsyncKnowledgeBaseSnapshot or AsyncKnowledgeBaseClient
+    """
+    if question_pool.has_knowledge_base_snapshot():
+        return async_knowledge_base_snapshot
+    return async_knowledge_base
+
+
+async def agenerate_question(choices: int = 4, try_count: int = 100, target_user: User = None, custom_weight: dict = None):
+    """
+    Generate a question for the user to answer, see apps.question.generate_question
+    :param choices: Number of choices to generate
+    :param try_count: Number of tries to generate question
+    :param target_user: User to generate question for, used to get the weight if custom weight is not provided
+    :param custom_weight: Weight dict of the user
+    :return: Dict of question, choices, and answer
+    """
+    if target_user and not custom_weight:
+        custom_weight = await acreate_weight_from_database(target_user.id)
+    attempts = GenerationAttempts(try_count)
+    for i in attempts:
+        with attempts:
+            # The question pool may be rebuilt from the database and is stored in the shared cache, so it's always
+            # accessed in the sync thread
+            all_question_mode = attempts.get_question_modes(
+                await sync_to_async(get_all_question_mode)(include_seed_question=not attempts.skip_seed_question)
+            )
+            selected_question_mode, question_id, answer_mode = await sync_to_async(select_question)(
+                all_question_mode, custom_weight if custom_weight or target_user else None, attempts.failed_question
+            )
+            question_model = QUESTION_MODE_MODEL[selected_question_mode]
+            try:
+                question = await get_question_queryset(selected_question_mode).aget(pk=question_id)
+            except question_model.DoesNotExist:
+                # The pool is outdated, rebuild it on next attempt
+                await sync_to_async(question_pool.invalidate)()
+                raise FailedToGenerateQuestion(f"Failed to generate question, question with ID {question_id} not found")
+
+            # random the game mode that allow the answer mode of the question
+            game_mode = await sync_to_async(question_pool.random_game_mode)(answer_mode)
+            attempts.generating(selected_question_mode, question_id)
+            return await agenerate_question_from_model(question, selected_question_mode, game_mode, choices)
+    raise attempts.fail()
+
+
+async def agenerate_question_from_model(question, question_mode: str, game_mode: GameMode, choices: int = 4):
+    """
+    Generate question from question model by its question mode
+    :param question: QuestionModel, TextCustomQuestion, or ImageCustomQuestion instance with its category loaded
+    :param question_mode: Question mode of the question
+    :param game_mode: GameMode instance that allow the answer mode of the question
+    :param choices: Number of choices to generate
+    :return: Dict of question, choices, and answer
+    """
+    if game_mode is None:
+        raise FailedToGenerateQuestion("No question or game mode found")
+
+    if question_mode == "seed_question":
+        if question.answer_mode not in game_mode.allow_answer_mode:
+            raise FailedToGenerateQuestion(f"Failed to generate question, question mode {question.answer_mode} not allowed in game mode {game_mode.name}")
+
+        if question.answer_mode == "single_right":
+            return await agenerate_single_right_question(question, game_mode, choices)
+        elif question.answer_mode == "text":
+            return await agenerate_text_question(question, game_mode)
+        else:
+            raise FailedToGenerateQuestion(f"Failed to generate question, question mode {question.answer_mode} not found")
+    # Choices of custom question are read from the question pool, which may be rebuilt from the database
+    elif question_mode == "text_custom_question":
+        return await sync_to_async(generate_text_custom_question)(question, game_mode, choices)
+    elif question_mode == "image_custom_question":
+        return await sync_to_async(generate_image_custom_question)(question, game_mode, choices)
+    else:
+        raise FailedToGenerateQuestion(f"Failed to generate question, question mode {question_mode} not found")
+
+
+async def agenerate_single_right_question(question: QuestionModel, game_mode: GameMode, choices: int = 4, seed_knowledge_base=None):
+    """
+    Generate a "single right" question, see apps.question.generate_single_right_question
+    :param question: QuestionModel instance
+    :param game_mode: GameMode instance
+    :param choices: Number of choices to generate
+    :param seed_knowledge_base: Async knowledge base to generate from, see get_async_seed_knowledge_base() if not provided
+    :return: Dict of question, choices, and answer
+    """
+    seed_knowledge_base = seed_knowledge_base or await sync_to_async(get_async_seed_knowledge_base)()
+    instance_list = await seed_knowledge_base.get_indexed_instances_from_class(question.main_class_id)
+    builder = SingleRightQuestionBuilder(question, game_mode, instance_list, choices)
+    while builder.unresolved:
+        builder.add_names(await seed_knowledge_base.get_instance_names(builder.unresolved))
+    return builder.build()
+
+
+async def agenerate_text_question(question: QuestionModel, game_mode: GameMode, seed_knowledge_base=None):
+    """
+    Generate a "text" question, see apps.question.generate_text_question
+    :param question: QuestionModel instance
+    :param game_mode: GameMode instance
+    :param seed_knowledge_base: Async knowledge base to generate from, see get_async_seed_knowledge_base() if not provided
+    :return: Dict of question, and answer
+    """
+    seed_knowledge_base = seed_knowledge_base or await sync_to_async(get_async_seed_knowledge_base)()
+    instance_list = await seed_knowledge_base.get_indexed_instances_from_class(question.main_class_id)
+    return build_text_question(question, game_mode, instance_list)
@@ -0,0 +1,212 @@
+import time
+
+from django.core.cache import caches
+
+# Cache shared by all workers through Django's cache framework, the backend is configured by CACHE_BACKEND in settings
+# (local memory by default, file or Redis to share between workers and nodes).
+# Key is "<namespace>:<version>:<key>" or "<namespace>:<version>:<group>:<group version>:<key>". Invalidating a
+# namespace or a group increase its version instead of deleting the keys, so it's one write on every backend and the
+# old keys are left to expire by their TTL.
+
+_MISSING = object()
+
+
+class NamespaceCache:
+    """
+    Cache of one namespace with its own TTL and version
+    """
+    def __init__(self, namespace: str, ttl: float, alias: str = 'default'):
+        """
+        :param namespace: Prefix of all keys, e.g. "leaderboard"
+        :param ttl: Default time to live of the keys in seconds
+        :param alias: Alias of the cache in CACHES setting
+        """
+        self.namespace = namespace
+        self.ttl = ttl
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _version_key(self, group: str = None) -> str:
+        return f'{self.namespace}:version' if group is None else f'{self.namespace}:version:{group}'
+
+    def _get_versions(self, *version_keys) -> list:
+        versions = self.cache.get_many(version_keys)
+        for version_key in version_keys:
+            if version_key not in versions:
+                # Start from the current time, so a version that is evicted from the cache doesn't restart at a
+                # number that the old keys may still use. add() keep the version that other worker just set.
+                self.cache.add(version_key, time.time_ns(), timeout=None)
+                versions[version_key] = self.cache.get(version_key)
+        return [versions[version_key] for version_key in version_keys]
+
+    def make_key(self, key, group: str = None) -> str:
+        """
+        Build the cache key with the current version
+        :param key: Key in the namespace, tuple is joined with ":"
+        :param group: Group in the namespace that can be invalidated separately
+        :return: Cache key
+        """
+        if isinstance(key, (tuple, list)):
+            key = ':'.join(str(k) for k in key)
+        if group is None:
+            version, = self._get_versions(self._version_key())
+            return f'{self.namespace}:{version}:{key}'
+        version, group_version = self._get_versions(self._version_key(), self._version_key(group))
+        return f'{self.namespace}:{version}:{group}:{group_version}:{key}'
+
+    def get(self, key, default=None, group: str = None):
+        """
+        Get value from cache
+        :param key: Key in the namespace
+        :param default: Value to return if key is not in cache
+        :param group: Group of the key
+        :return: Cached value
+        """
+        return self.cache.get(self.make_key(key, group), default)
+
+    def set(self, key, value, ttl: float = None, group: str = None):
+        """
+        Set value to cache
+        :param key: Key in the namespace
+        :param value: Value to cache, must be picklable
+        :param ttl: Time to live in seconds, use namespace's TTL if not provided
+        :param group: Group of the key
+        """
+        self.cache.set(self.make_key(key, group), value, timeout=self.ttl if ttl is None else ttl)
+
+    def get_or_set(self, key, default, ttl: float = None, group: str = None):
+        """
+        Get value from cache, or call default and cache its result if key is not in cache
+        :param key: Key in the namespace
+        :param default: Function that return the value
+        :param ttl: Time to live in seconds, use namespace's TTL if not provided
+        :param group: Group of the key
+        :return: Cached or new value
+        """
+        cache_key = self.make_key(key, group)
+        value = self.cache.get(cache_key, _MISSING)
+        if value is _MISSING:
+            value = default()
+            self.cache.set(cache_key, value, timeout=self.ttl if ttl is None else ttl)
+        return value
+
+    def delete(self, key, group: str = None):
+        """
+        Remove one key from cache
+        :param key: Key in the namespace
+        :param group: Group of the key
+        """
+        self.cache.delete(self.make_key(key, group))
+
+    def invalidate(self, group: str = None):
+        """
+        Invalidate all keys of the namespace, or only the keys of the group
+        :param group: Group to invalidate
+        """
+        version_key = self._version_key(group)
+        try:
+            self.cache.incr(version_key)
+        except ValueError:
+            self.cache.add(version_key, time.time_ns(), timeout=None)
+
+    def get_version(self) -> int:
+        """
+        Get current version of the namespace, it's changed every time the namespace is invalidated
+        :return: Version
+        """
+        return self._get_versions(self._version_key())[0]
+
+
+class SharedTTLCache:
+    """
+    Cache of knowledge base responses on the namespace cache, with the same interface as apps.seed_api.TTLCache.
+    Entry is (stored at, expire at, value, validators) in wall clock time since it's shared between processes.
+    Expired entry with validators is kept for stale_ttl seconds, so it can be revalidated with conditional request.
+    Key must be in (endpoint, id) format, the endpoint is the group of the key.
+    """
+    def __init__(self, namespace: str, ttl: float = 600, stale_ttl: float = 86400, alias: str = 'default'):
+        """
+        :param namespace: Namespace of the keys
+        :param ttl: Time to live of each entry in seconds
+        :param stale_ttl: Seconds that expired entry with validators is kept for revalidation
+        :param alias: Alias of the cache in CACHES setting
+        """
+        self.store = NamespaceCache(namespace, ttl, alias)
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        # Counters are of this process only
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+    def _get_entry(self, key):
+        return self.store.get(key[1:], group=key[0])
+
+    def _set_entry(self, key, value, ttl: float, validators: dict):
+        now = time.time()
+        self.store.set(key[1:], (now, now + ttl, value, validators or {}),
+                       ttl=ttl + self.stale_ttl if validators else ttl, group=key[0])
+
+    def _is_fresh(self, entry) -> bool:
+        stored_at, expire_at, _, _ = entry
+        if expire_at <= time.time():
+            return False
+        expired_before = self.store.get('expired_before')
+        return expired_before is None or stored_at > expired_before
+
+    def __contains__(self, key):
+        entry = self._get_entry(key)
+        return entry is not None and self._is_fresh(entry)
+
+    def get(self, key, default=None):
+        entry = self._get_entry(key)
+        if entry is None or not self._is_fresh(entry):
+            self.misses += 1
+            return default
+        self.hits += 1
+        return entry[2]
+
+    def get_stale(self, key):
+        entry = self._get_entry(key)
+        if entry is None or not entry[3]:
+            return None
+        return entry[2], entry[3]
+
+    def set(self, key, value, ttl: float = None, validators: dict = None):
+        self._set_entry(key, value, self.ttl if ttl is None else ttl, validators)
+
+    def revalidate(self, key, ttl: float = None, validators: dict = None):
+        entry = self._get_entry(key)
+        if entry is None:
+            return None
+        self._set_entry(key, entry[2], self.ttl if ttl is None else ttl, validators or entry[3])
+        self.revalidations += 1
+        return entry[2]
+
+    def expire(self):
+        self.store.set('expired_before', time.time(), ttl=self.ttl + self.stale_ttl)
+
+    def invalidate(self, key):
+        self.store.delete(key[1:], group=key[0])
+
+    def invalidate_endpoint(self, endpoint: str):
+        self.store.invalidate(group=endpoint)
+
+    def clear(self):
+        self.store.invalidate()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'revalidations': self.revalidations,
+            'size': None,
+            'max_size': None,
+            'ttl': self.ttl
+        }
@@ -3,7 +3,9 @@ import json
 from django import forms
 from django.core.validators import FileExtensionValidator
 
+from apps.image_storage import hash_file
 from apps.models import QuestionModel, ANSWER_MODE_CHOICES, QuestionCategory, TextCustomQuestion
+from apps.question_template import compile_question_template
 from apps.seed_api import get_all_class, get_property_type_from_class
 
 
@@ -117,9 +119,7 @@ class QuestionModelForm(forms.Form):
         all_property = get_property_type_from_class(main_class_id)
         all_property_name = [p['name'] for p in all_property]
         all_property_id = [str(p['id']) for p in all_property]
-        all_property_in_question = question.split('{')
-        all_property_in_question = [p.split('}')[0] for p in all_property_in_question if '}' in p]
-        for p in all_property_in_question:
+        for p in compile_question_template(question).property_names:
             if p not in all_property_name:
                 self.add_error('question', f'Property {p} does not exist in main class')
         # check answer property exist
@@ -380,8 +380,8 @@ class ImageCustomQuestionForm(forms.Form):
         if len(choices) < 4:
             self.add_error('choices', 'There must be more than 4 choices')
             return
-        # Check duplicate choice
-        if len(choices) != len(set(choices)):
+        # Check duplicate choice, the same image is stored only once so it's compared by content
+        if len(choices) != len(set(hash_file(c) for c in choices)):
             self.add_error('choices', 'Choices must be unique')
             return
         # Check duplicate answer
@@ -0,0 +1,112 @@
+import hashlib
+import logging
+import os
+from io import BytesIO
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+from decouple import config
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+logger = logging.getLogger(__name__)
+
+# Image of image custom question is stored once per content under its SHA-256 hash, so uploading the same image again
+# (e.g. editing a question re-upload all choices) reuse the stored image instead of saving a new copy.
+# Each image is stored as a downscaled and recompressed master and a smaller variant that is sent to the game client.
+CUSTOM_QUESTION_IMAGE_DIRECTORY = 'custom_question'
+# Master is downscaled to this size (in pixel, the longer side), it's kept to build the variant again if the size
+# below is changed
+CUSTOM_QUESTION_IMAGE_MAX_SIZE = 1024
+# Size of the variant that is used in the question choices
+CUSTOM_QUESTION_IMAGE_SIZE = config('CUSTOM_QUESTION_IMAGE_SIZE', default=512, cast=int)
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def hash_file(file) -> str:
+    """
+    Hash the content of the uploaded file in chunks, so a large upload is not read into memory at once
+    :param file: Django File or UploadedFile
+    :return: Hex digest of SHA-256 of the content
+    """
+    # The upload is hashed when the form is validated and again when it's stored
+    if getattr(file, 'content_hash', None):
+        return file.content_hash
+    digest = hashlib.sha256()
+    for chunk in file.chunks(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+    file.seek(0)
+    file.content_hash = digest.hexdigest()
+    return file.content_hash
+
+
+def has_transparency(image: Image.Image) -> bool:
+    return image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def encode_image(image: Image.Image) -> tuple:
+    """
+    Recompress the image, image with transparency is kept in PNG and other images are converted to progressive JPEG
+    :param image: PIL image
+    :return: Tuple of encoded image and file extension
+    """
+    output = BytesIO()
+    if has_transparency(image):
+        image.save(output, format='PNG', optimize=True)
+        return output.getvalue(), 'png'
+    image.convert('RGB').save(output, format='JPEG', quality=85, optimize=True, progressive=True)
+    return output.getvalue(), 'jpg'
+
+
+def get_image_name(content_hash: str, extension: str, size: int = None) -> str:
+    """
+    Get storage name of the image
+    :param content_hash: Hash of the uploaded content
+    :param extension: File extension
+    :param size: Size of the variant, the master is used if not provided
+    :return: Storage name of the image
+    """
+    suffix = f'_{size}' if size else ''
+    return f'{CUSTOM_QUESTION_IMAGE_DIRECTORY}/{content_hash}{suffix}.{extension}'
+
+
+def save_image(storage, name: str, content: bytes) -> str:
+    """
+    Save the image if it's not stored yet
+    :return: Storage name of the image
+    """
+    if storage.exists(name):
+        return name
+    return storage.save(name, ContentFile(content))
+
+
+def store_custom_question_image(file, storage=default_storage) -> str:
+    """
+    Store the uploaded image of image custom question, the same content is only processed and stored once
+    :param file: Uploaded image
+    :param storage: Storage to save the image in
+    :return: URL of the variant that is used in the question
+    """
+    content_hash = hash_file(file)
+    for extension in ('jpg', 'png'):
+        name = get_image_name(content_hash, extension, CUSTOM_QUESTION_IMAGE_SIZE)
+        if storage.exists(name):
+            return storage.url(name)
+
+    try:
+        image = Image.open(file)
+        image.load()
+    except (UnidentifiedImageError, OSError) as e:
+        # Keep the upload as it is rather than losing the choice
+        logger.warning(f'Failed to open image {file.name}, store it without processing: {e}')
+        file.seek(0)
+        extension = os.path.splitext(file.name)[1].lstrip('.').lower() or 'bin'
+        return storage.url(save_image(storage, get_image_name(content_hash, extension), file.read()))
+    image = ImageOps.exif_transpose(image)
+
+    image.thumbnail((CUSTOM_QUESTION_IMAGE_MAX_SIZE, CUSTOM_QUESTION_IMAGE_MAX_SIZE))
+    content, extension = encode_image(image)
+    save_image(storage, get_image_name(content_hash, extension), content)
+
+    image.thumbnail((CUSTOM_QUESTION_IMAGE_SIZE, CUSTOM_QUESTION_IMAGE_SIZE))
+    content, extension = encode_image(image)
+    return storage.url(save_image(storage, get_image_name(content_hash, extension, CUSTOM_QUESTION_IMAGE_SIZE), content))
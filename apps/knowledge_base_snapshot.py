@@ -0,0 +1,185 @@
+import logging
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.utils import timezone
+
+from apps.models import KnowledgeBaseClass, KnowledgeBasePropertyType, KnowledgeBaseInstance, \
+    KnowledgeBasePropertyValue, KnowledgeBaseSync
+from apps.question_pool import question_pool
+from apps.seed_api import KnowledgeBaseClient, KnowledgeBaseError, knowledge_base, IndexedInstance, PropertyValue, \
+    TTLCache, KNOWLEDGE_BASE_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Local snapshot of the knowledge base, filled by `python manage.py syncknowledgebase`. Once a sync is finished, seed
+# questions are generated from the snapshot tables only, so they don't depend on the knowledge base being up.
+
+
+def sync_knowledge_base(client: KnowledgeBaseClient = knowledge_base) -> KnowledgeBaseSync:
+    """
+    Pull all classes, property types and instances from the knowledge base and replace the snapshot with them.
+    The snapshot is replaced in one transaction, so generating question during the sync still read the old one.
+    :param client: Knowledge base client to pull from
+    :return: Finished KnowledgeBaseSync
+    """
+    # Don't copy the responses that are cached before the knowledge base is changed, the expired responses are
+    # revalidated so only the changed ones are downloaded again
+    client.cache.expire()
+    classes = {}
+    property_types = {}
+    instances = {}
+    property_values = []
+    for class_object in client.get_all_class():
+        class_id = int(class_object['id'])
+        classes[class_id] = KnowledgeBaseClass(id=class_id, name=class_object['name'])
+        for property_type in client.get_property_type_from_class(class_id):
+            property_types[int(property_type['id'])] = KnowledgeBasePropertyType(
+                id=int(property_type['id']),
+                knowledge_base_class_id=class_id,
+                name=property_type['name'],
+                raw_type=property_type['raw_type']
+            )
+        for instance in client.get_instance_from_class(class_id):
+            instance_id = int(instance['id'])
+            instances[instance_id] = KnowledgeBaseInstance(id=instance_id, knowledge_base_class_id=class_id,
+                                                           name=instance['name'])
+            for property_value in instance['property_values']:
+                property_type = property_value['property_type']
+                # Property type of the value may be inherited from other class
+                property_types.setdefault(int(property_type['id']), KnowledgeBasePropertyType(
+                    id=int(property_type['id']),
+                    name=property_type['name'],
+                    raw_type=property_type['raw_type']
+                ))
+                property_values.append(KnowledgeBasePropertyValue(
+                    knowledge_base_class_id=class_id,
+                    instance_id=instance_id,
+                    property_type_id=int(property_type['id']),
+                    raw_value=property_value['raw_value'] or ''
+                ))
+
+    with transaction.atomic():
+        # Cascade delete the property types, instances and property values of the old snapshot
+        KnowledgeBaseClass.objects.all().delete()
+        KnowledgeBasePropertyType.objects.all().delete()
+        KnowledgeBaseClass.objects.bulk_create(classes.values())
+        KnowledgeBasePropertyType.objects.bulk_create(property_types.values())
+        KnowledgeBaseInstance.objects.bulk_create(instances.values(), batch_size=1000)
+        KnowledgeBasePropertyValue.objects.bulk_create(property_values, batch_size=1000)
+        sync = KnowledgeBaseSync.objects.create(
+            finished_at=timezone.now(),
+            class_count=len(classes),
+            property_type_count=len(property_types),
+            instance_count=len(instances)
+        )
+    # Switch the seed question to the snapshot
+    knowledge_base_snapshot.clear_cache()
+    question_pool.invalidate()
+    logger.info(f'Knowledge base snapshot synced with {len(classes)} classes and {len(instances)} instances')
+    return sync
+
+
+def clear_knowledge_base_snapshot():
+    """
+    Delete the snapshot, seed questions are generated from the knowledge base API again
+    """
+    with transaction.atomic():
+        KnowledgeBaseClass.objects.all().delete()
+        KnowledgeBasePropertyType.objects.all().delete()
+        KnowledgeBaseSync.objects.all().delete()
+    knowledge_base_snapshot.clear_cache()
+    question_pool.invalidate()
+
+
+class KnowledgeBaseSnapshot:
+    """
+    Read the snapshot tables in the same format as the knowledge base API, see apps.seed_api.KnowledgeBaseClient
+    """
+    def __init__(self, cache_size: int = KNOWLEDGE_BASE_CACHE_SIZE):
+        """
+        :param cache_size: Number of instance lists to keep in the process
+        """
+        # Instance lists are built once per class and sync, the key include the sync ID so other worker's sync is
+        # picked up when the question pool see it. The snapshot doesn't change until the next sync, so the TTL is long.
+        self.cache = TTLCache(max_size=cache_size, ttl=86400)
+
+    def clear_cache(self):
+        self.cache.clear()
+
+    def is_available(self) -> bool:
+        return True
+
+    def get_instance_from_class(self, class_id):
+        """
+        Get instance from class
+        :param class_id: ID of class
+        :return: Instance list in JSON format
+        """
+        return [instance.to_json() for instance in self.get_indexed_instances_from_class(class_id)]
+
+    def get_indexed_instances_from_class(self, class_id):
+        """
+        Get instance from class
+        :param class_id: ID of class
+        :return: List of IndexedInstance
+        """
+        key = (question_pool.get_knowledge_base_sync_id(), str(class_id))
+        instances = self.cache.get(key)
+        if instances is None:
+            instances = self._build_indexed_instances(class_id)
+            self.cache.set(key, instances)
+        return instances
+
+    def _build_indexed_instances(self, class_id) -> list:
+        property_values = {}
+        values = KnowledgeBasePropertyValue.objects.filter(knowledge_base_class_id=class_id).values_list(
+            'instance_id', 'property_type_id', 'property_type__name', 'property_type__raw_type', 'raw_value'
+        )
+        for instance_id, property_type_id, name, raw_type, raw_value in values:
+            property_values.setdefault(instance_id, []).append(PropertyValue(property_type_id, name, raw_type, raw_value))
+        return [
+            IndexedInstance(instance_id, name, int(class_id), property_values.get(instance_id, []))
+            for instance_id, name in
+            KnowledgeBaseInstance.objects.filter(knowledge_base_class_id=class_id).values_list('id', 'name')
+        ]
+
+    def get_instance_names(self, instance_ids) -> dict:
+        """
+        Get name of multiple instances by ID
+        :param instance_ids: List of instance ID
+        :return: Dict of instance ID (as string) to instance name
+        """
+        unique_ids = list(dict.fromkeys(str(i) for i in instance_ids))
+        names = {
+            str(instance_id): name for instance_id, name in
+            KnowledgeBaseInstance.objects.filter(id__in=[int(i) for i in unique_ids]).values_list('id', 'name')
+        }
+        missing_ids = [i for i in unique_ids if i not in names]
+        if missing_ids:
+            raise KnowledgeBaseError(f'Instance {", ".join(missing_ids)} not found in knowledge base snapshot')
+        return names
+
+
+class AsyncKnowledgeBaseSnapshot:
+    """
+    Async interface of KnowledgeBaseSnapshot, see apps.seed_api.AsyncKnowledgeBaseClient
+    """
+    def __init__(self, snapshot: KnowledgeBaseSnapshot):
+        self.snapshot = snapshot
+
+    def is_available(self) -> bool:
+        return True
+
+    async def get_instance_from_class(self, class_id):
+        return await sync_to_async(self.snapshot.get_instance_from_class)(class_id)
+
+    async def get_indexed_instances_from_class(self, class_id):
+        return await sync_to_async(self.snapshot.get_indexed_instances_from_class)(class_id)
+
+    async def get_instance_names(self, instance_ids) -> dict:
+        return await sync_to_async(self.snapshot.get_instance_names)(instance_ids)
+
+
+knowledge_base_snapshot = KnowledgeBaseSnapshot()
+async_knowledge_base_snapshot = AsyncKnowledgeBaseSnapshot(knowledge_base_snapshot)
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from email.utils import formatdate
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+import requests
+
+from apps.seed_api import KnowledgeBaseClient, TTLCache, KNOWLEDGE_BASE_CACHE_SIZE, KNOWLEDGE_BASE_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+# Local stand-in for the knowledge base API used to test and benchmark seed questions without the real server.
+# Responses are stored as {request path: JSON response}, so a generated dataset and a recorded fixture are served the
+# same way. Run it with `python manage.py runknowledgebasestub`.
+
+# Property types of each generated class, ID of the property type is class ID * 10 + index
+PROPERTY_TYPES = [
+    ('name', 'string'),
+    ('code', 'string'),
+    ('picture', 'image'),
+    ('related', 'instance'),
+]
+
+
+def get_property_type_id(class_id: int, property_name: str) -> int:
+    """
+    Get ID of the property type in the generated dataset
+    :param class_id: Class ID
+    :param property_name: Property name in PROPERTY_TYPES
+    :return: Property type ID
+    """
+    return class_id * 10 + [name for name, raw_type in PROPERTY_TYPES].index(property_name) + 1
+
+
+def generate_dataset(class_count: int = 3, instance_per_class: int = 50, seed: int = 0) -> dict:
+    """
+    Generate knowledge base responses. Each class has instances with a name, a unique code, a picture and a relation
+    to an instance of the next class.
+    :param class_count: Number of classes
+    :param instance_per_class: Number of instances in each class
+    :param seed: Random seed of the relations
+    :return: Dict of request path to JSON response
+    """
+    rand = random.Random(seed)
+    classes = [{'id': c, 'name': f'Class {c}'} for c in range(1, class_count + 1)]
+    instance_ids = {
+        c['id']: list(range((c['id'] - 1) * instance_per_class + 1, c['id'] * instance_per_class + 1)) for c in classes
+    }
+    responses = {'/api/class': {'class': classes}}
+    for class_object in classes:
+        class_id = class_object['id']
+        property_types = [
+            {'id': get_property_type_id(class_id, name), 'name': name, 'raw_type': raw_type}
+            for name, raw_type in PROPERTY_TYPES
+        ]
+        related_class_id = class_id % class_count + 1
+        instances = []
+        for instance_id in instance_ids[class_id]:
+            raw_values = {
+                'name': f"{class_object['name']} instance {instance_id}",
+                'code': f'C{instance_id:06d}',
+                'picture': f'/media/instance/{instance_id}.png',
+                'related': str(rand.choice(instance_ids[related_class_id])),
+            }
+            instance = {
+                'id': instance_id,
+                'name': raw_values['name'],
+                'class': class_id,
+                'property_values': [
+                    {'property_type': property_type, 'raw_value': raw_values[property_type['name']]}
+                    for property_type in property_types
+                ]
+            }
+            instances.append(instance)
+            responses[f'/api/instance/{instance_id}'] = instance
+        responses[f'/api/class?class={class_id}'] = {'class': class_object}
+        responses[f'/api/property_type?class={class_id}'] = {'property_type': property_types}
+        responses[f'/api/instance?class={class_id}'] = {'instance': instances}
+    return responses
+
+
+def normalize_path(path: str) -> str:
+    """
+    Normalize request path so the query string order doesn't matter
+    :param path: Request path with query string
+    :return: Normalized path
+    """
+    url = urlsplit(path)
+    query = urlencode(sorted(parse_qsl(url.query)))
+    return url.path.rstrip('/') + (f'?{query}' if query else '')
+
+
+class KnowledgeBaseStubServer:
+    """
+    HTTP server that serve knowledge base responses in a background thread
+    """
+    def __init__(self, responses: dict = None, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0,
+                 upstream: str = None):
+        """
+        :param responses: Dict of request path to JSON response, generated dataset is used if not provided
+        :param host: Host to listen on
+        :param port: Port to listen on, random free port if 0
+        :param latency: Seconds to wait before each response
+        :param upstream: URL of the real knowledge base, unknown path is fetched from it and recorded
+        """
+        self.responses = {normalize_path(k): v for k, v in (responses if responses is not None else generate_dataset()).items()}
+        self.latency = latency
+        self.upstream = upstream.rstrip('/') if upstream else None
+        self.request_count = 0
+        self.not_modified_count = 0
+        # All responses are treated as modified when the server is started
+        self.last_modified = formatdate(time.time(), usegmt=True)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs):
+        """
+        Create the server that replay responses recorded by save()
+        :param path: Path of the JSON file
+        """
+        with open(path) as f:
+            return cls(responses=json.load(f), **kwargs)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def save(self, path: str):
+        """
+        Save the responses, include the ones recorded from the upstream
+        :param path: Path of the JSON file
+        """
+        with self._lock:
+            responses = dict(self.responses)
+        with open(path, 'w') as f:
+            json.dump(responses, f)
+
+    def get_response(self, path: str):
+        """
+        Get response of the request path
+        :param path: Request path with query string
+        :return: Tuple of (status code, JSON response)
+        """
+        path = normalize_path(path)
+        with self._lock:
+            self.request_count += 1
+            response = self.responses.get(path)
+        if response is not None:
+            return 200, response
+        if self.upstream is None:
+            return 404, {'message': 'Not found'}
+        upstream_response = requests.get(f'{self.upstream}{path}', timeout=30)
+        if upstream_response.status_code != 200:
+            return upstream_response.status_code, {'message': 'Upstream error'}
+        response = upstream_response.json()
+        with self._lock:
+            self.responses[path] = response
+        return 200, response
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if stub.latency:
+                    time.sleep(stub.latency)
+                status, response = stub.get_response(self.path)
+                body = json.dumps(response).encode()
+                if status == 200:
+                    etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                    if_none_match = self.headers.get('If-None-Match')
+                    if (if_none_match == etag if if_none_match else
+                            self.headers.get('If-Modified-Since') == stub.last_modified):
+                        with stub._lock:
+                            stub.not_modified_count += 1
+                        self.send_response(304)
+                        self.send_header('ETag', etag)
+                        self.end_headers()
+                        return
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                if status == 200:
+                    self.send_header('ETag', etag)
+                    self.send_header('Last-Modified', stub.last_modified)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(f'Knowledge base stub: {format % args}')
+
+        return Handler
+
+    def start(self):
+        """
+        Start serving in a background thread
+        """
+        self._thread = threading.Thread(target=self.server.serve_forever, name='knowledge-base-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def create_stub_client(stub: KnowledgeBaseStubServer, **kwargs) -> KnowledgeBaseClient:
+    """
+    Create a knowledge base client of the stub with its own in-process cache. The shared client is not used since its
+    cache is shared with the workers and the cache key doesn't include the URL.
+    :param stub: KnowledgeBaseStubServer
+    :param kwargs: Other arguments of KnowledgeBaseClient
+    :return: KnowledgeBaseClient
+    """
+    cache = TTLCache(max_size=KNOWLEDGE_BASE_CACHE_SIZE, ttl=KNOWLEDGE_BASE_CACHE_TTL)
+    return KnowledgeBaseClient(base_url=stub.url, cache=cache, **kwargs)
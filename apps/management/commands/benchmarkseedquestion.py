@@ -0,0 +1,67 @@
+import statistics
+import time
+
+from django.core.management import BaseCommand
+
+from apps.knowledge_base_stub import KnowledgeBaseStubServer, generate_dataset, get_property_type_id, \
+    create_stub_client
+from apps.models import QuestionModel, QuestionCategory, GameMode
+from apps.question import generate_single_right_question, generate_text_question
+
+
+class Command(BaseCommand):
+    help = 'Measure seed question generation against the local knowledge base stub'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=100, help='Number of questions to generate for each answer type')
+        parser.add_argument('--classes', type=int, default=3, help='Number of generated classes')
+        parser.add_argument('--instances', type=int, default=50, help='Number of generated instances in each class')
+        parser.add_argument('--latency', type=float, default=0.0, help='Seconds the stub wait before each response')
+        parser.add_argument('--replay', help='Serve responses recorded in this JSON file instead of generated dataset')
+        parser.add_argument('--cold', action='store_true', help='Clear the knowledge base cache before each question')
+
+    def handle(self, *args, **options):
+        if options['replay']:
+            stub = KnowledgeBaseStubServer.from_file(options['replay'], latency=options['latency'])
+        else:
+            stub = KnowledgeBaseStubServer(
+                generate_dataset(options['classes'], options['instances']), latency=options['latency']
+            )
+        # The question is not saved, generator only read its fields
+        category = QuestionCategory(name='Benchmark')
+        game_mode = GameMode(name='Benchmark', allow_answer_mode='single_right, text')
+        benchmarks = [
+            (f'single_right ({answer})', 'single_right', answer) for answer in ['code', 'picture', 'related']
+        ] + [('text', 'text', 'code')]
+        # The shared client is not touched, its cache is shared with the running workers
+        client = create_stub_client(stub)
+        with stub:
+            for name, answer_mode, answer_property in benchmarks:
+                question = QuestionModel(
+                    main_class_id=1,
+                    question='Which one belongs to {name}?',
+                    answer_property_id=get_property_type_id(1, answer_property),
+                    answer_mode=answer_mode,
+                    difficulty_level='easy',
+                    category=category
+                )
+                client.invalidate_cache()
+                request_count = stub.request_count
+                durations = []
+                for i in range(options['count']):
+                    if options['cold']:
+                        client.invalidate_cache()
+                    start = time.perf_counter()
+                    if answer_mode == 'single_right':
+                        generate_single_right_question(question, game_mode, seed_knowledge_base=client)
+                    else:
+                        generate_text_question(question, game_mode, seed_knowledge_base=client)
+                    durations.append((time.perf_counter() - start) * 1000)
+                durations.sort()
+                self.stdout.write(
+                    f'{name}: mean {statistics.mean(durations):.2f} ms, '
+                    f'p50 {durations[len(durations) // 2]:.2f} ms, '
+                    f'p95 {durations[min(len(durations) - 1, int(len(durations) * 0.95))]:.2f} ms, '
+                    f'max {durations[-1]:.2f} ms, '
+                    f'{(stub.request_count - request_count) / len(durations):.2f} requests per question'
+                )
@@ -0,0 +1,15 @@
+from django.core.management import BaseCommand
+from django.db.models import F
+
+from users.avatar import process_avatar
+from users.models import Profile
+
+
+class Command(BaseCommand):
+    help = 'Build the avatar thumbnails of the profiles that their thumbnails are not built yet'
+
+    def handle(self, *args, **options):
+        profile_ids = list(Profile.objects.exclude(avatar_thumbnail=F('avatar')).values_list('id', flat=True))
+        for profile_id in profile_ids:
+            process_avatar(profile_id)
+        self.stdout.write(self.style.SUCCESS(f'Avatar thumbnails built for {len(profile_ids)} profiles'))
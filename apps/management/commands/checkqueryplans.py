@@ -0,0 +1,207 @@
+import re
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from apps.models import Game, GameQuestion, UserCategoryWeight, QuestionModel, TextCustomQuestion, \
+    ImageCustomQuestion, LeaderboardEntry, KnowledgeBaseInstance, KnowledgeBasePropertyValue, QuestionCategory, \
+    GameMode, QuestionHistory, KnowledgeBaseClass, KnowledgeBasePropertyType
+
+# "Seq Scan on table" in PostgreSQL, "SCAN table" in SQLite (index scan is "SEARCH table USING INDEX" or
+# "SCAN table USING INDEX" in SQLite)
+SEQUENTIAL_SCAN_PATTERNS = [
+    re.compile(r'Seq Scan on (\w+)'),
+    re.compile(r'\bSCAN (\w+)(?! USING (?:COVERING )?INDEX)(?:\s|$)'),
+]
+
+
+def get_hot_queries() -> list:
+    """
+    Get the queries that run on every game request, the parameters are placeholders since only the plan is checked
+    :return: List of (name, queryset)
+    """
+    queries = [
+        ('running game', Game.objects.filter(user_id=1, finished=False)),
+        ('unanswered question', GameQuestion.objects.filter(game_id=1, answered=False)),
+        ('wrong answer', GameQuestion.objects.filter(game_id=1, answered=True, is_true=False)),
+        ('user weight', UserCategoryWeight.objects.filter(user_id=1)),
+        ('user category weight', UserCategoryWeight.objects.filter(user_id=1, category_id=1)),
+        ('leaderboard', LeaderboardEntry.objects.order_by('-best_score', 'user_id')[:10]),
+        ('game history page', Game.objects.filter(
+            Q(end_time__lt=timezone.now()) | Q(end_time=timezone.now(), id__lt=1),
+            user_id=1, finished=True, completed=True, end_time__isnull=False
+        ).order_by('-end_time', '-id')[:21]),
+        ('snapshot instance', KnowledgeBaseInstance.objects.filter(knowledge_base_class_id=1)),
+        ('snapshot property value', KnowledgeBasePropertyValue.objects.filter(knowledge_base_class_id=1, property_type_id=1)),
+    ]
+    for model in [QuestionModel, TextCustomQuestion, ImageCustomQuestion]:
+        queries.append((
+            f'{model.__name__} by category',
+            model.objects.filter(category_id=1, difficulty_level='easy', active=True)
+        ))
+    return queries
+
+
+def seed_rows(rows: int) -> list:
+    """
+    Insert rows in the shape of a production database into the tables of the hot queries, so the planner choose the
+    plan that it would choose in production instead of scanning a near-empty table. Must be run in a transaction that
+    is rolled back.
+    :param rows: Number of games, game questions, question histories, snapshot instances and property values, other
+    tables get a proportional number of rows
+    :return: List of seeded models
+    """
+    now = timezone.now()
+    prefix = uuid.uuid4().hex[:8]
+    users = User.objects.bulk_create(
+        User(username=f'queryplan_{prefix}_{i}', password='!') for i in range(max(rows // 10, 1))
+    )
+    categories = QuestionCategory.objects.bulk_create(QuestionCategory(name=f'Query plan {i}') for i in range(10))
+    game_mode = GameMode.objects.create(name='Query plan', allow_answer_mode='single_right')
+
+    # Most games are finished, each user has at most one running game
+    games = Game.objects.bulk_create(
+        Game(user=users[i % len(users)], score=i % 1000, finished=i >= len(users), completed=i % 3 != 0,
+             end_time=now - timedelta(minutes=i) if i >= len(users) else None)
+        for i in range(rows)
+    )
+    histories = QuestionHistory.objects.bulk_create(
+        QuestionHistory(question_mode='text_custom_question', category=categories[i % len(categories)],
+                        difficulty_level='easy', question='Query plan', type='single_right')
+        for i in range(rows)
+    )
+    GameQuestion.objects.bulk_create(
+        GameQuestion(game=games[i % len(games)], question=history, game_mode=game_mode, answered=i >= len(users),
+                     is_true=i % 2 == 0)
+        for i, history in enumerate(histories)
+    )
+    UserCategoryWeight.objects.bulk_create(
+        UserCategoryWeight(user=user, category=category) for user in users for category in categories
+    )
+    LeaderboardEntry.objects.bulk_create(LeaderboardEntry(user=user, best_score=i) for i, user in enumerate(users))
+
+    difficulty_levels = ['easy', 'medium', 'hard']
+    question_count = max(rows // 10, 1)
+    QuestionModel.objects.bulk_create(
+        QuestionModel(main_class_id=1, question='Query plan {name}', answer_property_id=1, answer_mode='single_right',
+                      difficulty_level=difficulty_levels[i % 3], category=categories[i % len(categories)])
+        for i in range(question_count)
+    )
+    for model in [TextCustomQuestion, ImageCustomQuestion]:
+        model.objects.bulk_create(
+            model(question='Query plan', difficulty_level=difficulty_levels[i % 3],
+                  category=categories[i % len(categories)])
+            for i in range(question_count)
+        )
+
+    # Snapshot uses the knowledge base IDs, start after the existing ones
+    def next_id(model):
+        return (model.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1
+
+    class_id = next_id(KnowledgeBaseClass)
+    classes = KnowledgeBaseClass.objects.bulk_create(
+        KnowledgeBaseClass(id=class_id + i, name=f'Query plan {i}') for i in range(10)
+    )
+    property_type_id = next_id(KnowledgeBasePropertyType)
+    property_types = KnowledgeBasePropertyType.objects.bulk_create(
+        KnowledgeBasePropertyType(id=property_type_id + i, knowledge_base_class=classes[i % len(classes)],
+                                  name=f'property_{i}', raw_type='string')
+        for i in range(50)
+    )
+    instance_id = next_id(KnowledgeBaseInstance)
+    instances = KnowledgeBaseInstance.objects.bulk_create(
+        KnowledgeBaseInstance(id=instance_id + i, knowledge_base_class=classes[i % len(classes)], name=f'Instance {i}')
+        for i in range(rows)
+    )
+    KnowledgeBasePropertyValue.objects.bulk_create(
+        KnowledgeBasePropertyValue(knowledge_base_class_id=instance.knowledge_base_class_id, instance=instance,
+                                   property_type=property_types[i % len(property_types)], raw_value=str(i))
+        for i, instance in enumerate(instances)
+    )
+    return [User, QuestionCategory, GameMode, Game, QuestionHistory, GameQuestion, UserCategoryWeight,
+            LeaderboardEntry, QuestionModel, TextCustomQuestion, ImageCustomQuestion, KnowledgeBaseClass,
+            KnowledgeBasePropertyType, KnowledgeBaseInstance, KnowledgeBasePropertyValue]
+
+
+def analyze_tables(models: list):
+    """
+    Update the planner statistics of the tables, so the plan is chosen from the seeded rows
+    :param models: List of model
+    """
+    if connection.vendor not in ('postgresql', 'sqlite'):
+        return
+    with connection.cursor() as cursor:
+        for model in models:
+            cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+
+
+def find_sequential_scans(plan: str) -> list:
+    """
+    Find tables that are read by sequential scan in the query plan
+    :param plan: Query plan from QuerySet.explain()
+    :return: List of table name
+    """
+    tables = []
+    for pattern in SEQUENTIAL_SCAN_PATTERNS:
+        tables.extend(pattern.findall(plan))
+    return tables
+
+
+class Command(BaseCommand):
+    help = 'Run EXPLAIN on the hot game queries and fail if any of them use sequential scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--analyze', action='store_true',
+            help='Run EXPLAIN ANALYZE (PostgreSQL only), the queries are executed'
+        )
+        parser.add_argument(
+            '--rows', type=int, default=0,
+            help='Number of rows to seed in the hot tables before EXPLAIN, e.g. 10000. The rows are rolled back, but '
+                 'the tables are locked and ANALYZE-d during the run, so never seed a production database'
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Allow seeding rows when DEBUG is off'
+        )
+        parser.add_argument(
+            '--disable-seqscan', action='store_true',
+            help='Discourage sequential scan in the planner (PostgreSQL only), use it to check that an index can serve '
+                 'the query on a small or unseeded dataset where sequential scan is cheaper'
+        )
+
+    def handle(self, *args, **options):
+        is_postgresql = connection.vendor == 'postgresql'
+        explain_options = {'analyze': True} if options['analyze'] and is_postgresql else {}
+        if options['rows'] > 0 and not settings.DEBUG and not options['force']:
+            raise CommandError('Refuse to seed rows when DEBUG is off, it must not run against production. '
+                               'Pass --force to seed anyway.')
+        failed = []
+        with transaction.atomic():
+            try:
+                if options['rows'] > 0:
+                    analyze_tables(seed_rows(options['rows']))
+                if options['disable_seqscan'] and is_postgresql:
+                    with connection.cursor() as cursor:
+                        cursor.execute('SET LOCAL enable_seqscan = off')
+                for name, queryset in get_hot_queries():
+                    plan = queryset.explain(**explain_options)
+                    tables = find_sequential_scans(plan)
+                    if tables:
+                        failed.append(name)
+                        self.stdout.write(self.style.ERROR(f'{name}: sequential scan on {", ".join(tables)}'))
+                    else:
+                        self.stdout.write(self.style.SUCCESS(f'{name}: OK'))
+                    if options['verbosity'] > 1:
+                        self.stdout.write(plan)
+            finally:
+                # Nothing that is seeded or set here is committed
+                transaction.set_rollback(True)
+        if failed:
+            raise CommandError(f'Sequential scan in {len(failed)} hot queries: {", ".join(failed)}')
@@ -0,0 +1,77 @@
+import socket
+from urllib.parse import urlsplit
+
+from decouple import config
+from django.core.management import BaseCommand, CommandError
+
+from apps.knowledge_base_stub import KnowledgeBaseStubServer, generate_dataset
+
+
+def resolve_host(host: str) -> str:
+    try:
+        return socket.gethostbyname(host)
+    except OSError:
+        return host
+
+
+def is_same_address(url: str, host: str, port: int) -> bool:
+    """
+    Check that the URL point to the address that the stub listen on
+    :param url: URL of the upstream
+    :param host: Host that the stub listen on, all interfaces if it's empty or 0.0.0.0
+    :param port: Port that the stub listen on
+    :return: True if requests to the URL would go to the stub itself
+    """
+    upstream = urlsplit(url)
+    upstream_port = upstream.port or (443 if upstream.scheme == 'https' else 80)
+    if upstream_port != port:
+        return False
+    if host in ('', '0.0.0.0'):
+        return upstream.hostname in ('localhost', socket.gethostname()) or resolve_host(upstream.hostname).startswith('127.')
+    return resolve_host(upstream.hostname) == resolve_host(host)
+
+
+class Command(BaseCommand):
+    help = 'Run a local stand-in of the knowledge base API with generated or recorded responses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='Host to listen on')
+        parser.add_argument('--port', type=int, default=8000, help='Port to listen on')
+        parser.add_argument('--classes', type=int, default=3, help='Number of generated classes')
+        parser.add_argument('--instances', type=int, default=50, help='Number of generated instances in each class')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the generated dataset')
+        parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before each response')
+        parser.add_argument('--replay', help='Serve responses recorded in this JSON file instead of generated dataset')
+        parser.add_argument('--record', help='Fetch unknown requests from the upstream and save them to this JSON file on exit')
+        parser.add_argument('--upstream', default=config('KNOWLEDGE_BASE_URL', default='http://localhost:8000'),
+                            help='URL of the real knowledge base to record from')
+
+    def handle(self, *args, **options):
+        kwargs = {
+            'host': options['host'],
+            'port': options['port'],
+            'latency': options['latency'],
+        }
+        if options['record']:
+            # The default port and upstream are both the KNOWLEDGE_BASE_URL port, so the stub would proxy to itself
+            if is_same_address(options['upstream'], options['host'], options['port']):
+                raise CommandError(f'Upstream {options["upstream"]} is the address of the stub itself, '
+                                   f'run the stub on other port with --port')
+            kwargs['upstream'] = options['upstream']
+        # Recording continue from the replayed file if both are provided
+        if options['replay']:
+            stub = KnowledgeBaseStubServer.from_file(options['replay'], **kwargs)
+        elif options['record']:
+            stub = KnowledgeBaseStubServer(responses={}, **kwargs)
+        else:
+            stub = KnowledgeBaseStubServer(generate_dataset(options['classes'], options['instances'], options['seed']), **kwargs)
+        self.stdout.write(f'Knowledge base stub is running at {stub.url} with {len(stub.responses)} responses')
+        try:
+            stub.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stub.server.server_close()
+            if options['record']:
+                stub.save(options['record'])
+                self.stdout.write(f'Saved {len(stub.responses)} responses to {options["record"]}')
@@ -0,0 +1,30 @@
+from django.core.management import BaseCommand, CommandError
+
+from apps.knowledge_base_snapshot import sync_knowledge_base, clear_knowledge_base_snapshot
+from apps.seed_api import KnowledgeBaseClient, KnowledgeBaseError, knowledge_base
+
+
+class Command(BaseCommand):
+    help = 'Mirror the knowledge base into the local snapshot tables that seed questions are generated from'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='URL of the knowledge base, KNOWLEDGE_BASE_URL is used if not provided')
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Delete the snapshot, seed questions are generated from the knowledge base API again'
+        )
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            clear_knowledge_base_snapshot()
+            self.stdout.write(self.style.SUCCESS('Knowledge base snapshot cleared'))
+            return
+        client = KnowledgeBaseClient(base_url=options['url']) if options['url'] else knowledge_base
+        try:
+            sync = sync_knowledge_base(client)
+        except KnowledgeBaseError as e:
+            raise CommandError(f'Failed to sync knowledge base, the old snapshot is kept: {e}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Knowledge base snapshot synced with {sync.class_count} classes, {sync.property_type_count} property types '
+            f'and {sync.instance_count} instances'
+        ))
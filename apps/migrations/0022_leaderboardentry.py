@@ -0,0 +1,41 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:18
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max, Q
+
+
+def create_leaderboard_entry(apps, schema_editor):
+    User = apps.get_model('auth', 'User')
+    LeaderboardEntry = apps.get_model('apps', 'LeaderboardEntry')
+    users = User.objects.annotate(
+        best_score=Max('game__score', filter=Q(game__finished=True, game__completed=True))
+    )
+    LeaderboardEntry.objects.bulk_create([
+        LeaderboardEntry(user_id=user.id, best_score=max(user.best_score or 0, 0)) for user in users
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0021_gamemode_active_imagecustomquestion_active_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('best_score', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-best_score', 'user'], name='leaderboard_rank_idx')],
+            },
+        ),
+        migrations.RunPython(create_leaderboard_entry, migrations.RunPython.noop)
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:32
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def backfill_game_accumulator(apps, schema_editor):
+    Game = apps.get_model('apps', 'Game')
+    games = Game.objects.annotate(
+        wrong=Count('gamequestion', filter=Q(gamequestion__answered=True, gamequestion__is_true=False))
+    ).filter(wrong__gt=0)
+    for game in games:
+        Game.objects.filter(pk=game.pk).update(wrong_count=game.wrong)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0022_leaderboardentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='wrong_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_game_accumulator, migrations.RunPython.noop)
+    ]
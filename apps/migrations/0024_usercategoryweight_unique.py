@@ -0,0 +1,31 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:40
+
+from django.db import migrations, models
+from django.db.models import Max, Count
+
+
+def remove_duplicate_weight(apps, schema_editor):
+    UserCategoryWeight = apps.get_model('apps', 'UserCategoryWeight')
+    duplicates = UserCategoryWeight.objects.values('user_id', 'category_id').annotate(
+        latest=Max('id'), total=Count('id')
+    ).filter(total__gt=1)
+    for duplicate in duplicates:
+        # Keep the latest row since it's the one updated last
+        UserCategoryWeight.objects.filter(
+            user_id=duplicate['user_id'], category_id=duplicate['category_id']
+        ).exclude(id=duplicate['latest']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0023_game_wrong_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_weight, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='usercategoryweight',
+            constraint=models.UniqueConstraint(fields=('user', 'category'), name='unique_user_category_weight'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0024_usercategoryweight_unique'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['user', 'finished'], name='game_user_finished_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gamequestion',
+            index=models.Index(fields=['game', 'answered', 'is_true'], name='game_question_answer_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='imagecustomquestion',
+            index=models.Index(fields=['category', 'difficulty_level', 'active'], name='image_question_select_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='questionmodel',
+            index=models.Index(fields=['category', 'difficulty_level', 'active'], name='question_model_select_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='textcustomquestion',
+            index=models.Index(fields=['category', 'difficulty_level', 'active'], name='text_question_select_idx'),
+        ),
+    ]
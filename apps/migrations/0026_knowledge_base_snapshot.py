@@ -0,0 +1,62 @@
+# Generated by Django 5.0.4 on 2026-10-18 20:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0025_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KnowledgeBaseClass',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='KnowledgeBaseSync',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('class_count', models.IntegerField(default=0)),
+                ('property_type_count', models.IntegerField(default=0)),
+                ('instance_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='KnowledgeBaseInstance',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255)),
+                ('knowledge_base_class', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='apps.knowledgebaseclass')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='KnowledgeBasePropertyType',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255)),
+                ('raw_type', models.CharField(max_length=100)),
+                ('knowledge_base_class', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='apps.knowledgebaseclass')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='KnowledgeBasePropertyValue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('raw_value', models.TextField(blank=True, default='')),
+                ('instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='apps.knowledgebaseinstance')),
+                ('knowledge_base_class', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='apps.knowledgebaseclass')),
+                ('property_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='apps.knowledgebasepropertytype')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['knowledge_base_class', 'property_type'], name='kb_value_class_property_idx')],
+            },
+        ),
+    ]
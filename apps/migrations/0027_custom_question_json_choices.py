@@ -0,0 +1,86 @@
+# Generated by Django 5.0.4 on 2026-10-18 21:30
+
+import ast
+import json
+
+from django.db import migrations, models
+
+CUSTOM_QUESTION_MODELS = ['TextCustomQuestion', 'ImageCustomQuestion']
+
+
+def parse_list(text):
+    """
+    Parse the choices or answer that was saved as JSON text (json.dumps) or Python list text (str(list))
+    """
+    if not text:
+        return []
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return ast.literal_eval(text)
+
+
+def text_to_json(apps, schema_editor):
+    for model_name in CUSTOM_QUESTION_MODELS:
+        model = apps.get_model('apps', model_name)
+        questions = list(model.objects.all())
+        for question in questions:
+            question.choices = parse_list(question.choices_text)
+            question.answer = parse_list(question.answer_text)
+        model.objects.bulk_update(questions, ['choices', 'answer'], batch_size=500)
+
+
+def json_to_text(apps, schema_editor):
+    for model_name in CUSTOM_QUESTION_MODELS:
+        model = apps.get_model('apps', model_name)
+        questions = list(model.objects.all())
+        for question in questions:
+            question.choices_text = json.dumps(question.choices)
+            question.answer_text = json.dumps(question.answer)
+        model.objects.bulk_update(questions, ['choices_text', 'answer_text'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0026_knowledge_base_snapshot'),
+    ]
+
+    # Text can't be cast to JSON in the database since some rows are saved as Python list text, so the old columns are
+    # renamed and the values are parsed into new JSON columns
+    operations = [
+        migrations.RenameField(model_name='textcustomquestion', old_name='choices', new_name='choices_text'),
+        migrations.RenameField(model_name='textcustomquestion', old_name='answer', new_name='answer_text'),
+        migrations.RenameField(model_name='imagecustomquestion', old_name='choices', new_name='choices_text'),
+        migrations.RenameField(model_name='imagecustomquestion', old_name='answer', new_name='answer_text'),
+        migrations.AddField(
+            model_name='textcustomquestion',
+            name='choices',
+            field=models.JSONField(default=list),
+        ),
+        migrations.AddField(
+            model_name='textcustomquestion',
+            name='answer',
+            field=models.JSONField(default=list),
+        ),
+        migrations.AddField(
+            model_name='imagecustomquestion',
+            name='choices',
+            field=models.JSONField(default=list),
+        ),
+        migrations.AddField(
+            model_name='imagecustomquestion',
+            name='answer',
+            field=models.JSONField(default=list),
+        ),
+        migrations.RunPython(text_to_json, json_to_text),
+        # Reversing RemoveField add the column back before json_to_text fill it, so the old columns need a default
+        migrations.AlterField(model_name='textcustomquestion', name='choices_text', field=models.TextField(default='')),
+        migrations.AlterField(model_name='textcustomquestion', name='answer_text', field=models.TextField(default='')),
+        migrations.AlterField(model_name='imagecustomquestion', name='choices_text', field=models.TextField(default='')),
+        migrations.AlterField(model_name='imagecustomquestion', name='answer_text', field=models.TextField(default='')),
+        migrations.RemoveField(model_name='textcustomquestion', name='choices_text'),
+        migrations.RemoveField(model_name='textcustomquestion', name='answer_text'),
+        migrations.RemoveField(model_name='imagecustomquestion', name='choices_text'),
+        migrations.RemoveField(model_name='imagecustomquestion', name='answer_text'),
+    ]
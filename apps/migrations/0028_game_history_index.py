@@ -0,0 +1,19 @@
+# Generated by Django 5.0.4 on 2026-10-18 21:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0027_custom_question_json_choices'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(condition=models.Q(('completed', True), ('finished', True)), fields=['user', '-end_time', '-id'], name='game_user_history_idx'),
+        ),
+    ]
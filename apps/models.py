@@ -1,6 +1,10 @@
+import ast
+
 from django.contrib.auth.models import User
 from django.db import models
 
+from apps.question_template import compile_question_template, QuestionTemplate
+
 ANSWER_MODE_CHOICES = (
     ('single_right', 'Single (1 right answer, others are wrong)'),
     ('text', 'Text (User input text)')
@@ -30,13 +34,19 @@ class QuestionModel(models.Model):
     category = models.ForeignKey(QuestionCategory, on_delete=models.SET_NULL, null=True)
     active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['category', 'difficulty_level', 'active'], name='question_model_select_idx')
+        ]
+
     def __str__(self):
         return self.question
 
+    def get_template(self) -> QuestionTemplate:
+        return compile_question_template(self.question)
+
     def get_property_in_question(self):
-        property_in_question = self.question.split('{')
-        property_in_question = [p.split('}')[0] for p in property_in_question if '}' in p]
-        return property_in_question
+        return list(self.get_template().placeholders)
 
 
 class GameMode(models.Model):
@@ -53,30 +63,47 @@ class UserCategoryWeight(models.Model):
     category = models.ForeignKey(QuestionCategory, on_delete=models.CASCADE)
     weight = models.FloatField(default=0.0)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'category'], name='unique_user_category_weight')
+        ]
+
     def __str__(self):
         return self.user.username + ' - ' + self.category.name + '(' + str(self.weight) + ')'
 
 
 class TextCustomQuestion(models.Model):
     question = models.TextField()
-    choices = models.TextField()
-    answer = models.TextField()
+    # List of choice and list of answer (subset of choices)
+    choices = models.JSONField(default=list)
+    answer = models.JSONField(default=list)
     difficulty_level = models.CharField(max_length=100, choices=DIFFICULTY_LEVEL_CHOICES)
     category = models.ForeignKey(QuestionCategory, on_delete=models.SET_NULL, null=True)
     active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['category', 'difficulty_level', 'active'], name='text_question_select_idx')
+        ]
+
     def __str__(self):
         return self.question
 
 
 class ImageCustomQuestion(models.Model):
     question = models.TextField()
-    choices = models.TextField()
-    answer = models.TextField()
+    # List of choice and list of answer (subset of choices)
+    choices = models.JSONField(default=list)
+    answer = models.JSONField(default=list)
     difficulty_level = models.CharField(max_length=100, choices=DIFFICULTY_LEVEL_CHOICES)
     category = models.ForeignKey(QuestionCategory, on_delete=models.SET_NULL, null=True)
     active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['category', 'difficulty_level', 'active'], name='image_question_select_idx')
+        ]
+
     def __str__(self):
         return self.question
 
@@ -92,15 +119,48 @@ class Game(models.Model):
     completed = models.BooleanField(default=False)
     rank_before = models.IntegerField(default=0)
     rank_after = models.IntegerField(default=0)
+    # Running count of wrong answers, updated with the score and weight when a question is answered
+    wrong_count = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Running game of the user
+            models.Index(fields=['user', 'finished'], name='game_user_finished_idx'),
+            # Completed games of the user in history order, used by the keyset pagination in apps.utils.get_game_history
+            models.Index(fields=['user', '-end_time', '-id'], name='game_user_history_idx',
+                         condition=models.Q(finished=True, completed=True))
+        ]
 
     def __str__(self):
         return self.user.username + ' - ' + str(self.start_time)
 
     def has_lose(self):
-        if GameQuestion.objects.filter(game=self, is_true=False, answered=True).count() >= 3:
+        if self.wrong_count >= 3:
             return True
         return False
 
+    def get_weight(self):
+        """
+        Get weight of this game with category ID as integer (JSON object store the key as string)
+        :return: Weight dict
+        """
+        return {int(k): v for k, v in self.weight.items()}
+
+
+class LeaderboardEntry(models.Model):
+    # Materialized best score of each user, updated when a game is completed
+    user = models.OneToOneField(User, on_delete=models.CASCADE)
+    best_score = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-best_score', 'user'], name='leaderboard_rank_idx')
+        ]
+
+    def __str__(self):
+        return self.user.username + ' - ' + str(self.best_score)
+
 
 class QuestionHistory(models.Model):
     question_mode = models.CharField(max_length=100)
@@ -115,6 +175,15 @@ class QuestionHistory(models.Model):
     def __str__(self):
         return self.question + ' - ' + self.question_mode + ' - ' + self.type
 
+    def get_choices(self) -> list:
+        """
+        Get choice list of the question, choice is saved as Python list text so the generated question is used instead
+        :return: List of choice
+        """
+        if 'choices' in self.full_json:
+            return self.full_json['choices']
+        return ast.literal_eval(self.choice) if self.choice else []
+
     def get_right_weight(self):
         if self.difficulty_level == 'easy':
             return 0.25
@@ -141,6 +210,12 @@ class GameQuestion(models.Model):
     answered = models.BooleanField(default=False)
     duration = models.FloatField(default=0.0)
 
+    class Meta:
+        indexes = [
+            # Also serve filter on (game, answered) by its prefix
+            models.Index(fields=['game', 'answered', 'is_true'], name='game_question_answer_idx')
+        ]
+
     def __str__(self):
         return self.game.user.username + ' - ' + self.question.question + ' - ' + self.game_mode.name
 
@@ -159,3 +234,59 @@ class GameQuestion(models.Model):
             else:
                 return 200
         return 0
+
+
+# Snapshot of the knowledge base mirrored by the syncknowledgebase command, the ID is the ID in the knowledge base.
+# Seed questions are generated from the snapshot instead of the knowledge base API once a sync is finished.
+class KnowledgeBaseClass(models.Model):
+    id = models.IntegerField(primary_key=True)
+    name = models.CharField(max_length=255)
+
+    def __str__(self):
+        return self.name
+
+
+class KnowledgeBasePropertyType(models.Model):
+    id = models.IntegerField(primary_key=True)
+    knowledge_base_class = models.ForeignKey(KnowledgeBaseClass, on_delete=models.CASCADE, null=True)
+    name = models.CharField(max_length=255)
+    raw_type = models.CharField(max_length=100)
+
+    def __str__(self):
+        return self.name
+
+
+class KnowledgeBaseInstance(models.Model):
+    id = models.IntegerField(primary_key=True)
+    knowledge_base_class = models.ForeignKey(KnowledgeBaseClass, on_delete=models.CASCADE)
+    name = models.CharField(max_length=255)
+
+    def __str__(self):
+        return self.name
+
+
+class KnowledgeBasePropertyValue(models.Model):
+    # Class is copied from the instance so the values of a class can be read from the index alone
+    knowledge_base_class = models.ForeignKey(KnowledgeBaseClass, on_delete=models.CASCADE)
+    instance = models.ForeignKey(KnowledgeBaseInstance, on_delete=models.CASCADE)
+    property_type = models.ForeignKey(KnowledgeBasePropertyType, on_delete=models.CASCADE)
+    raw_value = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['knowledge_base_class', 'property_type'], name='kb_value_class_property_idx')
+        ]
+
+    def __str__(self):
+        return str(self.instance_id) + ' - ' + str(self.property_type_id) + ' - ' + self.raw_value
+
+
+class KnowledgeBaseSync(models.Model):
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    class_count = models.IntegerField(default=0)
+    property_type_count = models.IntegerField(default=0)
+    instance_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return str(self.started_at) + ' - ' + str(self.instance_count) + ' instances'
@@ -1,255 +1,392 @@
-import json
 import logging
 import random
 
 from decouple import config
 from django.contrib.auth.models import User
 
-from apps.models import QuestionModel, GameMode, QuestionCategory, UserCategoryWeight, TextCustomQuestion, \
-    ImageCustomQuestion
-from apps.seed_api import get_instance_from_class, get_instance
+from apps.models import QuestionModel, GameMode, TextCustomQuestion, ImageCustomQuestion
+from apps.question_pool import question_pool, QUESTION_MODE_MODEL
+from apps.knowledge_base_snapshot import knowledge_base_snapshot
+from apps.seed_api import knowledge_base, KnowledgeBaseUnavailable, IndexedInstance, PropertyValue
 from apps.utils import create_weight_from_database
 
 logger = logging.getLogger(__name__)
 CURRENT_URL = config('CURRENT_URL')
 KNOWLEDGE_BASE_URL = config('KNOWLEDGE_BASE_URL')
 
-# Note : Most part of this code is not covered by test because it needs connection to knowledge base
+# Note : Seed question is tested against the local knowledge base stub, see apps/knowledge_base_stub.py
 
 
 class FailedToGenerateQuestion(Exception):
     pass
 
 
-def get_all_question_mode():
-    all_question_mode = []
-    if QuestionModel.objects.all().exists():  # pragma: no cover
-        all_question_mode.append("seed_question")
-    if TextCustomQuestion.objects.all().exists():
-        all_question_mode.append("text_custom_question")
-    if ImageCustomQuestion.objects.all().exists():
-        all_question_mode.append("image_custom_question")
+class NoFeasibleQuestion(FailedToGenerateQuestion):
+    pass
+
+
+def get_seed_knowledge_base():
+    """
+    Get the knowledge base that seed question is generated from, the local snapshot is used once it's synced
+    :return: KnowledgeBaseSnapshot or KnowledgeBaseClient
+    """
+    if question_pool.has_knowledge_base_snapshot():
+        return knowledge_base_snapshot
+    return knowledge_base
+
+
+def get_all_question_mode(include_seed_question: bool = True):
+    all_question_mode = question_pool.get_all_question_mode()
+    # Skip seed question when the knowledge base is known to be down so the request doesn't wait on it
+    if "seed_question" in all_question_mode and not (include_seed_question and get_seed_knowledge_base().is_available()):  # pragma: no cover
+        all_question_mode.remove("seed_question")
     return all_question_mode
 
 
+def get_difficulty_levels(weight: float) -> list:
+    """
+    Get difficulty levels that allowed for the category weight
+    > 5.0 -> allow medium
+    > 10.0 -> allow hard
+    :param weight: User's weight of the category
+    :return: List of difficulty level
+    """
+    if weight < 5.0:
+        return ["easy"]
+    elif weight < 10.0:
+        return ["easy", "medium"]
+    else:
+        return ["easy", "medium", "hard"]
+
+
+def get_question_queryset(question_mode: str):
+    """
+    Get queryset to load the question to generate, choices and answer of custom question are read from the question
+    pool so they're not loaded
+    :param question_mode: Question mode
+    :return: QuerySet of the question model
+    """
+    queryset = QUESTION_MODE_MODEL[question_mode].objects.select_related('category')
+    if question_mode != "seed_question":
+        queryset = queryset.defer('choices', 'answer')
+    return queryset
+
+
+def get_custom_choices(question, question_mode: str):
+    """
+    Get choices and answer of custom question from the question pool, inactive question is read from the model
+    :param question: TextCustomQuestion or ImageCustomQuestion instance
+    :param question_mode: text_custom_question or image_custom_question
+    :return: Tuple of (choices, answer)
+    """
+    cached = question_pool.get_custom_choices(question_mode, question.id)
+    if cached is not None:
+        return cached
+    return question.choices, question.answer
+
+
+def select_question(question_modes: list, custom_weight: dict = None, exclude: set = None):
+    """
+    Random a question that can be generated from the question pool
+    :param question_modes: Allowed question modes
+    :param custom_weight: Weight dict of the user, category that's not in the weight is treated as weight 0. Random
+                          weight is used for each category if not provided
+    :param exclude: Set of (question mode, question ID) to exclude
+    :return: Tuple of (question mode, question ID, answer mode)
+    """
+    if custom_weight is not None:
+        difficulty_levels = {k: get_difficulty_levels(v) for k, v in custom_weight.items()}
+    else:
+        # random 0-12 float for each category (12 to make sure that hard question is allowed)
+        difficulty_levels = {k: get_difficulty_levels(random.uniform(0.0, 12.0)) for k in question_pool.data['categories']}
+
+    # Plan only the combinations that can produce a question, so a failed attempt only happen when the
+    # question itself can't be generated
+    plan = question_pool.plan(question_modes, difficulty_levels, get_difficulty_levels(0.0), exclude)
+    if not plan:
+        raise NoFeasibleQuestion("Failed to generate question, no question is available for the allowed category, difficulty level, question mode, and game mode")
+
+    category_id = random.choice(list(plan.keys()))
+    difficulty_level = random.choice(list(plan[category_id].keys()))
+    question_mode = random.choice(plan[category_id][difficulty_level])
+    question_id, answer_mode = random.choice(question_pool.get_feasible_questions(category_id, difficulty_level, question_mode, exclude))
+    return question_mode, question_id, answer_mode
+
+
+class GenerationAttempts:
+    """
+    Retry and exclusion bookkeeping of generate_question and agenerate_question. Each try is run in `with attempts:`,
+    error that can be retried is logged and suppressed so the loop continue with the next try.
+    """
+    def __init__(self, try_count: int, question_mode: str = None):
+        """
+        :param try_count: Number of tries to generate question
+        :param question_mode: Question mode that is requested by the caller, any mode if not provided
+        """
+        self.try_count = try_count
+        self.question_mode = question_mode
+        self.skip_seed_question = False
+        # Question that failed to generate in this call, it won't be selected again
+        self.failed_question = set()
+        self._generating = None
+
+    def __iter__(self):
+        return iter(range(self.try_count))
+
+    def get_question_modes(self, all_question_mode: list) -> list:
+        """
+        Get question modes that can be selected in this try
+        :param all_question_mode: Question modes that have question, see get_all_question_mode
+        :return: List of question mode
+        """
+        if self.question_mode:
+            if self.question_mode not in all_question_mode:
+                raise FailedToGenerateQuestion(f"Failed to generate question, question mode {self.question_mode} is not allowed")
+            all_question_mode = [self.question_mode]
+        if not all_question_mode:
+            raise FailedToGenerateQuestion("No question mode found")
+        return all_question_mode
+
+    def generating(self, question_mode: str, question_id: int):
+        """
+        Mark the question that this try generate, it's excluded from the next tries if the generation failed
+        """
+        self._generating = (question_mode, question_id)
+
+    def fail(self) -> FailedToGenerateQuestion:
+        return FailedToGenerateQuestion(f"Failed to generate question after {self.try_count} tries")
+
+    def __enter__(self):
+        self._generating = None
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None or not issubclass(exc_type, Exception) or issubclass(exc_type, NoFeasibleQuestion):
+            return False
+        if issubclass(exc_type, KnowledgeBaseUnavailable):
+            # Fail fast and use other question mode instead of waiting on the knowledge base again
+            logger.warning(f"Knowledge base is unavailable, skip seed question: {exc_value}")
+            if self.question_mode == "seed_question":
+                raise FailedToGenerateQuestion("Failed to generate question, knowledge base is unavailable")
+            self.skip_seed_question = True
+            return True
+        if self._generating is not None:
+            self.failed_question.add(self._generating)
+        if issubclass(exc_type, FailedToGenerateQuestion):
+            logger.warning(f"Failed to generate question: {exc_value}")
+        else:
+            logger.error(f"Failed to generate question: {exc_value}", exc_info=exc_value)
+        return True
+
+
 def generate_question(choices: int = 4, try_count: int = 100, specific_question_id: int = None, target_user: User = None, question_mode: str = None, custom_weight: dict = None):
     """
     Generate a question for the user to answer
     :param specific_question_id: Specific question ID to generate if want to generate specific question
     :param choices: Number of choices to generate
     :param try_count: Number of tries to generate question
+    :param question_mode: Question mode to generate, it's selected again on every try if not provided
     :return: Dict of question, choices, and answer
     """
-    for i in range(try_count):
-        try:
-            # random category
-            category = QuestionCategory.objects.order_by('?').first()  # pragma: no cover
-            if category is None:
-                raise FailedToGenerateQuestion("No category found")
-
-            # filter only question that have category in user's weight
-            # > 5.0 -> allow medium
-            # > 10.0 -> allow hard
-
-            if custom_weight and target_user:  # pragma: no cover
-                # We prefer to use custom weight if it's provided more than target_user
-                if category.id in custom_weight.keys():
-                    weight = custom_weight[category.id]
-                else:
-                    UserCategoryWeight.objects.create(user=target_user, category=category, weight=0.0)
-                    weight = 0.0
-            elif target_user and not custom_weight:
-                custom_weight = create_weight_from_database(target_user.id)
-                try:
-                    weight = custom_weight[category.id]
-                except KeyError:
-                    UserCategoryWeight.objects.create(user=target_user, category=category, weight=0.0)
-                    weight = 0.0
-            elif not target_user and custom_weight:
-                try:
-                    weight = custom_weight[category.id]
-                except KeyError:
-                    weight = 0.0
-            else:
-                # random 1-12 float (12 to make sure that hard question is allowed)
-                weight = random.uniform(0.0, 12.0)
-
-            if weight < 5.0:
-                difficulty_level = "easy"
-            elif weight < 10.0:
-                difficulty_level = random.choice(["easy", "medium"])
-            else:
-                difficulty_level = random.choice(["easy", "medium", "hard"])
-
-            # random between seed_question, text_custom_question, and image_custom_question
-            if question_mode:
-                if question_mode not in get_all_question_mode():
-                    raise FailedToGenerateQuestion(f"Failed to generate question, question mode {question_mode} is not allowed")
-                question_mode = question_mode
-            else:
-                all_question_mode = get_all_question_mode()
-                if all_question_mode:
-                    question_mode = random.choice(all_question_mode)
-                else:
-                    raise FailedToGenerateQuestion("No question mode found")
-
-            # random one question
-            if question_mode == "seed_question":  # pragma: no cover
-                if specific_question_id:
-                    try:
-                        question = QuestionModel.objects.get(pk=specific_question_id)
-                    except QuestionModel.DoesNotExist:
-                        raise FailedToGenerateQuestion(f"Failed to generate question, question with ID {specific_question_id} not found")
-                else:
-                    all_question = QuestionModel.objects.filter(category=category, difficulty_level=difficulty_level, active=True)
-                    question = random.choice(all_question)
-            elif question_mode == "text_custom_question":
-                if specific_question_id:
-                    try:
-                        question = TextCustomQuestion.objects.get(pk=specific_question_id)
-                    except TextCustomQuestion.DoesNotExist:
-                        raise FailedToGenerateQuestion(f"Failed to generate question, question with ID {specific_question_id} not found")
-                else:
-                    all_question = TextCustomQuestion.objects.filter(category=category, difficulty_level=difficulty_level, active=True)
-                    question = random.choice(all_question)
-            elif question_mode == "image_custom_question":
-                if specific_question_id:
-                    try:
-                        question = ImageCustomQuestion.objects.get(pk=specific_question_id)
-                    except ImageCustomQuestion.DoesNotExist:
-                        raise FailedToGenerateQuestion(f"Failed to generate question, question with ID {specific_question_id} not found")
-                else:
-                    all_question = ImageCustomQuestion.objects.filter(category=category, difficulty_level=difficulty_level, active=True)
-                    question = random.choice(all_question)
-            else:
-                raise FailedToGenerateQuestion(f"Failed to generate question, question mode {question_mode} not found")
-
-            # random the game mode
-            game_mode = GameMode.objects.order_by('?').first()
-
-            if question is None or game_mode is None:
-                raise FailedToGenerateQuestion("No question or game mode found")
-
-            if question_mode == "seed_question":
-                if question.answer_mode not in game_mode.allow_answer_mode:
-                    raise FailedToGenerateQuestion(f"Failed to generate question, question mode {question.answer_mode} not allowed in game mode {game_mode.name}")
-
-                if question.answer_mode == "single_right":
-                    return generate_single_right_question(question, game_mode, choices)
-                elif question.answer_mode == "text":
-                    return generate_text_question(question, game_mode)
-                else:
-                    raise FailedToGenerateQuestion(f"Failed to generate question, question mode {question.answer_mode} not found")
-            elif question_mode == "text_custom_question":
-                if "single_right" not in game_mode.allow_answer_mode:
-                    raise FailedToGenerateQuestion(f"Failed to generate question, question mode 'single_right' not allowed in game mode {game_mode.name}")
-                return generate_text_custom_question(question, game_mode, choices)
-            elif question_mode == "image_custom_question":
-                if "single_right" not in game_mode.allow_answer_mode:
-                    raise FailedToGenerateQuestion(f"Failed to generate question, question mode 'single_right' not allowed in game mode {game_mode.name}")
-                return generate_image_custom_question(question, game_mode, choices)
-            else:
-                raise FailedToGenerateQuestion(f"Failed to generate question, question mode {question_mode} not found")
-
-        except FailedToGenerateQuestion as e:
-            logger.error(f"Failed to generate question: {e}")
-            logger.exception(e)
-            continue
-
-        except Exception as e:
-            logger.error(f"Failed to generate question: {e}")
-            logger.exception(e)
-            continue
-    raise FailedToGenerateQuestion(f"Failed to generate question after {try_count} tries")
-
-
-def generate_single_right_question(question: QuestionModel, game_mode: GameMode, choices: int = 4):  # pragma: no cover
+    if target_user and not custom_weight:
+        custom_weight = create_weight_from_database(target_user.id)
+    attempts = GenerationAttempts(try_count, question_mode)
+    for i in attempts:
+        with attempts:
+            # random between seed_question, text_custom_question, and image_custom_question. The mode is selected again
+            # on every try (the first selected mode used to be kept for all retries), so a try that failed in one mode
+            # can fall back to the others
+            all_question_mode = attempts.get_question_modes(
+                get_all_question_mode(include_seed_question=not attempts.skip_seed_question)
+            )
+
+            if specific_question_id:
+                return generate_specific_question(specific_question_id, random.choice(all_question_mode), choices)
+
+            # We prefer to use custom weight if it's provided more than target_user
+            selected_question_mode, question_id, answer_mode = select_question(
+                all_question_mode, custom_weight if custom_weight or target_user else None, attempts.failed_question
+            )
+            question_model = QUESTION_MODE_MODEL[selected_question_mode]
+            try:
+                question = get_question_queryset(selected_question_mode).get(pk=question_id)
+            except question_model.DoesNotExist:
+                # The pool is outdated, rebuild it on next attempt
+                question_pool.invalidate()
+                raise FailedToGenerateQuestion(f"Failed to generate question, question with ID {question_id} not found")
+
+            # random the game mode that allow the answer mode of the question
+            game_mode = question_pool.random_game_mode(answer_mode)
+            attempts.generating(selected_question_mode, question_id)
+            return generate_question_from_model(question, selected_question_mode, game_mode, choices)
+    raise attempts.fail()
+
+
+def generate_specific_question(question_id: int, question_mode: str, choices: int = 4):
     """
-    Generate a "single right" question
-    :param question: QuestionModel instance
-    :param game_mode: GameMode instance
+    Generate question from specific question ID
+    :param question_id: Question ID
+    :param question_mode: Question mode of the question
     :param choices: Number of choices to generate
     :return: Dict of question, choices, and answer
     """
-    if question.answer_mode != "single_right":
-        raise FailedToGenerateQuestion(f"Failed to generate question, question mode is not 'text' instead of {question.answer_mode}")
+    question_model = QUESTION_MODE_MODEL[question_mode]
+    try:
+        question = get_question_queryset(question_mode).get(pk=question_id)
+    except question_model.DoesNotExist:
+        raise FailedToGenerateQuestion(f"Failed to generate question, question with ID {question_id} not found")
+    answer_mode = question.answer_mode if question_mode == "seed_question" else "single_right"
+    game_mode = question_pool.random_game_mode(answer_mode)
+    return generate_question_from_model(question, question_mode, game_mode, choices)
 
-    rendered_question = question.question
-    question_properties = question.get_property_in_question()
 
-    instance_list = get_instance_from_class(question.main_class_id)
+def generate_question_from_model(question, question_mode: str, game_mode: GameMode, choices: int = 4):
+    """
+    Generate question from question model by its question mode
+    :param question: QuestionModel, TextCustomQuestion, or ImageCustomQuestion instance
+    :param question_mode: Question mode of the question
+    :param game_mode: GameMode instance that allow the answer mode of the question
+    :param choices: Number of choices to generate
+    :return: Dict of question, choices, and answer
+    """
+    if game_mode is None:
+        raise FailedToGenerateQuestion("No question or game mode found")
+
+    if question_mode == "seed_question":
+        if question.answer_mode not in game_mode.allow_answer_mode:
+            raise FailedToGenerateQuestion(f"Failed to generate question, question mode {question.answer_mode} not allowed in game mode {game_mode.name}")
+
+        if question.answer_mode == "single_right":
+            return generate_single_right_question(question, game_mode, choices)
+        elif question.answer_mode == "text":
+            return generate_text_question(question, game_mode)
+        else:
+            raise FailedToGenerateQuestion(f"Failed to generate question, question mode {question.answer_mode} not found")
+    elif question_mode == "text_custom_question":
+        return generate_text_custom_question(question, game_mode, choices)
+    elif question_mode == "image_custom_question":
+        return generate_image_custom_question(question, game_mode, choices)
+    else:
+        raise FailedToGenerateQuestion(f"Failed to generate question, question mode {question_mode} not found")
+
+
+def render_seed_question(question: QuestionModel, instance_list: list):
+    """
+    Random the instance of the question and render the question with its property values
+    :param question: QuestionModel instance
+    :param instance_list: List of IndexedInstance of the main class of the question
+    :return: Tuple of (question instance, rendered question, property names in question)
+    """
+    if not instance_list:
+        raise FailedToGenerateQuestion(f"Failed to generate question, class {question.main_class_id} has no instance")
+    template = question.get_template()
     # random the instance from the instance list
     question_instance = random.choice(instance_list)
     # try get raw value of question property
-    for question_property in question_properties:
-        try:
-            # find member of list in question_instance['property_values'] that have property_type['name'] ==
-            # question_property
-            property_value = next((pv for pv in question_instance['property_values'] if
-                                   pv['property_type']['name'] == question_property), None)
-            rendered_question = rendered_question.replace(
-                "{" + question_property + "}",
-                property_value['raw_value']
-            )
-        except StopIteration or KeyError:
+    values = {}
+    for question_property in template.property_names:
+        property_value = question_instance.property_values_by_name.get(question_property)
+        if property_value is None:
             raise FailedToGenerateQuestion(
                 f"Failed to generate question, property {question_property} not found in instance")
+        values[question_property] = property_value.raw_value
+    rendered_question = template.render(values)
+    question_properties = list(template.placeholders)
+    return question_instance, rendered_question, question_properties
 
-    choice_list = []
-    choice_type = ""
-
-    # before get in while loop, just check instance for creating choice is more than the target choices
-    # number (choices-1)
-    if len(instance_list) < choices - 1:
-        raise FailedToGenerateQuestion(f"Failed to generate question, instance list is less than {choices - 1}")
-
-    # Remove the answer instance from the instance list
-    instance_list = [i for i in instance_list if i['id'] != question_instance['id']]
-
-    while len(choice_list) < choices - 1:
-        try:
-            choice_instance = random.choice(instance_list)
-            choice_property_value = next((pv for pv in choice_instance['property_values'] if
-                                          pv['property_type']['id'] == question.answer_property_id), None)
-            choice_type = choice_property_value['property_type']['raw_type']
-            if choice_type == "instance":
-                instance = get_instance(choice_property_value['raw_value'])
-                if instance["name"] not in choice_list:
-                    choice_list.append(instance["name"])
-                else:
-                    continue
-            elif choice_type == "image":
-                if KNOWLEDGE_BASE_URL + choice_property_value['raw_value'] not in choice_list:
-                    choice_list.append(KNOWLEDGE_BASE_URL + choice_property_value['raw_value'])
-                else:
-                    continue
-            else:
-                if choice_property_value['raw_value'] not in choice_list:
-                    choice_list.append(choice_property_value['raw_value'])
-                else:
-                    continue
-        except StopIteration or KeyError:
-            raise FailedToGenerateQuestion(
-                f"Failed to generate question, property ID {question.answer_property_id} not found")
-        except Exception as e:
-            raise FailedToGenerateQuestion(f"Failed to generate question, {e}")
-
-    # append the answer to the choice in random position
-    answer_property_value = next((pv for pv in question_instance['property_values'] if
-                                  pv['property_type']['id'] == question.answer_property_id), None)
-    if answer_property_value['property_type']['raw_type'] == "instance":
-        instance = get_instance(answer_property_value['raw_value'])
-        answer_raw_value = instance["name"]
-    elif answer_property_value['property_type']['raw_type'] == "image":
-        answer_raw_value = KNOWLEDGE_BASE_URL + answer_property_value['raw_value']
-    else:
-        answer_raw_value = answer_property_value['raw_value']
-    choice_list.insert(random.randint(0, len(choice_list)), answer_raw_value)
 
+def get_answer_property_value(question: QuestionModel, instance: IndexedInstance) -> PropertyValue:
+    """
+    Get property value of the answer property in the instance
+    :param question: QuestionModel instance
+    :param instance: IndexedInstance
+    :return: PropertyValue
+    """
+    property_value = instance.property_values_by_id.get(question.answer_property_id)
+    if property_value is None:
+        raise FailedToGenerateQuestion(
+            f"Failed to generate question, property ID {question.answer_property_id} not found")
+    return property_value
+
+
+def collect_candidate_raw_values(question: QuestionModel, instance_list: list, question_instance: IndexedInstance, answer_raw_value) -> list:
+    """
+    Collect distinct raw value of the answer property from other instances in random order, so the choices can be
+    resolved together instead of one knowledge base request per choice
+    :param question: QuestionModel instance
+    :param instance_list: List of IndexedInstance of the main class of the question
+    :param question_instance: Instance that the question is about
+    :param answer_raw_value: Raw value of the answer
+    :return: List of raw value
+    """
+    candidate_instance_list = [i for i in instance_list if i.id != question_instance.id]
+    random.shuffle(candidate_instance_list)
+    candidate_raw_values = []
+    seen_raw_values = {answer_raw_value}
+    for choice_instance in candidate_instance_list:
+        raw_value = get_answer_property_value(question, choice_instance).raw_value
+        if raw_value not in seen_raw_values:
+            seen_raw_values.add(raw_value)
+            candidate_raw_values.append(raw_value)
+    return candidate_raw_values
+
+
+class InstanceChoiceCollector:
+    """
+    Collect distinct instance names as choices. The caller resolve the instance IDs in `unresolved` with the knowledge
+    base and pass the names to add_names() until nothing is unresolved, so the sync and async generators share the steps.
+    Answer and just enough candidates are resolved in the first batch, more are resolved only if some names are duplicated.
+    """
+    def __init__(self, answer_raw_value, candidate_raw_values: list, choices: int):
+        """
+        :param answer_raw_value: Instance ID of the answer
+        :param candidate_raw_values: Instance ID of the other choices in random order
+        :param choices: Number of choices including the answer
+        """
+        self.answer_raw_value = answer_raw_value
+        self.candidate_raw_values = candidate_raw_values
+        self.choices = choices
+        self.resolved_names = {}
+        self.choice_list = []
+        self._position = 0
+        self._batch = candidate_raw_values[:choices - 1]
+        self.unresolved = [answer_raw_value] + self._batch
+
+    @property
+    def answer_name(self) -> str:
+        return self.resolved_names[str(self.answer_raw_value)]
+
+    def add_names(self, names: dict):
+        """
+        Add resolved names and add the choices of the resolved batches
+        :param names: Dict of instance ID (as string) to instance name
+        """
+        self.resolved_names.update(names)
+        self.unresolved = []
+        while len(self.choice_list) < self.choices - 1 and self._batch:
+            unresolved = [v for v in self._batch if str(v) not in self.resolved_names]
+            if unresolved:
+                self.unresolved = unresolved
+                return
+            for raw_value in self._batch:
+                name = self.resolved_names[str(raw_value)]
+                if name != self.answer_name and name not in self.choice_list and len(self.choice_list) < self.choices - 1:
+                    self.choice_list.append(name)
+            self._position += len(self._batch)
+            needed = self.choices - 1 - len(self.choice_list)
+            self._batch = self.candidate_raw_values[self._position:self._position + needed]
+
+
+def build_seed_question(question: QuestionModel, game_mode: GameMode, question_instance: IndexedInstance, rendered_question: str,
+                        question_properties: list, choice_list: list, choice_type: str, answer):
+    """
+    Build the generated seed question
+    :return: Dict of question, choices, and answer
+    """
     return {
         "question": {
             "text": question.question,
-            "question_model_instance": question_instance.get('id'),
+            "question_model_instance": question_instance.id,
             "question_property": question_properties,
             "main_class_id": question.main_class_id,
             "answer_property": question.answer_property_id,
@@ -263,69 +400,122 @@ def generate_single_right_question(question: QuestionModel, game_mode: GameMode,
         },
         "choices": choice_list,
         "choices_type": choice_type,
-        "answer": answer_raw_value,
+        "answer": answer,
         "type": choice_type,
         "difficulty_level": question.difficulty_level
     }
 
 
-def generate_text_question(question: QuestionModel, game_mode: GameMode):  # pragma: no cover
+class SingleRightQuestionBuilder:
     """
-    Generate a "text" question
+    Steps of generating a "single right" question from the instance list of the question's main class, shared by the
+    sync and async generators. Instance names in `unresolved` must be resolved with add_names() before build().
+    """
+    def __init__(self, question: QuestionModel, game_mode: GameMode, instance_list: list, choices: int = 4):
+        """
+        :param question: QuestionModel instance
+        :param game_mode: GameMode instance
+        :param instance_list: List of IndexedInstance of the main class of the question
+        :param choices: Number of choices to generate
+        """
+        if question.answer_mode != "single_right":
+            raise FailedToGenerateQuestion(f"Failed to generate question, question mode is not 'single_right' instead of {question.answer_mode}")
+        self.question = question
+        self.game_mode = game_mode
+        self.choices = choices
+        self.question_instance, self.rendered_question, self.question_properties = render_seed_question(question, instance_list)
+
+        # before collecting the choices, just check instance for creating choice is more than the target choices
+        # number (choices-1)
+        if len(instance_list) < choices - 1:
+            raise FailedToGenerateQuestion(f"Failed to generate question, instance list is less than {choices - 1}")
+
+        self.answer_property_value = get_answer_property_value(question, self.question_instance)
+        self.choice_type = self.answer_property_value.raw_type
+        self.candidate_raw_values = collect_candidate_raw_values(question, instance_list, self.question_instance, self.answer_property_value.raw_value)
+        self.instance_choices = None
+        if self.choice_type == "instance":
+            self.instance_choices = InstanceChoiceCollector(self.answer_property_value.raw_value, self.candidate_raw_values, choices)
+
+    @property
+    def unresolved(self) -> list:
+        """
+        Instance IDs that must be resolved to names before build()
+        """
+        return self.instance_choices.unresolved if self.instance_choices is not None else []
+
+    def add_names(self, names: dict):
+        self.instance_choices.add_names(names)
+
+    def build(self) -> dict:
+        """
+        Build the question with the answer in random position of the choices
+        :return: Dict of question, choices, and answer
+        """
+        if self.instance_choices is not None:
+            answer_raw_value = self.instance_choices.answer_name
+            choice_list = list(self.instance_choices.choice_list)
+        elif self.choice_type == "image":
+            answer_raw_value = KNOWLEDGE_BASE_URL + self.answer_property_value.raw_value
+            choice_list = [KNOWLEDGE_BASE_URL + v for v in self.candidate_raw_values[:self.choices - 1]]
+        else:
+            answer_raw_value = self.answer_property_value.raw_value
+            choice_list = self.candidate_raw_values[:self.choices - 1]
+
+        if len(choice_list) < self.choices - 1:
+            raise FailedToGenerateQuestion(f"Failed to generate question, distinct choice is less than {self.choices - 1}")
+
+        # append the answer to the choice in random position
+        choice_list.insert(random.randint(0, len(choice_list)), answer_raw_value)
+
+        return build_seed_question(self.question, self.game_mode, self.question_instance, self.rendered_question,
+                                   self.question_properties, choice_list, self.choice_type, answer_raw_value)
+
+
+def build_text_question(question: QuestionModel, game_mode: GameMode, instance_list: list):
+    """
+    Build a "text" question from the instance list of the question's main class, shared by the sync and async generators
     :param question: QuestionModel instance
     :param game_mode: GameMode instance
+    :param instance_list: List of IndexedInstance of the main class of the question
     :return: Dict of question, and answer
     """
     if question.answer_mode != "text":
         raise FailedToGenerateQuestion(f"Failed to generate question, question mode is not 'text' instead of {question.answer_mode}")
+    question_instance, rendered_question, question_properties = render_seed_question(question, instance_list)
+    answer_property_value = get_answer_property_value(question, question_instance)
+    return build_seed_question(question, game_mode, question_instance, rendered_question, question_properties,
+                               [], answer_property_value.raw_type, answer_property_value.raw_value)
 
-    rendered_question = question.question
-    question_properties = question.get_property_in_question()
 
-    instance_list = get_instance_from_class(question.main_class_id)
-    # random the instance from the instance list
-    question_instance = random.choice(instance_list)
-    # try get raw value of question property
-    for question_property in question_properties:
-        try:
-            # find member of list in question_instance['property_values'] that have property_type['name'] ==
-            # question_property
-            property_value = next((pv for pv in question_instance['property_values'] if
-                                   pv['property_type']['name'] == question_property), None)
-            rendered_question = rendered_question.replace(
-                "{" + question_property + "}",
-                property_value['raw_value']
-            )
-        except StopIteration or KeyError:
-            raise FailedToGenerateQuestion(
-                f"Failed to generate question, property {question_property} not found in instance")
+def generate_single_right_question(question: QuestionModel, game_mode: GameMode, choices: int = 4, seed_knowledge_base=None):
+    """
+    Generate a "single right" question
+    :param question: QuestionModel instance
+    :param game_mode: GameMode instance
+    :param choices: Number of choices to generate
+    :param seed_knowledge_base: Knowledge base to generate from, see get_seed_knowledge_base() if not provided
+    :return: Dict of question, choices, and answer
+    """
+    seed_knowledge_base = seed_knowledge_base or get_seed_knowledge_base()
+    instance_list = seed_knowledge_base.get_indexed_instances_from_class(question.main_class_id)
+    builder = SingleRightQuestionBuilder(question, game_mode, instance_list, choices)
+    while builder.unresolved:
+        builder.add_names(seed_knowledge_base.get_instance_names(builder.unresolved))
+    return builder.build()
 
-    choice_list = []
-    answer_property_value = next((pv for pv in question_instance['property_values'] if
-                                  pv['property_type']['id'] == question.answer_property_id), None)
-    choice_type = answer_property_value['property_type']['raw_type']
 
-    return {
-        "question": {
-            "text": question.question,
-            "question_model_instance": question_instance.get('id'),
-            "question_property": question_properties,
-            "main_class_id": question.main_class_id,
-            "answer_property": question.answer_property_id,
-            "answer_mode": question.answer_mode
-        },
-        "question_mode": "seed_question",
-        "question_category": question.category.name,
-        "rendered_question": rendered_question,
-        "game_mode": {
-            "name": game_mode.name
-        },
-        "choices": choice_list,
-        "choices_type": choice_type,
-        "answer": answer_property_value['raw_value'],
-        "type": choice_type,
-        "difficulty_level": question.difficulty_level
-    }
+def generate_text_question(question: QuestionModel, game_mode: GameMode, seed_knowledge_base=None):
+    """
+    Generate a "text" question
+    :param question: QuestionModel instance
+    :param game_mode: GameMode instance
+    :param seed_knowledge_base: Knowledge base to generate from, see get_seed_knowledge_base() if not provided
+    :return: Dict of question, and answer
+    """
+    seed_knowledge_base = seed_knowledge_base or get_seed_knowledge_base()
+    instance_list = seed_knowledge_base.get_indexed_instances_from_class(question.main_class_id)
+    return build_text_question(question, game_mode, instance_list)
 
 
 def generate_text_custom_question(question: TextCustomQuestion, game_mode: GameMode, choices: int = 4):
@@ -339,9 +529,8 @@ def generate_text_custom_question(question: TextCustomQuestion, game_mode: GameM
     if "single_right" not in game_mode.allow_answer_mode:  # pragma: no cover
         raise FailedToGenerateQuestion(f"Failed to generate question, question mode 'single_right' not allowed in game mode {game_mode.name}")
 
-    all_answer = json.loads(question.answer.replace("'", '"'))
+    choice_list, all_answer = get_custom_choices(question, "text_custom_question")
     answer = random.choice(all_answer)
-    choice_list = json.loads(question.choices.replace("'", '"'))
     if len(choice_list) < choices - 1:
         raise FailedToGenerateQuestion(f"Failed to generate question, choice list is less than {choices - 1}")
     final_choice = [answer]
@@ -382,9 +571,8 @@ def generate_image_custom_question(question: ImageCustomQuestion, game_mode: Gam
     if "single_right" not in game_mode.allow_answer_mode:  # pragma: no cover
         raise FailedToGenerateQuestion(f"Failed to generate question, question mode 'single_right' not allowed in game mode {game_mode.name}")
 
-    all_answer = json.loads(question.answer.replace("'", '"'))
+    choice_list, all_answer = get_custom_choices(question, "image_custom_question")
     answer = random.choice(all_answer)
-    choice_list = json.loads(question.choices.replace("'", '"'))
     if len(choice_list) <= choices - 1:
         raise FailedToGenerateQuestion(f"Failed to generate question, choice list is less than {choices - 1}")
     final_choice = [CURRENT_URL + answer]
@@ -0,0 +1,161 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+from decouple import config
+from django.db import close_old_connections
+
+from apps.question import generate_question, get_difficulty_levels, FailedToGenerateQuestion
+
+logger = logging.getLogger(__name__)
+
+# Pre-generate questions for each user in a background thread so the request doesn't wait on the knowledge base.
+# The buffer is in the memory of each worker process, request that go to other worker will generate the question
+# synchronously as before.
+QUESTION_BUFFER_ENABLED = config('QUESTION_BUFFER_ENABLED', default=False, cast=bool)
+QUESTION_BUFFER_SIZE = config('QUESTION_BUFFER_SIZE', default=2, cast=int)
+QUESTION_BUFFER_MAX_AGE = config('QUESTION_BUFFER_MAX_AGE', default=300, cast=float)
+
+
+def get_weight_bucket(weight: dict) -> tuple:
+    """
+    Get the bucket of the weight, questions generated with weights in the same bucket have the same
+    allowed difficulty levels
+    :param weight: Weight dict in {category_id: weight} format
+    :return: Tuple of (category_id, number of allowed difficulty levels)
+    """
+    return tuple(sorted((int(k), len(get_difficulty_levels(v))) for k, v in (weight or {}).items()))
+
+
+class QuestionBuffer:
+    """
+    Per user queue of generated questions filled by a background producer thread
+    """
+    def __init__(self, size: int = QUESTION_BUFFER_SIZE, max_age: float = QUESTION_BUFFER_MAX_AGE, enabled: bool = QUESTION_BUFFER_ENABLED):
+        """
+        :param size: Number of questions to keep ready for each user
+        :param max_age: Seconds before the buffered question is discarded
+        :param enabled: Disable to always generate question in the request
+        """
+        self.size = size
+        self.max_age = max_age
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        # user_id -> deque of (weight bucket, created time, question)
+        self._buffers = {}
+        # user_id -> latest requested weight of the refill that is queued but not started yet
+        self._pending = {}
+        # Increased by clear(), refill that started before the buffer is cleared must not add its questions back
+        self._generation = 0
+        self._user_generations = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+
+    def pop(self, user_id: int, weight: dict = None):
+        """
+        Pop a ready question of the user that generated with the same weight bucket
+        :param user_id: User ID
+        :param weight: Current weight of the user
+        :return: Question dict, None if no question is ready
+        """
+        if not self.enabled:
+            return None
+        bucket = get_weight_bucket(weight)
+        with self._lock:
+            buffer = self._buffers.get(user_id)
+            while buffer:
+                question_bucket, created_at, question = buffer.popleft()
+                if question_bucket == bucket and time.monotonic() - created_at < self.max_age:
+                    self.hits += 1
+                    return question
+        self.misses += 1
+        return None
+
+    def request_refill(self, user, weight: dict = None):
+        """
+        Queue the refill of user's buffer to the background producer
+        :param user: User instance
+        :param weight: Weight that will be used to generate questions
+        """
+        if not self.enabled or self.size <= 0:
+            return
+        with self._lock:
+            queued = user.id in self._pending
+            # The queued refill use the latest weight when it starts
+            self._pending[user.id] = dict(weight) if weight else None
+            if queued:
+                return
+        self._ensure_worker()
+        self._queue.put(user)
+
+    def refill(self, user, weight: dict = None):
+        """
+        Generate questions until the user's buffer is full, this is run by the background producer
+        :param user: User instance
+        :param weight: Weight that will be used to generate questions
+        """
+        bucket = get_weight_bucket(weight)
+        with self._lock:
+            generation = self._get_generation(user.id)
+            buffer = self._buffers.setdefault(user.id, deque())
+            # Questions from other bucket will never be served
+            for entry in [e for e in buffer if e[0] != bucket]:
+                buffer.remove(entry)
+            missing = self.size - len(buffer)
+        for i in range(missing):
+            try:
+                question = generate_question(target_user=user, custom_weight=weight)
+            except FailedToGenerateQuestion as e:
+                logger.warning(f'Failed to pre-generate question for user {user}: {e}')
+                break
+            with self._lock:
+                if self._get_generation(user.id) != generation:
+                    # The buffer is cleared while generating, e.g. the user's weight is changed
+                    break
+                self._buffers.setdefault(user.id, deque()).append((bucket, time.monotonic(), question))
+
+    def clear(self, user_id: int = None):
+        """
+        Remove buffered questions
+        :param user_id: User ID, remove all users if not provided
+        """
+        with self._lock:
+            if user_id is None:
+                self._buffers.clear()
+                self._user_generations.clear()
+                self._generation += 1
+            else:
+                self._buffers.pop(user_id, None)
+                self._user_generations[user_id] = self._user_generations.get(user_id, 0) + 1
+
+    def _get_generation(self, user_id: int) -> tuple:
+        return self._generation, self._user_generations.get(user_id, 0)
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='question-buffer', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            user = self._queue.get()
+            with self._lock:
+                # Refill that is requested from now on is queued again with its own weight
+                weight = self._pending.pop(user.id, None)
+            try:
+                close_old_connections()
+                self.refill(user, weight)
+            except Exception as e:
+                logger.error(f'Error when pre-generating question for user {user}: {e}')
+                logger.exception(e)
+            finally:
+                close_old_connections()
+                self._queue.task_done()
+
+
+question_buffer = QuestionBuffer()
@@ -0,0 +1,212 @@
+import logging
+import random
+import threading
+import time
+
+from decouple import config
+
+from apps.cache import NamespaceCache
+from apps.models import QuestionModel, TextCustomQuestion, ImageCustomQuestion, QuestionCategory, GameMode, \
+    KnowledgeBaseSync
+
+logger = logging.getLogger(__name__)
+
+# The built pool is shared between workers through the shared cache (see apps/cache.py), signals invalidate it by
+# increasing the version of the "question_pool" namespace. The pool is also rebuilt after this number of seconds to pick
+# up changes that don't send signals.
+QUESTION_POOL_TTL = config('QUESTION_POOL_TTL', default=60, cast=float)
+# Seconds between checking the shared version, so the pool is not checked with the cache on every access
+QUESTION_POOL_VERSION_CHECK_INTERVAL = 1.0
+
+# Question mode to the model that store the question, custom question is always answered in "single_right" mode
+QUESTION_MODE_MODEL = {
+    "seed_question": QuestionModel,
+    "text_custom_question": TextCustomQuestion,
+    "image_custom_question": ImageCustomQuestion
+}
+
+
+class QuestionPool:
+    """
+    In-memory index of active question ID used to select question without querying the database.
+    Question that can be played in at least one game mode is keyed by (category ID, difficulty level, question mode)
+    with its answer mode, and game modes are grouped by the answer mode they allow. The pool is built lazily and rebuilt after invalidate() is called, see apps/signals.py.
+    The built pool is stored in the shared cache, so only one worker build it after each invalidation.
+    """
+    def __init__(self, ttl: float = QUESTION_POOL_TTL, store: NamespaceCache = None):
+        """
+        :param ttl: Seconds before the pool is rebuilt even it's not invalidated
+        :param store: Shared cache to store the built pool
+        """
+        self.ttl = ttl
+        self.store = store if store is not None else NamespaceCache('question_pool', ttl)
+        self._lock = threading.Lock()
+        self._data = None
+        self._version = None
+        self._built_at = 0.0
+        self._checked_at = 0.0
+
+    def invalidate(self):
+        """
+        Drop the pool on all workers, it will be rebuilt on next access
+        """
+        with self._lock:
+            self._data = None
+        self.store.invalidate()
+
+    def _build(self) -> dict:
+        """
+        Build the pool from the database
+        :return: Pool data
+        """
+        questions = {}
+        question_modes = []
+        # Decoded choices and answer of custom question, so generating the question doesn't load and decode them
+        custom_choices = {}
+        for question_mode, model in QUESTION_MODE_MODEL.items():
+            if model.objects.exists():
+                question_modes.append(question_mode)
+            fields = ['id', 'category_id', 'difficulty_level']
+            if model is QuestionModel:
+                fields.append('answer_mode')
+            else:
+                fields.extend(['choices', 'answer'])
+            for row in model.objects.filter(active=True, category__isnull=False).values(*fields):
+                answer_mode = row.get('answer_mode', 'single_right')
+                key = (row['category_id'], row['difficulty_level'], question_mode, answer_mode)
+                questions.setdefault(key, []).append(row['id'])
+                if 'choices' in row:
+                    custom_choices[(question_mode, row['id'])] = (tuple(row['choices']), tuple(row['answer']))
+        game_modes = list(GameMode.objects.all())
+        game_modes_by_answer_mode = {}
+        for game_mode in game_modes:
+            game_modes_by_answer_mode.setdefault(game_mode.allow_answer_mode, []).append(game_mode)
+        # Feasible question is question that have at least one game mode allowing its answer mode, stored as
+        # (category ID, difficulty level, question mode) -> [(question ID, answer mode)]
+        feasible_questions = {}
+        for (category_id, difficulty_level, question_mode, answer_mode), ids in questions.items():
+            if answer_mode in game_modes_by_answer_mode:
+                feasible_questions.setdefault((category_id, difficulty_level, question_mode), []).extend(
+                    (question_id, answer_mode) for question_id in ids
+                )
+        data = {
+            'categories': list(QuestionCategory.objects.values_list('id', flat=True)),
+            'question_modes': question_modes,
+            'game_modes': game_modes,
+            'game_modes_by_answer_mode': game_modes_by_answer_mode,
+            'feasible_questions': feasible_questions,
+            'custom_choices': custom_choices,
+            # ID of the latest finished sync, None if the snapshot is not synced
+            'knowledge_base_sync_id': KnowledgeBaseSync.objects.filter(finished_at__isnull=False).order_by('-id')
+            .values_list('id', flat=True).first()
+        }
+        logger.debug(f"Question pool built with {sum(len(v) for v in questions.values())} questions")
+        return data
+
+    def _load(self) -> dict:
+        """
+        Get the pool that is built by any worker from the shared cache, or build and share it
+        :return: Pool data
+        """
+        data = self.store.get('data')
+        if data is None:
+            data = self._build()
+            self.store.set('data', data)
+        return data
+
+    @property
+    def data(self) -> dict:
+        data = self._data
+        if data is None or time.monotonic() - self._checked_at >= QUESTION_POOL_VERSION_CHECK_INTERVAL:
+            with self._lock:
+                now = time.monotonic()
+                if self._data is None or now - self._checked_at >= QUESTION_POOL_VERSION_CHECK_INTERVAL:
+                    version = self.store.get_version()
+                    if self._data is None or version != self._version or now - self._built_at >= self.ttl:
+                        self._data = self._load()
+                        self._version = version
+                        self._built_at = now
+                    self._checked_at = now
+                data = self._data
+        return data
+
+    def get_all_question_mode(self) -> list:
+        """
+        Get question modes that have question
+        :return: List of question mode
+        """
+        return list(self.data['question_modes'])
+
+    def has_knowledge_base_snapshot(self) -> bool:
+        """
+        Check that seed question should be generated from the knowledge base snapshot, see apps/knowledge_base_snapshot.py
+        :return: True if the snapshot has been synced
+        """
+        return self.data['knowledge_base_sync_id'] is not None
+
+    def get_knowledge_base_sync_id(self):
+        """
+        Get ID of the snapshot that seed question is generated from
+        :return: ID of the latest finished KnowledgeBaseSync, None if the snapshot has not been synced
+        """
+        return self.data['knowledge_base_sync_id']
+
+    def get_custom_choices(self, question_mode: str, question_id: int):
+        """
+        Get choices and answer of active custom question
+        :param question_mode: text_custom_question or image_custom_question
+        :param question_id: Question ID
+        :return: Tuple of (choices, answer) as tuples, None if the question is not in the pool
+        """
+        return self.data['custom_choices'].get((question_mode, question_id))
+
+    def random_game_mode(self, answer_mode: str = None):
+        """
+        Random one game mode
+        :param answer_mode: Only random game mode that allow this answer mode if provided
+        :return: GameMode instance, None if no game mode
+        """
+        if answer_mode is None:
+            game_modes = self.data['game_modes']
+        else:
+            game_modes = self.data['game_modes_by_answer_mode'].get(answer_mode, [])
+        if not game_modes:
+            return None
+        return random.choice(game_modes)
+
+    def get_feasible_questions(self, category_id, difficulty_level: str, question_mode: str, exclude: set = None) -> list:
+        """
+        Get questions that can be played in at least one game mode
+        :param category_id: Category ID
+        :param difficulty_level: Difficulty level
+        :param question_mode: Question mode
+        :param exclude: Set of (question mode, question ID) to exclude
+        :return: List of (question ID, answer mode)
+        """
+        questions = self.data['feasible_questions'].get((category_id, difficulty_level, question_mode), [])
+        if exclude:
+            questions = [q for q in questions if (question_mode, q[0]) not in exclude]
+        return questions
+
+    def plan(self, question_modes: list, difficulty_levels: dict, default_difficulty_levels: list, exclude: set = None) -> dict:
+        """
+        Find all (category, difficulty level, question mode) combinations that can produce a question
+        :param question_modes: Allowed question modes
+        :param difficulty_levels: Dict of category ID to allowed difficulty levels
+        :param default_difficulty_levels: Allowed difficulty levels of category that is not in difficulty_levels
+        :param exclude: Set of (question mode, question ID) to exclude
+        :return: Dict in {category ID: {difficulty level: [question mode]}} format, only feasible entries are included
+        """
+        plan = {}
+        for category_id in self.data['categories']:
+            for difficulty_level in difficulty_levels.get(category_id, default_difficulty_levels):
+                feasible_modes = [
+                    question_mode for question_mode in question_modes
+                    if self.get_feasible_questions(category_id, difficulty_level, question_mode, exclude)
+                ]
+                if feasible_modes:
+                    plan.setdefault(category_id, {})[difficulty_level] = feasible_modes
+        return plan
+
+
+question_pool = QuestionPool()
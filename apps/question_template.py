@@ -0,0 +1,53 @@
+import re
+from functools import lru_cache
+
+# Question text of seed question use {property_name} as placeholder of the property value of the instance, e.g.
+# "What is the scientific name of {name}?". The text is compiled once and the compiled template is shared by the
+# question form validation and the question generator.
+PLACEHOLDER_PATTERN = re.compile(r'\{([^{}]*)\}')
+
+
+class QuestionTemplate:
+    """
+    Compiled question text, literal segments are around the placeholders so rendering is a single join
+    """
+    __slots__ = ('text', 'segments', 'placeholders', 'property_names')
+
+    def __init__(self, text: str):
+        """
+        :param text: Question text with {property_name} placeholders
+        """
+        self.text = text
+        # segments[i] is the text before placeholders[i] and the last segment is the text after the last placeholder
+        self.segments = []
+        self.placeholders = []
+        position = 0
+        for match in PLACEHOLDER_PATTERN.finditer(text):
+            self.segments.append(text[position:match.start()])
+            self.placeholders.append(match.group(1))
+            position = match.end()
+        self.segments.append(text[position:])
+        # Property name may be used more than once in the question
+        self.property_names = list(dict.fromkeys(self.placeholders))
+
+    def render(self, values: dict) -> str:
+        """
+        Render the question with the property values
+        :param values: Dict of property name to value, must have all property names
+        :return: Rendered question
+        """
+        parts = [self.segments[0]]
+        for placeholder, segment in zip(self.placeholders, self.segments[1:]):
+            parts.append(str(values[placeholder]))
+            parts.append(segment)
+        return ''.join(parts)
+
+
+@lru_cache(maxsize=1024)
+def compile_question_template(text: str) -> QuestionTemplate:
+    """
+    Compile the question text, compiled template is cached by the text
+    :param text: Question text with {property_name} placeholders
+    :return: QuestionTemplate
+    """
+    return QuestionTemplate(text)
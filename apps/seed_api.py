@@ -1,75 +1,834 @@
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
 from decouple import config
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from apps.cache import SharedTTLCache
+
+logger = logging.getLogger(__name__)
 
 KNOWLEDGE_BASE_URL = config('KNOWLEDGE_BASE_URL', default='http://localhost:8000')
 if KNOWLEDGE_BASE_URL[-1] == '/':  # pragma: no cover
     KNOWLEDGE_BASE_URL = KNOWLEDGE_BASE_URL[:-1]
 
+# Knowledge base responses are cached since the knowledge base data rarely change, expired responses are
+# revalidated with conditional request (ETag / Last-Modified) so unchanged responses are not downloaded and parsed again
+KNOWLEDGE_BASE_CACHE_SIZE = config('KNOWLEDGE_BASE_CACHE_SIZE', default=1024, cast=int)
+KNOWLEDGE_BASE_CACHE_TTL = config('KNOWLEDGE_BASE_CACHE_TTL', default=600, cast=float)
+# Converted instance lists of the shared client are also kept in each process for this time to live, so the hot path
+# doesn't load them from the shared cache on every question. Change in other process is seen after this time.
+KNOWLEDGE_BASE_LOCAL_CACHE_TTL = config('KNOWLEDGE_BASE_LOCAL_CACHE_TTL', default=60, cast=float)
+
+# Connection policy of the knowledge base client, timeout is in seconds
+KNOWLEDGE_BASE_CONNECT_TIMEOUT = config('KNOWLEDGE_BASE_CONNECT_TIMEOUT', default=3.0, cast=float)
+KNOWLEDGE_BASE_READ_TIMEOUT = config('KNOWLEDGE_BASE_READ_TIMEOUT', default=10.0, cast=float)
+KNOWLEDGE_BASE_MAX_RETRIES = config('KNOWLEDGE_BASE_MAX_RETRIES', default=2, cast=int)
+KNOWLEDGE_BASE_BACKOFF_FACTOR = config('KNOWLEDGE_BASE_BACKOFF_FACTOR', default=0.3, cast=float)
+KNOWLEDGE_BASE_POOL_SIZE = config('KNOWLEDGE_BASE_POOL_SIZE', default=10, cast=int)
+# Circuit breaker will open after this number of consecutive failures and try again after the reset timeout
+KNOWLEDGE_BASE_FAILURE_THRESHOLD = config('KNOWLEDGE_BASE_FAILURE_THRESHOLD', default=5, cast=int)
+KNOWLEDGE_BASE_RESET_TIMEOUT = config('KNOWLEDGE_BASE_RESET_TIMEOUT', default=30.0, cast=float)
+
+
+class KnowledgeBaseError(Exception):
+    pass
+
+
+class KnowledgeBaseUnavailable(KnowledgeBaseError):
+    pass
+
+
+class TTLCache:
+    """
+    Bounded LRU cache that expire each entry after the given time to live
+    """
+    def __init__(self, max_size: int = 1024, ttl: float = 600):
+        """
+        :param max_size: Maximum number of entries, least recently used entry is evicted first
+        :param ttl: Time to live of each entry in seconds
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and entry[0] > time.monotonic()
+
+    def get(self, key, default=None):
+        """
+        Get value from cache and count as hit or miss
+        :param key: Cache key
+        :param default: Value to return if key is not in cache or expired
+        :return: Cached value
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expire_at, value, validators = entry
+            if expire_at <= time.monotonic():
+                # Expired entry with validators is kept until it's evicted, so it can be revalidated
+                if not validators:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def get_stale(self, key):
+        """
+        Get value and validators of the entry even it's expired, this doesn't count as hit or miss
+        :param key: Cache key
+        :return: Tuple of (value, validators), None if key is not in cache or the entry has no validators
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or not entry[2]:
+                return None
+            return entry[1], entry[2]
+
+    def set(self, key, value, ttl: float = None, validators: dict = None):
+        """
+        Set value to cache
+        :param key: Cache key
+        :param value: Value to cache
+        :param ttl: Time to live in seconds, use cache's default if not provided
+        :param validators: Response headers to revalidate the value after it's expired (ETag, Last-Modified)
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value, validators or {})
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def revalidate(self, key, ttl: float = None, validators: dict = None):
+        """
+        Renew the time to live of the entry after the server confirm that it's not modified
+        :param key: Cache key
+        :param ttl: Time to live in seconds, use cache's default if not provided
+        :param validators: New validators from the server, the old ones are kept if not provided
+        :return: Cached value, None if key is not in cache
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), entry[1], validators or entry[2])
+            self._data.move_to_end(key)
+            self.revalidations += 1
+            return entry[1]
+
+    def expire(self):
+        """
+        Expire all entries but keep them for revalidation, so the next read check the server with conditional request
+        """
+        with self._lock:
+            for key, (expire_at, value, validators) in list(self._data.items()):
+                self._data[key] = (0.0, value, validators)
+
+    def invalidate(self, key):
+        """
+        Remove one key from cache
+        :param key: Cache key
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def invalidate_endpoint(self, endpoint: str):
+        """
+        Remove all keys of the endpoint, key must be in (endpoint, id) format
+        :param endpoint: Endpoint name
+        """
+        with self._lock:
+            for key in [k for k in self._data if k[0] == endpoint]:
+                del self._data[key]
+
+    def clear(self):
+        """
+        Remove all keys and reset the counters
+        """
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+            self.revalidations = 0
+
+    def stats(self) -> dict:
+        """
+        Get cache statistics
+        :return: Dict of hits, misses, revalidations, and current size
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'revalidations': self.revalidations,
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'ttl': self.ttl
+        }
+
+
+class TieredTTLCache:
+    """
+    In-process TTLCache in front of the shared cache for the given endpoints, other endpoints only use the shared cache.
+    Invalidation in this process clear both caches, invalidation in other process is seen when the local entry expired.
+    """
+    def __init__(self, shared, local: TTLCache, local_endpoints: tuple):
+        """
+        :param shared: Shared cache, e.g. apps.cache.SharedTTLCache
+        :param local: In-process cache of the local endpoints
+        :param local_endpoints: Endpoints that are kept in the in-process cache
+        """
+        self.shared = shared
+        self.local = local
+        self.local_endpoints = local_endpoints
+
+    def _is_local(self, key) -> bool:
+        return key[0] in self.local_endpoints
+
+    def __contains__(self, key):
+        return (self._is_local(key) and key in self.local) or key in self.shared
+
+    def get(self, key, default=None):
+        if self._is_local(key):
+            value = self.local.get(key)
+            if value is not None:
+                return value
+        value = self.shared.get(key)
+        if value is None:
+            return default
+        if self._is_local(key):
+            self.local.set(key, value)
+        return value
+
+    def get_stale(self, key):
+        return self.shared.get_stale(key)
 
-def get_all_class():  # pragma: no cover
+    def set(self, key, value, ttl: float = None, validators: dict = None):
+        self.shared.set(key, value, ttl, validators)
+        if self._is_local(key):
+            self.local.set(key, value)
+
+    def revalidate(self, key, ttl: float = None, validators: dict = None):
+        value = self.shared.revalidate(key, ttl, validators)
+        if value is not None and self._is_local(key):
+            self.local.set(key, value)
+        return value
+
+    def expire(self):
+        self.shared.expire()
+        self.local.expire()
+
+    def invalidate(self, key):
+        self.shared.invalidate(key)
+        self.local.invalidate(key)
+
+    def invalidate_endpoint(self, endpoint: str):
+        self.shared.invalidate_endpoint(endpoint)
+        self.local.invalidate_endpoint(endpoint)
+
+    def clear(self):
+        self.shared.clear()
+        self.local.clear()
+
+    def stats(self) -> dict:
+        stats = self.shared.stats()
+        stats['local'] = self.local.stats()
+        return stats
+
+
+class PropertyValue:
+    """
+    Property value of an instance with its property type
+    """
+    __slots__ = ('property_type_id', 'name', 'raw_type', 'raw_value')
+
+    def __init__(self, property_type_id: int, name: str, raw_type: str, raw_value):
+        self.property_type_id = property_type_id
+        self.name = name
+        self.raw_type = raw_type
+        self.raw_value = raw_value
+
+    def to_json(self) -> dict:
+        return {
+            'property_type': {'id': self.property_type_id, 'name': self.name, 'raw_type': self.raw_type},
+            'raw_value': self.raw_value
+        }
+
+
+class IndexedInstance:
+    """
+    Knowledge base instance with its property values indexed by property type ID and name
+    """
+    __slots__ = ('id', 'name', 'class_id', 'property_values_by_id', 'property_values_by_name')
+
+    def __init__(self, instance_id: int, name: str, class_id, property_values: list):
+        """
+        :param instance_id: ID of instance
+        :param name: Name of instance
+        :param class_id: ID of class of the instance
+        :param property_values: List of PropertyValue, the first value of each property type is kept
+        """
+        self.id = instance_id
+        self.name = name
+        self.class_id = class_id
+        self.property_values_by_id = {}
+        self.property_values_by_name = {}
+        for property_value in property_values:
+            self.property_values_by_id.setdefault(property_value.property_type_id, property_value)
+            self.property_values_by_name.setdefault(property_value.name, property_value)
+
+    @classmethod
+    def from_json(cls, instance: dict):
+        """
+        Convert instance from knowledge base API
+        :param instance: Instance in JSON format
+        :return: IndexedInstance
+        """
+        return cls(instance['id'], instance['name'], instance.get('class'), [
+            PropertyValue(pv['property_type']['id'], pv['property_type']['name'], pv['property_type']['raw_type'], pv['raw_value'])
+            for pv in instance['property_values']
+        ])
+
+    def to_json(self) -> dict:
+        return {
+            'id': self.id,
+            'name': self.name,
+            'class': self.class_id,
+            'property_values': [pv.to_json() for pv in self.property_values_by_id.values()]
+        }
+
+
+def index_instances(instances: list) -> list:
+    """
+    Convert instance list from knowledge base API to IndexedInstance
+    :param instances: Instance list in JSON format
+    :return: List of IndexedInstance
+    """
+    return [IndexedInstance.from_json(instance) for instance in instances]
+
+
+def get_validators(headers) -> dict:
+    """
+    Get validators of the response to make conditional request when the cached response is expired
+    :param headers: Response headers
+    :return: Dict of ETag and Last-Modified that the response has
+    """
+    if not headers:
+        return {}
+    return {name: headers[name] for name in ('ETag', 'Last-Modified') if headers.get(name)}
+
+
+def get_conditional_headers(stale: tuple = None) -> dict:
+    """
+    Get request headers that ask the server to respond 304 if the cached response is not modified
+    :param stale: Tuple of (value, validators) from TTLCache.get_stale()
+    :return: Request headers
+    """
+    if stale is None:
+        return {}
+    validators = stale[1]
+    headers = {}
+    if 'ETag' in validators:
+        headers['If-None-Match'] = validators['ETag']
+    if 'Last-Modified' in validators:
+        headers['If-Modified-Since'] = validators['Last-Modified']
+    return headers
+
+
+# Cache of the shared client is in the shared cache (see apps/cache.py), so the workers don't each download the same
+# responses. Client that is created separately (e.g. in the benchmark) use its own in-process cache.
+# Converted instance lists are read on every question and are large to unpickle, so they're also kept in the process.
+knowledge_base_cache = TieredTTLCache(
+    SharedTTLCache('knowledge_base', ttl=KNOWLEDGE_BASE_CACHE_TTL),
+    TTLCache(max_size=KNOWLEDGE_BASE_CACHE_SIZE, ttl=KNOWLEDGE_BASE_LOCAL_CACHE_TTL),
+    ('indexed_instance_from_class',)
+)
+
+
+class CircuitBreaker:
+    """
+    Stop calling the knowledge base after consecutive failures, allow one trial request after the reset timeout
+    """
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        """
+        :param failure_threshold: Number of consecutive failures to open the circuit
+        :param reset_timeout: Seconds to wait before allowing a trial request when the circuit is open
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failure_count = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self.opened_at is not None and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def allow_request(self) -> bool:
+        """
+        Check that request is allowed, when the reset timeout has passed the circuit is half open and one request
+        is allowed until it's recorded as success or failure
+        :return: True if request is allowed
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Half open, push the open time so only this request is allowed
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failure_count = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failure_count += 1
+            if self.failure_count >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning(f'Knowledge base circuit breaker opened after {self.failure_count} failures')
+                self.opened_at = time.monotonic()
+
+
+class KnowledgeBaseClient:
+    """
+    Client for knowledge base API with shared connection pool, timeout, retry, circuit breaker and response cache
+    """
+    def __init__(self, base_url: str = KNOWLEDGE_BASE_URL, cache: TTLCache = None,
+                 connect_timeout: float = KNOWLEDGE_BASE_CONNECT_TIMEOUT, read_timeout: float = KNOWLEDGE_BASE_READ_TIMEOUT,
+                 max_retries: int = KNOWLEDGE_BASE_MAX_RETRIES, backoff_factor: float = KNOWLEDGE_BASE_BACKOFF_FACTOR,
+                 pool_size: int = KNOWLEDGE_BASE_POOL_SIZE, failure_threshold: int = KNOWLEDGE_BASE_FAILURE_THRESHOLD,
+                 reset_timeout: float = KNOWLEDGE_BASE_RESET_TIMEOUT):
+        self.base_url = base_url.rstrip('/')
+        self.cache = cache if cache is not None else TTLCache(max_size=KNOWLEDGE_BASE_CACHE_SIZE, ttl=KNOWLEDGE_BASE_CACHE_TTL)
+        self.timeout = (connect_timeout, read_timeout)
+        self.circuit_breaker = CircuitBreaker(failure_threshold=failure_threshold, reset_timeout=reset_timeout)
+        self.session = requests.Session()
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=('GET',),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # Worker threads share the session's connection pool, so concurrent requests are bounded by the pool size
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='knowledge-base')
+
+    def is_available(self) -> bool:
+        """
+        Check that the circuit breaker allow calling the knowledge base
+        :return: False if the knowledge base is known to be down
+        """
+        return not self.circuit_breaker.is_open
+
+    def get_json(self, endpoint: str, object_id, path: str, error_message: str, response_key: str = None,
+                 transform=None):
+        """
+        Get JSON response from knowledge base through the cache
+        :param endpoint: Endpoint name use as cache key
+        :param object_id: ID in the endpoint use as cache key
+        :param path: Path of the API including query string
+        :param error_message: Error message prefix when knowledge base return non 200 status code
+        :param response_key: Key in JSON response to return, return the whole response if not provided
+        :param transform: Function to convert the response once before it's cached
+        :return: Response in JSON format, or the converted response if transform is provided
+        """
+        key = (endpoint, str(object_id))
+        cached = self.get_cached(key, error_message)
+        if cached is not None:
+            return cached
+        stale = self.cache.get_stale(key)
+        try:
+            response = self.session.get(f'{self.base_url}{path}', timeout=self.timeout,
+                                        headers=get_conditional_headers(stale))
+        except requests.RequestException as e:
+            self.circuit_breaker.record_failure()
+            raise KnowledgeBaseUnavailable(f'{error_message}. {e}') from e
+        return self.handle_response(key, response.status_code, response.json, error_message, response_key,
+                                    response.headers, stale, transform)
+
+    def get_cached(self, key: tuple, error_message: str):
+        """
+        Get cached response, raise KnowledgeBaseUnavailable if it's not cached and the circuit breaker is open
+        :param key: Cache key in (endpoint, ID) format
+        :param error_message: Error message prefix
+        :return: Cached response, None if it must be requested
+        """
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        if not self.circuit_breaker.allow_request():
+            raise KnowledgeBaseUnavailable(f'{error_message}. Knowledge base is unavailable (circuit breaker is open)')
+        return None
+
+    def handle_response(self, key: tuple, status_code: int, load_json, error_message: str, response_key: str = None,
+                        headers=None, stale: tuple = None, transform=None):
+        """
+        Record the response to the circuit breaker and cache the JSON response with its validators
+        :param key: Cache key in (endpoint, ID) format
+        :param status_code: HTTP status code of the response
+        :param load_json: Function that return the response body in JSON format
+        :param error_message: Error message prefix when knowledge base return non 200 status code
+        :param response_key: Key in JSON response to return, return the whole response if not provided
+        :param headers: Response headers
+        :param stale: Expired (value, validators) that the request was conditional on
+        :param transform: Function to convert the response once before it's cached
+        :return: Response in JSON format, or the converted response if transform is provided
+        """
+        if status_code >= 500:
+            self.circuit_breaker.record_failure()
+            raise KnowledgeBaseUnavailable(f'{error_message}. Status code: {status_code}')
+        self.circuit_breaker.record_success()
+        validators = get_validators(headers)
+        if status_code == 304 and stale is not None:
+            # Not modified, reuse the already parsed response
+            data = self.cache.revalidate(key, validators=validators)
+            return stale[0] if data is None else data
+        if status_code != 200:
+            raise KnowledgeBaseError(f'{error_message}. Status code: {status_code}')
+        data = load_json()
+        if response_key:
+            data = data[response_key]
+        if transform is not None:
+            data = transform(data)
+        self.cache.set(key, data, validators=validators)
+        return data
+
+    def invalidate_cache(self, endpoint: str = None, object_id=None):
+        """
+        Invalidate cached knowledge base response
+        :param endpoint: Endpoint name (class, property_type, instance_from_class, instance), invalidate all if not provided
+        :param object_id: ID in the endpoint, invalidate whole endpoint if not provided
+        """
+        if endpoint is None:
+            self.cache.clear()
+            return
+        # Converted instances are cached separately from the instance list response
+        endpoints = [endpoint, 'indexed_instance_from_class'] if endpoint == 'instance_from_class' else [endpoint]
+        for name in endpoints:
+            if object_id is None:
+                self.cache.invalidate_endpoint(name)
+            else:
+                self.cache.invalidate((name, str(object_id)))
+
+    def get_all_class(self):
+        """
+        Get all class in knowledge base
+        API endpoint : /api/class
+        :return: Class list in JSON format
+        """
+        return self.get_json('class', None, '/api/class', 'Error when getting all class from knowledge base', 'class')
+
+    def get_class(self, class_id):
+        """
+        Get class by ID
+        API endpoint : /api/class?class={class_id}
+        :param class_id: ID of class
+        :return: Class in JSON format
+        """
+        return self.get_json('class', class_id, f'/api/class?class={class_id}', 'Error when getting class from knowledge base', 'class')
+
+    def get_property_type_from_class(self, class_id):
+        """
+        Get property type from class
+        API endpoint : /api/property_type?class={class_id}
+        :param class_id: ID of class
+        :return: Property type list in JSON format
+        """
+        return self.get_json('property_type', class_id, f'/api/property_type?class={class_id}', 'Error when getting property type from class', 'property_type')
+
+    def get_instance_from_class(self, class_id):
+        """
+        Get instance from class
+        API endpoint : /api/instance?class={class_id}
+        :param class_id: ID of class
+        :return: Instance list in JSON format
+        """
+        return self.get_json('instance_from_class', class_id, f'/api/instance?class={class_id}', 'Error when getting instance from class', 'instance')
+
+    def get_indexed_instances_from_class(self, class_id):
+        """
+        Get instance from class converted to IndexedInstance, only the converted instances are cached
+        API endpoint : /api/instance?class={class_id}
+        :param class_id: ID of class
+        :return: List of IndexedInstance
+        """
+        return self.get_json('indexed_instance_from_class', class_id, f'/api/instance?class={class_id}', 'Error when getting instance from class', 'instance', index_instances)
+
+    def get_instance(self, instance_id):
+        """
+        Get instance by ID
+        API endpoint : /api/instance/{instance_id}
+        :param instance_id: ID of instance
+        :return: Instance in JSON format
+        """
+        return self.get_json('instance', instance_id, f'/api/instance/{instance_id}', 'Error when getting instance from knowledge base')
+
+    def get_instances(self, instance_ids) -> dict:
+        """
+        Get multiple instances by ID concurrently, instances that are already cached are not requested again
+        API endpoint : /api/instance/{instance_id}
+        :param instance_ids: List of instance ID, duplicated ID is requested once
+        :return: Dict of instance ID (as string) to instance in JSON format
+        """
+        unique_ids = list(dict.fromkeys(str(instance_id) for instance_id in instance_ids))
+        missing_ids = [i for i in unique_ids if ('instance', i) not in self.cache]
+        if len(missing_ids) > 1:
+            # Only the results are needed, the responses are stored in cache by get_instance
+            list(self.executor.map(self.get_instance, missing_ids))
+        return {instance_id: self.get_instance(instance_id) for instance_id in unique_ids}
+
+    def get_instance_names(self, instance_ids) -> dict:
+        """
+        Get name of multiple instances, the name is memoized separately from the full instance
+        :param instance_ids: List of instance ID
+        :return: Dict of instance ID (as string) to instance name
+        """
+        names = {}
+        missing_ids = []
+        for instance_id in dict.fromkeys(str(i) for i in instance_ids):
+            name = self.cache.get(('instance_name', instance_id))
+            if name is None:
+                missing_ids.append(instance_id)
+            else:
+                names[instance_id] = name
+        for instance_id, instance in self.get_instances(missing_ids).items():
+            names[instance_id] = instance['name']
+            self.cache.set(('instance_name', instance_id), instance['name'])
+        return names
+
+
+knowledge_base = KnowledgeBaseClient(cache=knowledge_base_cache)
+
+
+class AsyncKnowledgeBaseClient:
+    """
+    Non-blocking client for knowledge base API used by the async views. It shares the response cache and the circuit
+    breaker with the sync client so both see the same knowledge base state.
+    """
+    def __init__(self, sync_client: KnowledgeBaseClient, max_retries: int = KNOWLEDGE_BASE_MAX_RETRIES,
+                 pool_size: int = KNOWLEDGE_BASE_POOL_SIZE):
+        """
+        :param sync_client: Sync client to share the base URL, timeout, cache and circuit breaker with
+        :param max_retries: Number of retries when connection failed
+        :param pool_size: Maximum number of connections to the knowledge base
+        """
+        self.sync_client = sync_client
+        self.max_retries = max_retries
+        self.pool_size = pool_size
+        # httpx.AsyncClient is bound to the event loop that it's used first, keep one client for each loop
+        self._clients = weakref.WeakKeyDictionary()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            connect_timeout, read_timeout = self.sync_client.timeout
+            client = httpx.AsyncClient(
+                base_url=self.sync_client.base_url,
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                transport=httpx.AsyncHTTPTransport(retries=self.max_retries)
+            )
+            self._clients[loop] = client
+        return client
+
+    async def aclose(self):
+        """
+        Close the connection pool of the current event loop
+        """
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    def is_available(self) -> bool:
+        return self.sync_client.is_available()
+
+    async def get_json(self, endpoint: str, object_id, path: str, error_message: str, response_key: str = None,
+                       transform=None):
+        """
+        Get JSON response from knowledge base through the cache, see KnowledgeBaseClient.get_json
+        """
+        key = (endpoint, str(object_id))
+        # The cache may be on the network (see apps/cache.py), so it's accessed in a thread to not block the event loop
+        cached = await sync_to_async(self.sync_client.get_cached, thread_sensitive=False)(key, error_message)
+        if cached is not None:
+            return cached
+        stale = await sync_to_async(self.sync_client.cache.get_stale, thread_sensitive=False)(key)
+        try:
+            response = await self.client.get(path, headers=get_conditional_headers(stale))
+        except httpx.HTTPError as e:
+            self.sync_client.circuit_breaker.record_failure()
+            raise KnowledgeBaseUnavailable(f'{error_message}. {e}') from e
+        return await sync_to_async(self.sync_client.handle_response, thread_sensitive=False)(
+            key, response.status_code, response.json, error_message, response_key, response.headers, stale, transform
+        )
+
+    async def get_instance_from_class(self, class_id):
+        """
+        Get instance from class
+        API endpoint : /api/instance?class={class_id}
+        :param class_id: ID of class
+        :return: Instance list in JSON format
+        """
+        return await self.get_json('instance_from_class', class_id, f'/api/instance?class={class_id}', 'Error when getting instance from class', 'instance')
+
+    async def get_indexed_instances_from_class(self, class_id):
+        """
+        Get instance from class converted to IndexedInstance, see KnowledgeBaseClient.get_indexed_instances_from_class
+        :param class_id: ID of class
+        :return: List of IndexedInstance
+        """
+        return await self.get_json('indexed_instance_from_class', class_id, f'/api/instance?class={class_id}', 'Error when getting instance from class', 'instance', index_instances)
+
+    async def get_instance(self, instance_id):
+        """
+        Get instance by ID
+        API endpoint : /api/instance/{instance_id}
+        :param instance_id: ID of instance
+        :return: Instance in JSON format
+        """
+        return await self.get_json('instance', instance_id, f'/api/instance/{instance_id}', 'Error when getting instance from knowledge base')
+
+    async def get_instances(self, instance_ids) -> dict:
+        """
+        Get multiple instances by ID concurrently, the number of connections is bounded by the pool size
+        :param instance_ids: List of instance ID, duplicated ID is requested once
+        :return: Dict of instance ID (as string) to instance in JSON format
+        """
+        unique_ids = list(dict.fromkeys(str(instance_id) for instance_id in instance_ids))
+        instances = await asyncio.gather(*(self.get_instance(instance_id) for instance_id in unique_ids))
+        return dict(zip(unique_ids, instances))
+
+    async def get_instance_names(self, instance_ids) -> dict:
+        """
+        Get name of multiple instances, the name is memoized separately from the full instance
+        :param instance_ids: List of instance ID
+        :return: Dict of instance ID (as string) to instance name
+        """
+        names = {}
+        missing_ids = []
+        cache_get = sync_to_async(self.sync_client.cache.get, thread_sensitive=False)
+        cache_set = sync_to_async(self.sync_client.cache.set, thread_sensitive=False)
+        for instance_id in dict.fromkeys(str(i) for i in instance_ids):
+            name = await cache_get(('instance_name', instance_id))
+            if name is None:
+                missing_ids.append(instance_id)
+            else:
+                names[instance_id] = name
+        for instance_id, instance in (await self.get_instances(missing_ids)).items():
+            names[instance_id] = instance['name']
+            await cache_set(('instance_name', instance_id), instance['name'])
+        return names
+
+
+async_knowledge_base = AsyncKnowledgeBaseClient(knowledge_base)
+
+
+def invalidate_cache(endpoint: str = None, object_id=None):
+    """
+    Invalidate cached knowledge base response of the shared client
+    :param endpoint: Endpoint name (class, property_type, instance_from_class, instance), invalidate all if not provided
+    :param object_id: ID in the endpoint, invalidate whole endpoint if not provided
+    """
+    knowledge_base.invalidate_cache(endpoint, object_id)
+
+
+def get_all_class():
     """
     Get all class in knowledge base
     API endpoint : /api/class
     :return: Class list in JSON format
     """
-    url = f'{KNOWLEDGE_BASE_URL}/api/class'
-    response = requests.get(url)
-    if response.status_code != 200:
-        raise Exception(f'Error when getting all class from knowledge base. Status code: {response.status_code}')
-    return response.json()['class']
+    return knowledge_base.get_all_class()
 
 
-def get_class(class_id):  # pragma: no cover
+def get_class(class_id):
     """
     Get class by ID
     API endpoint : /api/class?class={class_id}
     :param class_id: ID of class
     :return: Class in JSON format
     """
-    url = f'{KNOWLEDGE_BASE_URL}/api/class?class={class_id}'
-    response = requests.get(url)
-    if response.status_code != 200:
-        raise Exception(f'Error when getting class from knowledge base. Status code: {response.status_code}')
-    return response.json()['class']
+    return knowledge_base.get_class(class_id)
 
 
-def get_property_type_from_class(class_id):  # pragma: no cover
+def get_property_type_from_class(class_id):
     """
     Get property type from class
     API endpoint : /api/property_type?class={class_id}
     :param class_id: ID of class
     :return: Property type list in JSON format
     """
-    url = f'{KNOWLEDGE_BASE_URL}/api/property_type?class={class_id}'
-    response = requests.get(url)
-    if response.status_code != 200:
-        raise Exception(f'Error when getting property type from class. Status code: {response.status_code}')
-    return response.json()['property_type']
+    return knowledge_base.get_property_type_from_class(class_id)
 
 
-def get_instance_from_class(class_id):  # pragma: no cover
+def get_instance_from_class(class_id):
     """
     Get instance from class
     API endpoint : /api/instance?class={class_id}
     :param class_id: ID of class
     :return: Instance list in JSON format
     """
-    url = f'{KNOWLEDGE_BASE_URL}/api/instance?class={class_id}'
-    response = requests.get(url)
-    if response.status_code != 200:
-        raise Exception(f'Error when getting instance from class. Status code: {response.status_code}')
-    return response.json()['instance']
+    return knowledge_base.get_instance_from_class(class_id)
 
 
-def get_instance(instance_id):  # pragma: no cover
+def get_instance(instance_id):
     """
     Get instance by ID
     API endpoint : /api/instance/{instance_id}
     :param instance_id: ID of instance
     :return: Instance in JSON format
     """
-    url = f'{KNOWLEDGE_BASE_URL}/api/instance/{instance_id}'
-    response = requests.get(url)
-    if response.status_code != 200:
-        raise Exception(f'Error when getting instance from knowledge base. Status code: {response.status_code}')
-    return response.json()
+    return knowledge_base.get_instance(instance_id)
+
+
+def get_instances(instance_ids):
+    """
+    Get multiple instances by ID concurrently
+    API endpoint : /api/instance/{instance_id}
+    :param instance_ids: List of instance ID
+    :return: Dict of instance ID (as string) to instance in JSON format
+    """
+    return knowledge_base.get_instances(instance_ids)
+
+
+def get_instance_names(instance_ids):
+    """
+    Get name of multiple instances by ID
+    :param instance_ids: List of instance ID
+    :return: Dict of instance ID (as string) to instance name
+    """
+    return knowledge_base.get_instance_names(instance_ids)
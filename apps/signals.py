@@ -0,0 +1,42 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from apps.models import QuestionModel, TextCustomQuestion, ImageCustomQuestion, QuestionCategory, GameMode, \
+    LeaderboardEntry, UserCategoryWeight
+from apps.question_pool import question_pool
+from apps.utils import invalidate_leaderboard, invalidate_user_weight
+
+
+@receiver(post_save, sender=QuestionModel)
+@receiver(post_save, sender=TextCustomQuestion)
+@receiver(post_save, sender=ImageCustomQuestion)
+@receiver(post_save, sender=QuestionCategory)
+@receiver(post_save, sender=GameMode)
+@receiver(post_delete, sender=QuestionModel)
+@receiver(post_delete, sender=TextCustomQuestion)
+@receiver(post_delete, sender=ImageCustomQuestion)
+@receiver(post_delete, sender=QuestionCategory)
+@receiver(post_delete, sender=GameMode)
+def invalidate_question_pool(sender, **kwargs):
+    question_pool.invalidate()
+    # Other workers may rebuild the shared pool before the change is committed, so invalidate again after commit
+    transaction.on_commit(question_pool.invalidate)
+
+
+@receiver(post_save, sender=LeaderboardEntry)
+@receiver(post_delete, sender=LeaderboardEntry)
+def invalidate_cached_leaderboard(sender, **kwargs):
+    invalidate_leaderboard()
+
+
+@receiver(post_save, sender=UserCategoryWeight)
+def invalidate_cached_user_weight(sender, instance, **kwargs):
+    invalidate_user_weight(instance.user_id)
+
+
+# Weights of the deleted category are deleted by cascade, which doesn't send signal per row without a post_delete
+# receiver on UserCategoryWeight
+@receiver(post_delete, sender=QuestionCategory)
+def invalidate_cached_user_weight_of_category(sender, **kwargs):
+    invalidate_user_weight()
@@ -1,13 +1,47 @@
+import os
+import shutil
+import tempfile
+import time
+from io import StringIO, BytesIO
+from unittest import mock
+
+from PIL import Image
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
-from apps.models import TextCustomQuestion, QuestionCategory, GameMode, ImageCustomQuestion
-from apps.question import generate_question, FailedToGenerateQuestion
-from apps.utils import create_all_weighted
+from apps.async_question import agenerate_question_from_model
+from apps.cache import NamespaceCache, SharedTTLCache
+from apps.image_storage import CUSTOM_QUESTION_IMAGE_DIRECTORY, CUSTOM_QUESTION_IMAGE_SIZE
+from apps.knowledge_base_snapshot import sync_knowledge_base, knowledge_base_snapshot
+from apps.knowledge_base_stub import KnowledgeBaseStubServer, generate_dataset, get_property_type_id, \
+    create_stub_client
+from apps.models import TextCustomQuestion, QuestionCategory, GameMode, ImageCustomQuestion, Game, UserCategoryWeight, \
+    QuestionModel, QuestionHistory, KnowledgeBaseInstance, KnowledgeBasePropertyValue, KnowledgeBaseSync
+from apps.question import generate_question, FailedToGenerateQuestion, NoFeasibleQuestion, \
+    generate_single_right_question, generate_text_question, InstanceChoiceCollector
+from apps.question_buffer import QuestionBuffer
+from apps.question_pool import question_pool, QuestionPool
+from apps.question_template import compile_question_template
+from apps.seed_api import TTLCache, CircuitBreaker, KnowledgeBaseClient, KnowledgeBaseUnavailable, \
+    AsyncKnowledgeBaseClient, IndexedInstance, KnowledgeBaseError, knowledge_base, TieredTTLCache
+from apps.utils import create_all_weighted, get_user_rank, get_user_highscore, update_leaderboard, save_game_weight, \
+    create_weight_for_category, generate_leaderboard, create_weight_from_database
 
 
 class BaseTestCase(TestCase):
     def setUp(self):
+        # Question pool and the shared cache are kept in memory between tests while the database is rolled back
+        cache.clear()
+        question_pool.invalidate()
         self.username = 'testuser'
         self.password = 'testpassword'
         self.user = User.objects.create_user(
@@ -32,16 +66,16 @@ class BaseTestCase(TestCase):
         for i in range(5):
             ImageCustomQuestion.objects.create(
                 question="Dummy question",
-                choices=f'["{i}","{i + 1}","{i + 2}","{i + 3}"]',
-                answer=f'["{i}"]',
+                choices=[f"{i}", f"{i + 1}", f"{i + 2}", f"{i + 3}"],
+                answer=[f"{i}"],
                 difficulty_level="easy",
                 category=question_category,
                 active=True
             )
             TextCustomQuestion.objects.create(
                 question="Dummy question",
-                choices=f'["{i}","{i + 1}","{i + 2}","{i + 3}"]',
-                answer=f'["{i}"]',
+                choices=[f"{i}", f"{i + 1}", f"{i + 2}", f"{i + 3}"],
+                answer=[f"{i}"],
                 difficulty_level="easy",
                 category=question_category,
                 active=True
@@ -55,8 +89,8 @@ class TestQuestionGenerator(TestCase):
         for i in range(5):
             TextCustomQuestion.objects.create(
                 question="Dummy question",
-                choices=f'["{i}","{i+1}","{i+2}","{i+3}"]',
-                answer=f'["{i}"]',
+                choices=[f"{i}", f"{i+1}", f"{i+2}", f"{i+3}"],
+                answer=[f"{i}"],
                 difficulty_level="easy",
                 category=question_category,
                 active=True
@@ -71,8 +105,8 @@ class TestQuestionGenerator(TestCase):
         for i in range(5):
             TextCustomQuestion.objects.create(
                 question="Dummy question",
-                choices=f'["{i}","{i + 1}"]',
-                answer=f'["{i}"]',
+                choices=[f"{i}", f"{i + 1}"],
+                answer=[f"{i}"],
                 difficulty_level="easy",
                 category=question_category,
                 active=True
@@ -87,8 +121,8 @@ class TestQuestionGenerator(TestCase):
         for i in range(5):
             ImageCustomQuestion.objects.create(
                 question="Dummy question",
-                choices=f'["{i}","{i + 1}","{i + 2}","{i + 3}"]',
-                answer=f'["{i}"]',
+                choices=[f"{i}", f"{i + 1}", f"{i + 2}", f"{i + 3}"],
+                answer=[f"{i}"],
                 difficulty_level="easy",
                 category=question_category,
                 active=True
@@ -103,8 +137,8 @@ class TestQuestionGenerator(TestCase):
         for i in range(5):
             ImageCustomQuestion.objects.create(
                 question="Dummy question",
-                choices=f'["{i}","{i + 1}"]',
-                answer=f'["{i}"]',
+                choices=[f"{i}", f"{i + 1}"],
+                answer=[f"{i}"],
                 difficulty_level="easy",
                 category=question_category,
                 active=True
@@ -130,8 +164,8 @@ class TestQuestionGeneratorWithUser(BaseTestCase):
         for i in range(5):
             TextCustomQuestion.objects.create(
                 question="Dummy question",
-                choices=f'["{i}","{i+1}","{i+2}","{i+3}"]',
-                answer=f'["{i}"]',
+                choices=[f"{i}", f"{i+1}", f"{i+2}", f"{i+3}"],
+                answer=[f"{i}"],
                 difficulty_level="easy",
                 category=question_category,
                 active=True
@@ -147,8 +181,8 @@ class TestQuestionGeneratorWithUser(BaseTestCase):
         for i in range(5):
             TextCustomQuestion.objects.create(
                 question="Dummy question",
-                choices=f'["{i}","{i + 1}"]',
-                answer=f'["{i}"]',
+                choices=[f"{i}", f"{i + 1}"],
+                answer=[f"{i}"],
                 difficulty_level="easy",
                 category=question_category,
                 active=True
@@ -164,8 +198,8 @@ class TestQuestionGeneratorWithUser(BaseTestCase):
         for i in range(5):
             ImageCustomQuestion.objects.create(
                 question="Dummy question",
-                choices=f'["{i}","{i + 1}","{i + 2}","{i + 3}"]',
-                answer=f'["{i}"]',
+                choices=[f"{i}", f"{i + 1}", f"{i + 2}", f"{i + 3}"],
+                answer=[f"{i}"],
                 difficulty_level="easy",
                 category=question_category,
                 active=True
@@ -181,8 +215,8 @@ class TestQuestionGeneratorWithUser(BaseTestCase):
         for i in range(5):
             ImageCustomQuestion.objects.create(
                 question="Dummy question",
-                choices=f'["{i}","{i + 1}"]',
-                answer=f'["{i}"]',
+                choices=[f"{i}", f"{i + 1}"],
+                answer=[f"{i}"],
                 difficulty_level="easy",
                 category=question_category,
                 active=True
@@ -200,6 +234,815 @@ class TestGenerateCommandUsingCommandLine(BaseTestCase):
         call_command('generatequestion')
 
 
+class TestCheckQueryPlansCommand(BaseTestCase):
+    def test_check_query_plans(self):
+        from django.core.management import call_command
+        game_count = Game.objects.count()
+        call_command('checkqueryplans', stdout=StringIO())
+        call_command('checkqueryplans', rows=200, force=True, stdout=StringIO())
+        # Seeded rows are rolled back
+        self.assertEqual(Game.objects.count(), game_count)
+
+    def test_refuse_to_seed_without_debug(self):
+        from django.core.management import call_command, CommandError
+        with self.assertRaises(CommandError):
+            call_command('checkqueryplans', rows=200, stdout=StringIO())
+        self.assertFalse(User.objects.filter(username__startswith='queryplan_').exists())
+
+    def test_find_sequential_scans(self):
+        from apps.management.commands.checkqueryplans import find_sequential_scans
+        self.assertEqual(find_sequential_scans('Seq Scan on apps_game  (cost=0.00..1.01 rows=1 width=8)'), ['apps_game'])
+        self.assertEqual(find_sequential_scans('Index Scan using game_user_finished_idx on apps_game'), [])
+        self.assertEqual(find_sequential_scans('2 0 0 SCAN apps_game'), ['apps_game'])
+        self.assertEqual(find_sequential_scans('5 0 0 SCAN apps_leaderboardentry USING INDEX leaderboard_rank_idx'), [])
+        self.assertEqual(find_sequential_scans('3 0 0 SEARCH apps_game USING INDEX game_user_finished_idx (user_id=?)'), [])
+
+
+class TestUserRank(BaseTestCase):
+    def create_completed_game(self, user, score):
+        game = Game.objects.create(user=user, score=score, finished=True, completed=True)
+        update_leaderboard(game)
+        return game
+
+    def test_user_rank(self):
+        other_user = User.objects.create_user(username='otheruser', password='testpassword')
+        self.create_completed_game(self.user, 100)
+        self.create_completed_game(other_user, 200)
+        self.assertEqual(get_user_rank(other_user.id), 1)
+        self.assertEqual(get_user_rank(self.user.id), 2)
+        self.assertEqual(get_user_highscore(self.user.id), 100)
+        self.assertEqual(get_user_highscore(other_user.id), 200)
+
+    def test_user_rank_tie_use_user_order(self):
+        other_user = User.objects.create_user(username='otheruser', password='testpassword')
+        self.create_completed_game(other_user, 100)
+        self.create_completed_game(self.user, 100)
+        self.assertEqual(get_user_rank(self.user.id), 1)
+        self.assertEqual(get_user_rank(other_user.id), 2)
+
+    def test_user_rank_not_exist(self):
+        self.assertEqual(get_user_rank(0), 0)
+        self.assertEqual(get_user_highscore(0), 0)
+
+
+class TestSaveGameWeight(BaseTestCase):
+    def save_weight(self, weight):
+        game = Game.objects.create(user=self.user, weight=weight)
+        with CaptureQueriesContext(connection) as queries:
+            save_game_weight(game)
+        return len(queries)
+
+    def test_save_game_weight(self):
+        categories = [QuestionCategory.objects.create(name=f"Dummy category {i}") for i in range(3)]
+        UserCategoryWeight.objects.create(user=self.user, category=categories[0], weight=1.0)
+        self.save_weight({str(categories[0].id): 5.0, str(categories[1].id): 3.0, '0': 1.0})
+        weight = dict(
+            UserCategoryWeight.objects.filter(user=self.user, category__in=categories).values_list('category_id', 'weight')
+        )
+        self.assertEqual(weight, {categories[0].id: 5.0, categories[1].id: 3.0})
+
+    def test_save_game_weight_query_count_does_not_grow(self):
+        categories = [QuestionCategory.objects.create(name=f"Dummy category {i}") for i in range(20)]
+        one_category = self.save_weight({categories[0].id: 1.0})
+        all_categories = self.save_weight({c.id: 2.0 for c in categories})
+        self.assertEqual(one_category, all_categories)
+        self.assertEqual(UserCategoryWeight.objects.filter(user=self.user, weight=2.0).count(), 20)
+
+
+class TestCreateWeight(BaseTestCase):
+    def test_create_weight_for_new_user(self):
+        QuestionCategory.objects.create(name="Dummy category")
+        with CaptureQueriesContext(connection) as first_signup:
+            new_user = User.objects.create_user(username='newuser', password='testpassword')
+        self.assertEqual(
+            UserCategoryWeight.objects.filter(user=new_user).count(),
+            QuestionCategory.objects.count()
+        )
+        for i in range(10):
+            User.objects.create_user(username=f'user{i}', password='testpassword')
+        # Signup cost must not grow with the number of users
+        with CaptureQueriesContext(connection) as later_signup:
+            User.objects.create_user(username='lastuser', password='testpassword')
+        self.assertEqual(len(first_signup), len(later_signup))
+
+    def test_create_weight_for_new_category(self):
+        other_user = User.objects.create_user(username='otheruser', password='testpassword')
+        category = QuestionCategory.objects.create(name="Dummy category")
+        create_weight_for_category(category)
+        create_weight_for_category(category)
+        self.assertEqual(
+            set(UserCategoryWeight.objects.filter(category=category).values_list('user_id', flat=True)),
+            {self.user.id, other_user.id}
+        )
+
+    def test_create_all_weighted_only_create_missing(self):
+        category = QuestionCategory.objects.create(name="Dummy category")
+        UserCategoryWeight.objects.create(user=self.user, category=category, weight=5.0)
+        create_all_weighted()
+        create_all_weighted()
+        self.assertEqual(UserCategoryWeight.objects.get(user=self.user, category=category).weight, 5.0)
+
+    def test_generate_question_does_not_create_weight(self):
+        self.generate_dummy_question()
+        UserCategoryWeight.objects.filter(user=self.user).delete()
+        question = generate_question(target_user=self.user)
+        self.assertEqual(question['difficulty_level'], 'easy')
+        self.assertFalse(UserCategoryWeight.objects.filter(user=self.user).exists())
+
+
+class TestQuestionTemplate(TestCase):
+    def test_compile(self):
+        template = compile_question_template("What is {name} ({code})? Is {name} in {x")
+        self.assertEqual(template.placeholders, ['name', 'code', 'name'])
+        self.assertEqual(template.property_names, ['name', 'code'])
+        self.assertEqual(template.segments, ['What is ', ' (', ')? Is ', ' in {x'])
+        self.assertIs(compile_question_template("What is {name} ({code})? Is {name} in {x"), template)
+
+    def test_render(self):
+        template = compile_question_template("{name} is {code}")
+        # Value that look like a placeholder is not rendered again
+        self.assertEqual(template.render({'name': '{code}', 'code': 'A'}), '{code} is A')
+        self.assertEqual(compile_question_template("No placeholder").render({}), 'No placeholder')
+
+    def test_question_model_use_template(self):
+        question = QuestionModel(question="Which one belongs to {name}?")
+        self.assertEqual(question.get_property_in_question(), ['name'])
+        self.assertIs(question.get_template(), compile_question_template("Which one belongs to {name}?"))
+
+
+class TestInstanceChoiceCollector(TestCase):
+    def test_resolve_more_only_on_duplicated_name(self):
+        collector = InstanceChoiceCollector(1, [2, 3, 4, 5, 6], 4)
+        self.assertEqual(collector.unresolved, [1, 2, 3, 4])
+        collector.add_names({'1': 'A', '2': 'B', '3': 'B', '4': 'A'})
+        self.assertEqual(collector.unresolved, [5, 6])
+        collector.add_names({'5': 'C', '6': 'D'})
+        self.assertEqual(collector.unresolved, [])
+        self.assertEqual(collector.answer_name, 'A')
+        self.assertEqual(collector.choice_list, ['B', 'C', 'D'])
+
+    def test_not_enough_distinct_name(self):
+        collector = InstanceChoiceCollector(1, [2, 3], 4)
+        collector.add_names({'1': 'A', '2': 'A', '3': 'B'})
+        self.assertEqual(collector.unresolved, [])
+        self.assertEqual(collector.choice_list, ['B'])
+
+
+class TestKnowledgeBaseCache(TestCase):
+    def test_cache_hit_and_miss(self):
+        cache = TTLCache(max_size=10, ttl=60)
+        self.assertIsNone(cache.get(('instance', '1')))
+        cache.set(('instance', '1'), {'name': 'Dummy'})
+        self.assertEqual(cache.get(('instance', '1')), {'name': 'Dummy'})
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_cache_expire(self):
+        cache = TTLCache(max_size=10, ttl=60)
+        cache.set(('instance', '1'), {'name': 'Dummy'}, ttl=0)
+        self.assertIsNone(cache.get(('instance', '1')))
+        self.assertEqual(len(cache), 0)
+
+    def test_cache_evict_least_recently_used(self):
+        cache = TTLCache(max_size=2, ttl=60)
+        cache.set(('instance', '1'), 1)
+        cache.set(('instance', '2'), 2)
+        cache.get(('instance', '1'))
+        cache.set(('instance', '3'), 3)
+        self.assertIn(('instance', '1'), cache)
+        self.assertNotIn(('instance', '2'), cache)
+        self.assertIn(('instance', '3'), cache)
+
+    def test_cache_invalidate(self):
+        cache = TTLCache(max_size=10, ttl=60)
+        cache.set(('instance', '1'), 1)
+        cache.set(('instance', '2'), 2)
+        cache.set(('class', '1'), 1)
+        cache.invalidate(('instance', '1'))
+        self.assertNotIn(('instance', '1'), cache)
+        cache.invalidate_endpoint('instance')
+        self.assertNotIn(('instance', '2'), cache)
+        self.assertIn(('class', '1'), cache)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_cache_revalidate(self):
+        cache = TTLCache(max_size=10, ttl=60)
+        cache.set(('instance', '1'), 1, ttl=0, validators={'ETag': '"1"'})
+        self.assertIsNone(cache.get(('instance', '1')))
+        self.assertEqual(cache.get_stale(('instance', '1')), (1, {'ETag': '"1"'}))
+        self.assertEqual(cache.revalidate(('instance', '1')), 1)
+        self.assertEqual(cache.get(('instance', '1')), 1)
+        self.assertEqual(cache.stats()['revalidations'], 1)
+        cache.expire()
+        self.assertNotIn(('instance', '1'), cache)
+        self.assertIsNotNone(cache.get_stale(('instance', '1')))
+
+
+class TestKnowledgeBaseClient(TestCase):
+    def test_circuit_breaker_open_after_failures(self):
+        circuit_breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        circuit_breaker.record_failure()
+        self.assertTrue(circuit_breaker.allow_request())
+        circuit_breaker.record_failure()
+        self.assertTrue(circuit_breaker.is_open)
+        self.assertFalse(circuit_breaker.allow_request())
+        circuit_breaker.record_success()
+        self.assertFalse(circuit_breaker.is_open)
+        self.assertTrue(circuit_breaker.allow_request())
+
+    def test_circuit_breaker_half_open_after_reset_timeout(self):
+        circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        circuit_breaker.record_failure()
+        self.assertTrue(circuit_breaker.allow_request())
+
+    def test_client_fail_fast_when_knowledge_base_down(self):
+        # Nothing is listening on port 1, so the connection is refused immediately
+        client = KnowledgeBaseClient(base_url='http://127.0.0.1:1', max_retries=0, failure_threshold=1, reset_timeout=60)
+        self.assertTrue(client.is_available())
+        self.assertRaises(KnowledgeBaseUnavailable, client.get_all_class)
+        self.assertFalse(client.is_available())
+        self.assertRaises(KnowledgeBaseUnavailable, client.get_instance, 1)
+
+    def test_client_use_cache(self):
+        client = KnowledgeBaseClient(base_url='http://127.0.0.1:1', max_retries=0)
+        client.cache.set(('instance', '1'), {'id': 1, 'name': 'Dummy'})
+        self.assertEqual(client.get_instance(1), {'id': 1, 'name': 'Dummy'})
+        client.invalidate_cache('instance', 1)
+        self.assertRaises(KnowledgeBaseUnavailable, client.get_instance, 1)
+
+    def test_client_get_instance_names_from_cache(self):
+        client = KnowledgeBaseClient(base_url='http://127.0.0.1:1', max_retries=0)
+        client.cache.set(('instance', '1'), {'id': 1, 'name': 'First'})
+        client.cache.set(('instance', '2'), {'id': 2, 'name': 'Second'})
+        self.assertEqual(client.get_instance_names([1, '2', 1]), {'1': 'First', '2': 'Second'})
+        self.assertIn(('instance_name', '1'), client.cache)
+
+    def test_indexed_instance(self):
+        instance = IndexedInstance.from_json({
+            'id': 1,
+            'name': 'Dummy',
+            'class': 2,
+            'property_values': [
+                {'property_type': {'id': 10, 'name': 'code', 'raw_type': 'string'}, 'raw_value': 'A'},
+                {'property_type': {'id': 11, 'name': 'picture', 'raw_type': 'image'}, 'raw_value': '/a.png'},
+                {'property_type': {'id': 10, 'name': 'code', 'raw_type': 'string'}, 'raw_value': 'B'}
+            ]
+        })
+        self.assertEqual(instance.property_values_by_id[11].raw_value, '/a.png')
+        self.assertEqual(instance.property_values_by_name['code'].raw_value, 'A')
+        self.assertEqual(instance.to_json()['property_values'][1], {
+            'property_type': {'id': 11, 'name': 'picture', 'raw_type': 'image'}, 'raw_value': '/a.png'
+        })
+        self.assertFalse(hasattr(instance, '__dict__'))
+
+    def test_client_cache_indexed_instances_only(self):
+        client = KnowledgeBaseClient(base_url='http://127.0.0.1:1', max_retries=0)
+        client.cache.set(('indexed_instance_from_class', '1'), [])
+        self.assertEqual(client.get_indexed_instances_from_class(1), [])
+        self.assertNotIn(('instance_from_class', '1'), client.cache)
+        client.invalidate_cache('instance_from_class', 1)
+        self.assertNotIn(('indexed_instance_from_class', '1'), client.cache)
+
+    async def test_async_client_fail_fast_when_knowledge_base_down(self):
+        client = AsyncKnowledgeBaseClient(
+            KnowledgeBaseClient(base_url='http://127.0.0.1:1', max_retries=0, failure_threshold=1, reset_timeout=60),
+            max_retries=0
+        )
+        with self.assertRaises(KnowledgeBaseUnavailable):
+            await client.get_instance(1)
+        self.assertFalse(client.is_available())
+        await client.aclose()
+
+    async def test_async_client_get_instance_names_from_cache(self):
+        client = AsyncKnowledgeBaseClient(KnowledgeBaseClient(base_url='http://127.0.0.1:1', max_retries=0))
+        client.sync_client.cache.set(('instance', '1'), {'id': 1, 'name': 'First'})
+        client.sync_client.cache.set(('instance_name', '2'), 'Second')
+        self.assertEqual(await client.get_instance_names([1, '2', 1]), {'1': 'First', '2': 'Second'})
+
+
+class TestKnowledgeBaseStub(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.stub = KnowledgeBaseStubServer(generate_dataset(class_count=2, instance_per_class=20)).start()
+        self.addCleanup(self.stub.stop)
+        self.category = QuestionCategory.objects.create(name="Dummy category")
+        self.game_mode = GameMode.objects.create(name="Dummy mode", allow_answer_mode="single_right, text")
+
+    def create_seed_question(self, answer_property, answer_mode="single_right"):
+        return QuestionModel.objects.create(
+            main_class_id=1,
+            question="Which one belongs to {name}?",
+            answer_property_id=get_property_type_id(1, answer_property),
+            answer_mode=answer_mode,
+            difficulty_level="easy",
+            category=self.category
+        )
+
+    def test_client(self):
+        client = KnowledgeBaseClient(base_url=self.stub.url)
+        self.assertEqual(len(client.get_all_class()), 2)
+        self.assertEqual(client.get_class(1)['name'], 'Class 1')
+        self.assertEqual(len(client.get_property_type_from_class(1)), 4)
+        self.assertEqual(len(client.get_instance_from_class(2)), 20)
+        self.assertEqual(client.get_instance(21)['class'], 2)
+        self.assertRaises(KnowledgeBaseError, client.get_instance, 999)
+
+    def test_client_indexed_instances(self):
+        client = KnowledgeBaseClient(base_url=self.stub.url)
+        instances = client.get_indexed_instances_from_class(1)
+        self.assertEqual([i.to_json() for i in instances], client.get_instance_from_class(1))
+        self.assertEqual(instances[0].property_values_by_name['code'].raw_value, 'C000001')
+
+    def test_stub_client_use_own_cache(self):
+        client = create_stub_client(self.stub)
+        self.assertEqual(len(client.get_all_class()), 2)
+        self.assertEqual(client.get_class(2)['id'], 2)
+        self.assertEqual(len(client.get_property_type_from_class(2)), 4)
+        self.assertEqual(client.get_instance(1)['id'], 1)
+        # The shared client and its cache are not touched
+        self.assertNotEqual(knowledge_base.base_url, self.stub.url)
+        self.assertNotIn(('instance', '1'), knowledge_base.cache)
+
+    def test_generate_single_right_question(self):
+        client = create_stub_client(self.stub)
+        for answer_property in ['code', 'picture', 'related']:
+            question = generate_single_right_question(self.create_seed_question(answer_property), self.game_mode,
+                                                      seed_knowledge_base=client)
+            self.assertEqual(len(set(question['choices'])), 4)
+            self.assertIn(question['answer'], question['choices'])
+            self.assertNotIn('{', question['rendered_question'])
+        # Related instance is shown by its name
+        self.assertTrue(question['answer'].startswith('Class 2 instance'))
+
+    def test_generate_text_question(self):
+        question = generate_text_question(self.create_seed_question('code', 'text'), self.game_mode,
+                                          seed_knowledge_base=create_stub_client(self.stub))
+        self.assertEqual(question['choices'], [])
+        self.assertRegex(question['answer'], r'^C\d{6}$')
+
+    def test_generate_question_with_seed_question(self):
+        self.create_seed_question('related')
+        GameMode.objects.create(name="Single right mode", allow_answer_mode="single_right")
+        with mock.patch('apps.question.get_seed_knowledge_base', return_value=create_stub_client(self.stub)):
+            question = generate_question(question_mode="seed_question")
+        self.assertEqual(question['question_mode'], 'seed_question')
+
+    async def test_async_generate_single_right_question(self):
+        question = await sync_to_async(self.create_seed_question)('related')
+        client = AsyncKnowledgeBaseClient(create_stub_client(self.stub))
+        with mock.patch('apps.async_question.get_async_seed_knowledge_base', return_value=client):
+            generated = await agenerate_question_from_model(question, 'seed_question', self.game_mode)
+        await client.aclose()
+        self.assertEqual(len(set(generated['choices'])), 4)
+
+    def test_replay_and_record(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # Record from the stub as the upstream, then replay the recorded responses without the upstream
+            with KnowledgeBaseStubServer(responses={}, upstream=self.stub.url) as recorder:
+                KnowledgeBaseClient(base_url=recorder.url).get_instance_from_class(1)
+                recorder.save(f'{directory}/knowledge_base.json')
+            with KnowledgeBaseStubServer.from_file(f'{directory}/knowledge_base.json') as replay:
+                client = KnowledgeBaseClient(base_url=replay.url)
+                self.assertEqual(len(client.get_instance_from_class(1)), 20)
+                self.assertRaises(KnowledgeBaseError, client.get_instance_from_class, 2)
+
+    def test_conditional_request(self):
+        client = KnowledgeBaseClient(base_url=self.stub.url, cache=TTLCache(max_size=10, ttl=0))
+        instances = client.get_instance_from_class(1)
+        self.assertIn('ETag', client.cache.get_stale(('instance_from_class', '1'))[1])
+        # Expired response is revalidated and the parsed response is reused
+        self.assertIs(client.get_instance_from_class(1), instances)
+        self.assertEqual(self.stub.not_modified_count, 1)
+        self.assertEqual(client.cache.stats()['revalidations'], 1)
+        # Modified response is downloaded again
+        self.stub.responses['/api/instance?class=1'] = {'instance': instances[:5]}
+        self.assertEqual(len(client.get_instance_from_class(1)), 5)
+        self.assertEqual(self.stub.not_modified_count, 1)
+
+    async def test_async_conditional_request(self):
+        client = AsyncKnowledgeBaseClient(KnowledgeBaseClient(base_url=self.stub.url, cache=TTLCache(max_size=10, ttl=0)))
+        instances = await client.get_instance_from_class(1)
+        self.assertIs(await client.get_instance_from_class(1), instances)
+        self.assertEqual(self.stub.not_modified_count, 1)
+        await client.aclose()
+
+    def test_latency(self):
+        self.stub.latency = 0.05
+        start = time.monotonic()
+        KnowledgeBaseClient(base_url=self.stub.url).get_all_class()
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+    def test_benchmark_command(self):
+        from django.core.management import call_command
+        output = StringIO()
+        call_command('benchmarkseedquestion', count=5, instances=10, stdout=output)
+        self.assertIn('single_right (related)', output.getvalue())
+
+    def test_stub_command_refuse_to_record_from_itself(self):
+        from django.core.management import call_command, CommandError
+        with self.assertRaises(CommandError):
+            call_command('runknowledgebasestub', port=8000, record='knowledge_base.json',
+                         upstream='http://localhost:8000', stdout=StringIO())
+
+
+class TestKnowledgeBaseSnapshot(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.stub = KnowledgeBaseStubServer(generate_dataset(class_count=2, instance_per_class=20)).start()
+        self.addCleanup(self.stub.stop)
+        self.client_to_stub = KnowledgeBaseClient(base_url=self.stub.url)
+        self.category = QuestionCategory.objects.create(name="Dummy category")
+        self.game_mode = GameMode.objects.create(name="Single right mode", allow_answer_mode="single_right")
+
+    def test_sync(self):
+        sync = sync_knowledge_base(self.client_to_stub)
+        self.assertEqual(sync.class_count, 2)
+        self.assertEqual(sync.property_type_count, 8)
+        self.assertEqual(sync.instance_count, 40)
+        self.assertEqual(KnowledgeBasePropertyValue.objects.count(), 160)
+        self.assertTrue(question_pool.has_knowledge_base_snapshot())
+        # Sync again replace the snapshot
+        sync_knowledge_base(self.client_to_stub)
+        self.assertEqual(KnowledgeBaseInstance.objects.count(), 40)
+        self.assertEqual(KnowledgeBasePropertyValue.objects.count(), 160)
+
+    def test_snapshot_same_as_knowledge_base(self):
+        sync_knowledge_base(self.client_to_stub)
+
+        def normalize(instances):
+            return sorted(
+                (dict(i, property_values=sorted(i['property_values'], key=lambda v: v['property_type']['id'])) for i in instances),
+                key=lambda i: i['id']
+            )
+        for class_id in [1, 2]:
+            self.assertEqual(
+                normalize(knowledge_base_snapshot.get_instance_from_class(class_id)),
+                normalize(self.client_to_stub.get_instance_from_class(class_id))
+            )
+        self.assertEqual(knowledge_base_snapshot.get_instance_names([1, '21', 1]), {'1': 'Class 1 instance 1', '21': 'Class 2 instance 21'})
+        self.assertRaises(KnowledgeBaseError, knowledge_base_snapshot.get_instance_names, [999])
+
+    def test_snapshot_instances_cached_until_next_sync(self):
+        sync_knowledge_base(self.client_to_stub)
+        instances = knowledge_base_snapshot.get_indexed_instances_from_class(1)
+        with self.assertNumQueries(0):
+            self.assertIs(knowledge_base_snapshot.get_indexed_instances_from_class(1), instances)
+        # Sync that is finished by other worker is seen through the question pool
+        KnowledgeBaseSync.objects.create(finished_at=timezone.now())
+        question_pool.invalidate()
+        self.assertIsNot(knowledge_base_snapshot.get_indexed_instances_from_class(1), instances)
+
+    def test_generate_question_without_knowledge_base(self):
+        sync_knowledge_base(self.client_to_stub)
+        QuestionModel.objects.create(
+            main_class_id=1,
+            question="Which one belongs to {name}?",
+            answer_property_id=get_property_type_id(1, 'related'),
+            answer_mode="single_right",
+            difficulty_level="easy",
+            category=self.category
+        )
+        # The shared client is not pointed to the stub, so the question can only come from the snapshot
+        question = generate_question(question_mode="seed_question")
+        self.assertEqual(len(set(question['choices'])), 4)
+        self.assertTrue(question['answer'].startswith('Class 2 instance'))
+
+    async def test_async_generate_question_without_knowledge_base(self):
+        await sync_to_async(sync_knowledge_base)(self.client_to_stub)
+        question = await QuestionModel.objects.acreate(
+            main_class_id=2,
+            question="What is the code of {name}?",
+            answer_property_id=get_property_type_id(2, 'code'),
+            answer_mode="single_right",
+            difficulty_level="easy",
+            category=self.category
+        )
+        generated = await agenerate_question_from_model(question, 'seed_question', self.game_mode)
+        self.assertEqual(len(set(generated['choices'])), 4)
+
+    def test_command(self):
+        from django.core.management import call_command
+        output = StringIO()
+        call_command('syncknowledgebase', url=self.stub.url, stdout=output)
+        self.assertIn('2 classes', output.getvalue())
+        call_command('syncknowledgebase', clear=True, stdout=output)
+        self.assertFalse(KnowledgeBaseInstance.objects.exists())
+        self.assertFalse(question_pool.has_knowledge_base_snapshot())
+
+    def test_command_failed_keep_old_snapshot(self):
+        from django.core.management import call_command, CommandError
+        sync_knowledge_base(self.client_to_stub)
+        with KnowledgeBaseStubServer(responses={}) as empty_stub:
+            self.assertRaises(CommandError, call_command, 'syncknowledgebase', url=empty_stub.url, stdout=StringIO())
+        self.assertEqual(KnowledgeBaseInstance.objects.count(), 40)
+
+
+class TestQuestionPool(BaseTestCase):
+    def test_question_pool_only_active_question(self):
+        self.generate_dummy_question()
+        category = QuestionCategory.objects.get(name="Dummy category")
+        questions = question_pool.get_feasible_questions(category.id, "easy", "text_custom_question")
+        self.assertEqual(len(questions), 5)
+        question = TextCustomQuestion.objects.get(id=questions[0][0])
+        question.active = False
+        question.save()
+        questions = question_pool.get_feasible_questions(category.id, "easy", "text_custom_question")
+        self.assertNotIn(question.id, [question_id for question_id, answer_mode in questions])
+        self.assertEqual(len(questions), 4)
+
+    def test_question_pool_keyed_by_answer_mode(self):
+        self.generate_dummy_question()
+        category = QuestionCategory.objects.get(name="Dummy category")
+        questions = question_pool.get_feasible_questions(category.id, "easy", "image_custom_question")
+        self.assertEqual(len(questions), 5)
+        self.assertEqual({answer_mode for question_id, answer_mode in questions}, {"single_right"})
+        self.assertEqual(question_pool.get_feasible_questions(category.id, "hard", "image_custom_question"), [])
+        self.assertEqual(question_pool.random_game_mode("single_right").name, "Dummy mode")
+        self.assertIsNone(question_pool.random_game_mode("text"))
+
+    def test_question_pool_cache_custom_choices(self):
+        category = QuestionCategory.objects.create(name="Dummy category")
+        question = TextCustomQuestion.objects.create(
+            question="Dummy question",
+            choices=["It's", "b", "c", "d"],
+            answer=["It's"],
+            difficulty_level="easy",
+            category=category
+        )
+        GameMode.objects.create(name="Dummy mode", allow_answer_mode="single_right")
+        self.assertEqual(question_pool.get_custom_choices("text_custom_question", question.id), (("It's", "b", "c", "d"), ("It's",)))
+        # Choices are read from the pool, so they are not loaded from the database
+        with CaptureQueriesContext(connection) as queries:
+            generated = generate_question(question_mode="text_custom_question")
+        self.assertEqual(generated['answer'], "It's")
+        self.assertEqual(sorted(generated['choices']), ["It's", "b", "c", "d"])
+        self.assertFalse(any('"choices"' in q['sql'] for q in queries.captured_queries))
+
+    def test_question_history_choices(self):
+        history = QuestionHistory(choice=str(["It's", "b"]))
+        self.assertEqual(history.get_choices(), ["It's", "b"])
+        history.full_json = {'choices': ["c"]}
+        self.assertEqual(history.get_choices(), ["c"])
+
+    def test_question_pool_rebuild_after_create(self):
+        self.assertEqual(question_pool.get_all_question_mode(), [])
+        self.generate_dummy_question()
+        self.assertEqual(question_pool.get_all_question_mode(), ["text_custom_question", "image_custom_question"])
+
+
+class TestQuestionPlanner(BaseTestCase):
+    def test_plan_only_feasible_combination(self):
+        self.generate_dummy_question()
+        category = QuestionCategory.objects.get(name="Dummy category")
+        plan = question_pool.plan(["text_custom_question"], {category.id: ["easy", "medium"]}, ["easy"])
+        self.assertEqual(plan, {category.id: {"easy": ["text_custom_question"]}})
+        plan = question_pool.plan(["text_custom_question"], {category.id: ["hard"]}, ["hard"])
+        self.assertEqual(plan, {})
+
+    def test_plan_exclude_game_mode_not_allowed(self):
+        self.generate_dummy_question()
+        GameMode.objects.all().update(allow_answer_mode="text")
+        question_pool.invalidate()
+        self.assertEqual(question_pool.plan(["text_custom_question"], {}, ["easy"]), {})
+        self.assertRaises(NoFeasibleQuestion, generate_question)
+
+    def test_generate_question_with_weight_only_in_feasible_difficulty(self):
+        self.generate_dummy_question()
+        category = QuestionCategory.objects.get(name="Dummy category")
+        for i in range(10):
+            question = generate_question(custom_weight={category.id: 12.0})
+            self.assertEqual(question['difficulty_level'], "easy")
+
+    def test_generate_question_not_retry_failed_question(self):
+        question_category = QuestionCategory.objects.create(name="Dummy category")
+        TextCustomQuestion.objects.create(
+            question="Dummy question",
+            choices=["0", "1"],
+            answer=["0"],
+            difficulty_level="easy",
+            category=question_category,
+            active=True
+        )
+        GameMode.objects.create(name="Dummy mode", allow_answer_mode="single_right")
+        self.assertRaises(NoFeasibleQuestion, generate_question)
+
+
+class TestQuestionBuffer(BaseTestCase):
+    def test_refill_and_pop(self):
+        self.generate_dummy_question()
+        buffer = QuestionBuffer(size=2, enabled=True)
+        self.assertIsNone(buffer.pop(self.user.id, {}))
+        buffer.refill(self.user, {})
+        self.assertIsNotNone(buffer.pop(self.user.id, {}))
+        self.assertIsNotNone(buffer.pop(self.user.id, {}))
+        self.assertIsNone(buffer.pop(self.user.id, {}))
+        self.assertEqual(buffer.hits, 2)
+
+    def test_pop_discard_other_weight_bucket(self):
+        self.generate_dummy_question()
+        category = QuestionCategory.objects.get(name="Dummy category")
+        buffer = QuestionBuffer(size=1, enabled=True)
+        buffer.refill(self.user, {category.id: 1.0})
+        self.assertIsNone(buffer.pop(self.user.id, {category.id: 11.0}))
+        buffer.refill(self.user, {category.id: 1.0})
+        self.assertIsNotNone(buffer.pop(self.user.id, {category.id: 2.0}))
+
+    def test_pop_discard_expired_question(self):
+        self.generate_dummy_question()
+        buffer = QuestionBuffer(size=1, max_age=0, enabled=True)
+        buffer.refill(self.user, {})
+        self.assertIsNone(buffer.pop(self.user.id, {}))
+
+    def test_disabled_buffer(self):
+        self.generate_dummy_question()
+        buffer = QuestionBuffer(size=1, enabled=False)
+        buffer.refill(self.user, {})
+        self.assertIsNone(buffer.pop(self.user.id, {}))
+
+    def test_queued_refill_use_latest_weight(self):
+        buffer = QuestionBuffer(size=1, enabled=True)
+        with mock.patch.object(buffer, '_ensure_worker'):
+            buffer.request_refill(self.user, {1: 1.0})
+            buffer.request_refill(self.user, {1: 11.0})
+        self.assertEqual(buffer._queue.qsize(), 1)
+        self.assertEqual(buffer._pending[self.user.id], {1: 11.0})
+
+    def test_clear_during_refill(self):
+        buffer = QuestionBuffer(size=2, enabled=True)
+
+        def generate_question(**kwargs):
+            buffer.clear(self.user.id)
+            return {'question': 'Dummy question'}
+
+        with mock.patch('apps.question_buffer.generate_question', side_effect=generate_question):
+            buffer.refill(self.user, {})
+        self.assertIsNone(buffer.pop(self.user.id, {}))
+
+
+class TestSharedCache(BaseTestCase):
+    def test_namespace_invalidate(self):
+        namespace = NamespaceCache('dummy', ttl=60)
+        namespace.set(('a', 1), 'first')
+        namespace.set('b', 'second', group='group')
+        self.assertEqual(namespace.get(('a', 1)), 'first')
+        namespace.invalidate(group='group')
+        self.assertIsNone(namespace.get('b', group='group'))
+        self.assertEqual(namespace.get(('a', 1)), 'first')
+        namespace.invalidate()
+        self.assertIsNone(namespace.get(('a', 1)))
+        self.assertEqual(namespace.get_or_set('c', lambda: 'third'), 'third')
+        self.assertEqual(namespace.get_or_set('c', lambda: 'other'), 'third')
+
+    def test_shared_ttl_cache_revalidate(self):
+        shared = SharedTTLCache('dummy_knowledge_base', ttl=60)
+        shared.set(('instance', '1'), {'id': 1}, validators={'ETag': '"a"'})
+        shared.set(('instance', '2'), {'id': 2})
+        self.assertIn(('instance', '1'), shared)
+        shared.expire()
+        self.assertIsNone(shared.get(('instance', '1')))
+        self.assertEqual(shared.get_stale(('instance', '1')), ({'id': 1}, {'ETag': '"a"'}))
+        self.assertEqual(shared.revalidate(('instance', '1')), {'id': 1})
+        self.assertEqual(shared.get(('instance', '1')), {'id': 1})
+        shared.invalidate_endpoint('instance')
+        self.assertIsNone(shared.get_stale(('instance', '1')))
+
+    def test_tiered_cache_keep_local_endpoint_in_process(self):
+        shared = SharedTTLCache('dummy_knowledge_base', ttl=60)
+        cache = TieredTTLCache(shared, TTLCache(ttl=60), ('indexed_instance_from_class',))
+        cache.set(('indexed_instance_from_class', '1'), ['instance'])
+        cache.set(('instance', '1'), {'id': 1})
+        # Change in the shared cache from other process, the local entry is used until it's expired
+        shared.set(('indexed_instance_from_class', '1'), ['other'])
+        shared.set(('instance', '1'), {'id': 2})
+        self.assertEqual(cache.get(('indexed_instance_from_class', '1')), ['instance'])
+        self.assertEqual(cache.get(('instance', '1')), {'id': 2})
+        self.assertEqual(cache.stats()['local']['hits'], 1)
+        cache.local.expire()
+        self.assertEqual(cache.get(('indexed_instance_from_class', '1')), ['other'])
+        cache.invalidate_endpoint('indexed_instance_from_class')
+        self.assertIsNone(cache.get(('indexed_instance_from_class', '1')))
+
+    def test_leaderboard_cached_until_score_changed(self):
+        generate_leaderboard()
+        with self.assertNumQueries(0):
+            leaderboard = generate_leaderboard()
+        self.assertEqual(leaderboard[0]['score'], 0)
+        game = Game.objects.create(user=self.user, score=100, finished=True, completed=True)
+        update_leaderboard(game)
+        self.assertEqual(generate_leaderboard()[0]['score'], 100)
+
+    def test_user_weight_cached_until_game_saved(self):
+        category = QuestionCategory.objects.create(name="Dummy category")
+        UserCategoryWeight.objects.create(user=self.user, category=category, weight=0.0)
+        create_weight_from_database(self.user.id)
+        with self.assertNumQueries(0):
+            weight = create_weight_from_database(self.user.id)
+        self.assertEqual(weight[category.id], 0.0)
+        # Caller can modify the returned weight
+        weight[category.id] = 10.0
+        self.assertEqual(create_weight_from_database(self.user.id)[category.id], 0.0)
+        game = Game.objects.create(user=self.user, weight={category.id: 3.0})
+        save_game_weight(game)
+        self.assertEqual(create_weight_from_database(self.user.id)[category.id], 3.0)
+
+    def test_question_pool_shared_between_workers(self):
+        self.generate_dummy_question()
+        first_worker, second_worker = QuestionPool(), QuestionPool()
+        first_worker.get_all_question_mode()
+        with self.assertNumQueries(0):
+            second_worker.get_all_question_mode()
+        with mock.patch('apps.question_pool.QUESTION_POOL_VERSION_CHECK_INTERVAL', 0):
+            TextCustomQuestion.objects.filter(active=True).update(active=False)
+            first_worker.invalidate()
+            category = QuestionCategory.objects.get(name="Dummy category")
+            self.assertEqual(second_worker.get_feasible_questions(category.id, "easy", "text_custom_question"), [])
+
+
+class TestImageCustomQuestionUpload(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.login()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.category = QuestionCategory.objects.create(name="Dummy category")
+
+    def create_image(self, name, color, size=(1600, 1200)):
+        output = BytesIO()
+        Image.new('RGB', size, color).save(output, format='PNG')
+        return SimpleUploadedFile(name, output.getvalue(), content_type='image/png')
+
+    def post_question(self, url, colors=((255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0))):
+        return self.client.post(url, {
+            'question': 'Which one is red?',
+            'choices': [self.create_image(f'{i}.png', color) for i, color in enumerate(colors)],
+            'answer': [self.create_image('0.png', colors[0])],
+            'difficulty_level': 'easy',
+            'category': self.category.id
+        })
+
+    def stored_files(self):
+        return sorted(os.listdir(os.path.join(settings.MEDIA_ROOT, CUSTOM_QUESTION_IMAGE_DIRECTORY)))
+
+    def test_store_by_content_hash(self):
+        response = self.post_question('/image_custom_question/create')
+        self.assertEqual(response.status_code, 302)
+        question = ImageCustomQuestion.objects.get()
+        self.assertEqual(len(question.choices), 4)
+        self.assertEqual(question.answer, [question.choices[0]])
+        for choice in question.choices:
+            self.assertRegex(choice, rf'^/media/custom_question/[0-9a-f]{{64}}_{CUSTOM_QUESTION_IMAGE_SIZE}\.jpg$')
+            with Image.open(os.path.join(settings.MEDIA_ROOT, choice[len('/media/'):])) as image:
+                self.assertEqual(max(image.size), CUSTOM_QUESTION_IMAGE_SIZE)
+        # Master and game variant of each image
+        self.assertEqual(len(self.stored_files()), 8)
+
+    def test_edit_reuse_stored_image(self):
+        self.post_question('/image_custom_question/create')
+        question = ImageCustomQuestion.objects.get()
+        choices = question.choices
+        stored_files = self.stored_files()
+        response = self.post_question(f'/image_custom_question/{question.id}/edit')
+        self.assertEqual(response.status_code, 302)
+        question.refresh_from_db()
+        self.assertEqual(question.choices, choices)
+        self.assertEqual(self.stored_files(), stored_files)
+
+    def test_duplicate_content_rejected(self):
+        response = self.post_question('/image_custom_question/create', colors=((255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 0, 0)))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(ImageCustomQuestion.objects.exists())
+
+
+class TestCustomQuestionJsonMigration(TransactionTestCase):
+    before = [('apps', '0026_knowledge_base_snapshot')]
+    after = [('apps', '0027_custom_question_json_choices')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_migrate_back_and_forth_with_questions(self):
+        old_apps = self.migrate(self.before)
+        old_apps.get_model('apps', 'TextCustomQuestion').objects.create(
+            question='Dummy question', choices="['A', 'B']", answer='["A"]', difficulty_level='easy'
+        )
+        new_apps = self.migrate(self.after)
+        question = new_apps.get_model('apps', 'TextCustomQuestion').objects.get()
+        self.assertEqual((question.choices, question.answer), (['A', 'B'], ['A']))
+        old_apps = self.migrate(self.before)
+        question = old_apps.get_model('apps', 'TextCustomQuestion').objects.get()
+        self.assertEqual((question.choices, question.answer), ('["A", "B"]', '["A"]'))
+
+
 class TestHomeView(BaseTestCase):
     def test_home_view(self):
         response = self.client.get('/')
@@ -1,16 +1,99 @@
+import binascii
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from decouple import config
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q, Count
+from django.utils import timezone
+
+from apps.cache import NamespaceCache
+from apps.models import QuestionCategory, UserCategoryWeight, GameQuestion, Game, LeaderboardEntry
+
+# Leaderboard show avatar in small size, so the thumbnail is used instead of the full avatar
+LEADERBOARD_AVATAR_SIZE = 128
+
+# Leaderboard and users' weight are read on every page / question, they are cached in the shared cache and invalidated
+# when they are changed. Change that doesn't invalidate (e.g. username or avatar in leaderboard) is shown after the TTL.
+leaderboard_cache = NamespaceCache('leaderboard', ttl=config('CACHE_LEADERBOARD_TTL', default=60, cast=int))
+user_weight_cache = NamespaceCache('user_weight', ttl=config('CACHE_USER_WEIGHT_TTL', default=300, cast=int))
+
+# Number of games in a page of user's game history
+GAME_HISTORY_PAGE_SIZE = 20
+
+
+def invalidate_user_weight(user_id=None):
+    """
+    Invalidate cached weight of the user, other workers may cache the old weight again before the change is committed
+    so it's invalidated again after commit
+    :param user_id: User ID, invalidate weight of all users if not provided
+    """
+    def invalidate():
+        if user_id is None:
+            user_weight_cache.invalidate()
+        else:
+            user_weight_cache.delete(user_id)
+    invalidate()
+    transaction.on_commit(invalidate)
+
 
-from apps.models import QuestionCategory, UserCategoryWeight, GameQuestion, Game
+def invalidate_leaderboard():
+    """
+    Invalidate cached leaderboard, again after commit for the same reason as invalidate_user_weight
+    """
+    leaderboard_cache.invalidate()
+    transaction.on_commit(leaderboard_cache.invalidate)
 
 
 def create_all_weighted():
     """
-    Create all weighted for all users and categories
+    Create all weighted for all users and categories, only the missing pairs are inserted.
+    Missing weight is read as 0, so this is only needed to backfill the rows shown in the admin pages.
+    """
+    existing = set(UserCategoryWeight.objects.values_list('user_id', 'category_id'))
+    category_ids = list(QuestionCategory.objects.values_list('id', flat=True))
+    UserCategoryWeight.objects.bulk_create(
+        [
+            UserCategoryWeight(user_id=user_id, category_id=category_id, weight=0.0)
+            for user_id in User.objects.values_list('id', flat=True).iterator()
+            for category_id in category_ids if (user_id, category_id) not in existing
+        ],
+        batch_size=1000
+    )
+    invalidate_user_weight()
+
+
+def create_weight_for_user(user: User):
+    """
+    Create weight of all categories for a new user in one insert
+    :param user: User instance
     """
-    for user in User.objects.all():
-        for category in QuestionCategory.objects.all():
-            if not UserCategoryWeight.objects.filter(user=user, category=category).exists():
-                UserCategoryWeight.objects.create(user=user, category=category, weight=0.0)
+    UserCategoryWeight.objects.bulk_create(
+        [
+            UserCategoryWeight(user_id=user.id, category_id=category_id, weight=0.0)
+            for category_id in QuestionCategory.objects.values_list('id', flat=True)
+        ],
+        ignore_conflicts=True
+    )
+    invalidate_user_weight(user.id)
+
+
+def create_weight_for_category(category: QuestionCategory):
+    """
+    Create weight of all users for a new category in batched inserts
+    :param category: QuestionCategory instance
+    """
+    UserCategoryWeight.objects.bulk_create(
+        [
+            UserCategoryWeight(user_id=user_id, category_id=category.id, weight=0.0)
+            for user_id in User.objects.values_list('id', flat=True).iterator()
+        ],
+        batch_size=1000,
+        ignore_conflicts=True
+    )
+    invalidate_user_weight()
 
 
 def create_weight_from_game(game_id):
@@ -19,27 +102,57 @@ def create_weight_from_game(game_id):
     :param game_id: Game ID
     :return: Weight dict
     """
-    question = GameQuestion.objects.filter(game_id=game_id, answered=True)
+    question = GameQuestion.objects.filter(game_id=game_id, answered=True).select_related('question')
     weight = {}
     for q in question:
-        if q.question.category.id in weight.keys():
-            weight[q.question.category.id] += q.get_weight()
+        if q.question.category_id in weight.keys():
+            weight[q.question.category_id] += q.get_weight()
         else:
-            weight[q.question.category.id] = q.get_weight()
+            weight[q.question.category_id] = q.get_weight()
     return weight
 
 
 def create_weight_from_database(user_id):
     """
-    Create weight dict applied from UserCategoryWeight
+    Create weight dict applied from UserCategoryWeight, category without row is not in the dict and read as 0
+    :param user_id: User ID
+    :return: Weight dict, it's a copy of the cached weight so the caller can modify it
+    """
+    return user_weight_cache.get_or_set(user_id, lambda: dict(
+        UserCategoryWeight.objects.filter(user_id=user_id).values_list('category_id', 'weight')
+    ))
+
+
+async def acreate_weight_from_database(user_id):
+    """
+    Async version of create_weight_from_database
     :param user_id: User ID
     :return: Weight dict
     """
-    all_weight = UserCategoryWeight.objects.filter(user_id=user_id)
-    weight = {}
-    for w in all_weight:
-        weight[w.category.id] = w.weight
-    return weight
+    return await sync_to_async(create_weight_from_database)(user_id)
+
+
+def save_game_weight(game: Game):
+    """
+    Save weight of the game to UserCategoryWeight of the user in one upsert query
+    :param game: Game instance
+    """
+    weight = game.get_weight()
+    if not weight:
+        return
+    # Category may be deleted while the game is running
+    category_ids = set(QuestionCategory.objects.filter(id__in=weight.keys()).values_list('id', flat=True))
+    with transaction.atomic():
+        UserCategoryWeight.objects.bulk_create(
+            [
+                UserCategoryWeight(user_id=game.user_id, category_id=category_id, weight=value)
+                for category_id, value in weight.items() if category_id in category_ids
+            ],
+            update_conflicts=True,
+            unique_fields=['user', 'category'],
+            update_fields=['weight']
+        )
+    invalidate_user_weight(game.user_id)
 
 
 def create_total_weight_with_game(game_id):
@@ -60,13 +173,74 @@ def create_total_weight_with_game(game_id):
     return weight
 
 
+def get_game_weight(game: Game):
+    """
+    Get total weight from history and in game from the running weight of the game
+    :param game: Game instance
+    :return: Weight dict
+    """
+    if game.weight:
+        return game.get_weight()
+    # Game that have no answer yet start from user's weight
+    return create_weight_from_database(game.user_id)
+
+
+def apply_answer_to_game(game: Game, game_question: GameQuestion):
+    """
+    Add the answered question to the running score, wrong answer count, and weight of the game.
+    The caller must save the game, use select_for_update() on the game to prevent concurrent update.
+    :param game: Game instance
+    :param game_question: Answered GameQuestion instance
+    """
+    weight = get_game_weight(game)
+    category_id = game_question.question.category_id
+    if category_id is not None:
+        weight[category_id] = weight.get(category_id, 0.0) + game_question.get_weight()
+    game.weight = weight
+    game.score += game_question.get_score()
+    if not game_question.is_true:
+        game.wrong_count += 1
+
+
+def record_answer(game_question: GameQuestion, answer: str, duration: float) -> bool:
+    """
+    Save the answer of the question
+    :param game_question: GameQuestion instance
+    :param answer: Answer of the user
+    :param duration: Seconds that the user took to answer
+    :return: True if the answer is right
+    """
+    game_question.is_true = game_question.question.answer == answer
+    game_question.answered = True
+    game_question.selected = answer
+    game_question.duration = duration
+    game_question.save()
+    return game_question.is_true
+
+
+def finish_game(game: Game):
+    """
+    Mark the game as completed, save the weight of the game to the user and update the leaderboard
+    :param game: Game instance
+    """
+    save_game_weight(game)
+    game.rank_before = get_user_rank(game.user_id)
+    game.finished = True
+    game.completed = True
+    game.end_time = timezone.now()
+    game.save()
+    update_leaderboard(game)
+    game.rank_after = get_user_rank(game.user_id)
+    game.save()
+
+
 def calculate_total_score(game_id):
     """
     Calculate total score for game
     :param game_id: Game ID
     :return: score
     """
-    valid_question = GameQuestion.objects.filter(is_true=True, answered=True, game_id=game_id)
+    valid_question = GameQuestion.objects.filter(is_true=True, answered=True, game_id=game_id).select_related('question')
     total_score = 0
     for question in valid_question:
         difficulty = question.question.difficulty_level
@@ -79,33 +253,147 @@ def calculate_total_score(game_id):
     return total_score
 
 
+def update_leaderboard(game: Game):
+    """
+    Update user's best score in leaderboard from the completed game
+    :param game: Game instance
+    """
+    if not (game.finished and game.completed):
+        return
+    updated = LeaderboardEntry.objects.filter(user_id=game.user_id, best_score__lt=game.score).update(best_score=game.score)
+    if updated:
+        invalidate_leaderboard()
+    else:
+        # Created entry invalidate the leaderboard by signal
+        LeaderboardEntry.objects.get_or_create(user_id=game.user_id, defaults={'best_score': max(game.score, 0)})
+
+
 def generate_leaderboard():
     """
-    Generate leaderboard
+    Generate leaderboard, it's cached until a score is changed
+    :return: Leaderboard dict
+    """
+    return leaderboard_cache.get_or_set('all', build_leaderboard)
+
+
+def build_leaderboard():
+    """
+    Build leaderboard from the database
     :return: Leaderboard dict
     """
-    leaderboard = {}
-    for user in User.objects.all():
-        leaderboard[user.username] = 0
-        for game in Game.objects.filter(user=user, finished=True, completed=True):
-            if game.score > leaderboard[user.username]:
-                leaderboard[user.username] = game.score
-    leaderboard = dict(sorted(leaderboard.items(), key=lambda item: item[1], reverse=True))
-    leaderboard = [{"username": k, "score": v, "rank": i + 1, "user_id": User.objects.get(username=k).id, "profile_picture": User.objects.get(username=k).profile.get_full_avatar_url()} for i, (k, v) in enumerate(leaderboard.items())]
+    entries = LeaderboardEntry.objects.select_related('user__profile').order_by('-best_score', 'user_id')
+    leaderboard = [{"username": entry.user.username, "score": entry.best_score, "rank": i + 1, "user_id": entry.user_id, "profile_picture": entry.user.profile.get_full_avatar_url(LEADERBOARD_AVATAR_SIZE)} for i, entry in enumerate(entries)]
     return leaderboard
 
 
+def get_answer_count(game_id) -> tuple[int, int]:
+    """
+    Count right and wrong answers of the game in one query
+    :param game_id: Game ID
+    :return: Tuple of right and wrong answer count
+    """
+    count = GameQuestion.objects.filter(game_id=game_id, answered=True).aggregate(
+        right=Count('id', filter=Q(is_true=True)),
+        wrong=Count('id', filter=Q(is_true=False))
+    )
+    return count['right'], count['wrong']
+
+
+def get_question_history(game_id) -> list:
+    """
+    Get answered questions of the game in answered order, in one query
+    :param game_id: Game ID
+    :return: List of question history dict
+    """
+    game_questions = GameQuestion.objects.filter(game_id=game_id, answered=True).select_related('question').only(
+        'selected', 'answered', 'is_true', 'question__question', 'question__question_mode', 'question__choice',
+        'question__answer', 'question__type', 'question__full_json'
+    ).order_by('id')
+    return [
+        {
+            'question': game_question.question.question,
+            'question_mode': game_question.question.question_mode,
+            'choices': game_question.question.get_choices(),
+            'answer': game_question.question.answer,
+            'selected': game_question.selected,
+            'answered': game_question.answered,
+            'is_true': game_question.is_true,
+            'type': game_question.question.type,
+            'full_json': game_question.question.full_json
+        }
+        for game_question in game_questions
+    ]
+
+
+def encode_game_cursor(game: Game) -> str:
+    """
+    Encode position of the game in the history as the cursor of the next page
+    :param game: Last game of the page
+    :return: Cursor string
+    """
+    return urlsafe_b64encode(f'{game.end_time.isoformat()}|{game.id}'.encode()).decode().rstrip('=')
+
+
+def decode_game_cursor(cursor: str) -> tuple[datetime, int]:
+    """
+    Decode the cursor from encode_game_cursor
+    :param cursor: Cursor string
+    :return: Tuple of end time and ID of the last game of the previous page
+    :raise ValueError: If the cursor is invalid
+    """
+    try:
+        end_time, game_id = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().split('|')
+        return datetime.fromisoformat(end_time), int(game_id)
+    except (binascii.Error, UnicodeDecodeError, TypeError) as e:
+        raise ValueError(f'Invalid cursor: {e}') from e
+
+
+def get_game_history(user_id, cursor: str = None, page_size: int = GAME_HISTORY_PAGE_SIZE) -> tuple[list, str]:
+    """
+    Get one page of the user's completed games, latest first. The page is sought by (end time, ID) of the last game of
+    the previous page with the history index instead of counting the offset, so every page cost the same.
+    :param user_id: User ID
+    :param cursor: Cursor of the page from the previous page, first page if not provided
+    :param page_size: Number of games in a page
+    :return: Tuple of list of Game (only ID, end time and score are loaded) and cursor of the next page, the cursor is
+             None on the last page
+    :raise ValueError: If the cursor is invalid
+    """
+    games = Game.objects.filter(user_id=user_id, finished=True, completed=True, end_time__isnull=False)
+    if cursor:
+        end_time, game_id = decode_game_cursor(cursor)
+        games = games.filter(Q(end_time__lt=end_time) | Q(end_time=end_time, id__lt=game_id))
+    # Fetch one more game to know that there is a next page
+    games = list(games.order_by('-end_time', '-id').only('id', 'end_time', 'score')[:page_size + 1])
+    if len(games) <= page_size:
+        return games, None
+    games = games[:page_size]
+    return games, encode_game_cursor(games[-1])
+
+
+def get_user_rank_and_highscore(user_id) -> tuple[int, int]:
+    """
+    Get user's rank and highscore from the leaderboard index without building the whole leaderboard
+    :param user_id: User ID
+    :return: Tuple of rank and highscore, rank is 0 if user is not in leaderboard
+    """
+    entry = LeaderboardEntry.objects.filter(user_id=user_id).only('best_score').first()
+    if entry is None:
+        return 0, 0
+    # Rank is the number of users ahead in leaderboard order (-best_score, user_id) plus one
+    ahead = LeaderboardEntry.objects.filter(
+        Q(best_score__gt=entry.best_score) | Q(best_score=entry.best_score, user_id__lt=user_id)
+    ).count()
+    return ahead + 1, entry.best_score
+
+
 def get_user_rank(user_id) -> int:
     """
     Get user's rank
     :param user_id: User ID
     :return: Rank
     """
-    leaderboard = generate_leaderboard()
-    for i, user in enumerate(leaderboard):
-        if user['user_id'] == user_id:
-            return i + 1
-    return 0
+    return get_user_rank_and_highscore(user_id)[0]
 
 
 def get_user_highscore(user_id) -> int:
@@ -114,8 +402,7 @@ def get_user_highscore(user_id) -> int:
     :param user_id: User ID
     :return: Highscore
     """
-    leaderboard = generate_leaderboard()
-    for user in leaderboard:
-        if user['user_id'] == user_id:
-            return user['score']
-    return 0
+    entry = LeaderboardEntry.objects.filter(user_id=user_id).only('best_score').first()
+    if entry is None:
+        return 0
+    return entry.best_score
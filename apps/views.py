@@ -5,15 +5,15 @@ from decouple import config
 from django.contrib import messages
 from django.contrib.auth.decorators import user_passes_test, login_required
 from django.contrib.auth.models import User
-from django.core.files.storage import default_storage
 from django.shortcuts import render, redirect
 
 from apps.forms import QuestionModelForm, GameModeForm, QuestionCategoryForm, TextCustomQuestionForm, \
     ImageCustomQuestionForm
-from apps.models import QuestionModel, GameMode, QuestionCategory, TextCustomQuestion, ImageCustomQuestion, Game, \
-    GameQuestion
+from apps.image_storage import store_custom_question_image
+from apps.models import QuestionModel, GameMode, QuestionCategory, TextCustomQuestion, ImageCustomQuestion, Game
 from apps.question import generate_question
-from apps.utils import create_all_weighted, generate_leaderboard, get_user_rank, get_user_highscore
+from apps.utils import create_weight_for_category, generate_leaderboard, get_user_rank_and_highscore, \
+    get_answer_count, get_question_history, get_game_history
 
 KNOWLEDGE_BASE_URL = config('KNOWLEDGE_BASE_URL', default='http://localhost:8000')
 if KNOWLEDGE_BASE_URL[-1] == '/':
@@ -23,10 +23,14 @@ logger = logging.getLogger(__name__)
 
 
 def home(request):
+    if request.user.is_authenticated:
+        user_rank, user_high_score = get_user_rank_and_highscore(request.user.id)
+    else:
+        user_rank, user_high_score = 0, 0
     return render(request, 'apps/home.html', {
         'user_obj': request.user if request.user.is_authenticated else None,
-        'user_rank': get_user_rank(request.user.id) if request.user.is_authenticated else 0,
-        'user_high_score': get_user_highscore(request.user.id) if request.user.is_authenticated else 0
+        'user_rank': user_rank,
+        'user_high_score': user_high_score
     })
 
 
@@ -179,8 +183,8 @@ def question_category_list(request):
 def question_category_create(request):
     if request.method == 'POST':
         form = QuestionCategoryForm(request.POST)
-        form.save()
-        create_all_weighted()
+        category = form.save()
+        create_weight_for_category(category)
         messages.success(request, 'Category created successfully')
         return redirect('apps_question_category_list')
     else:
@@ -287,8 +291,8 @@ def text_custom_question_edit(request, question_id):
     else:
         form = TextCustomQuestionForm(initial={
             'question': question.question,
-            'choices': question.choices.replace("'", '"'),
-            'answer': question.answer.replace("'", '"'),
+            'choices': json.dumps(question.choices),
+            'answer': json.dumps(question.answer),
             'category': question.category
         })
     return render(request, 'apps/text_custom_question/edit.html', {
@@ -321,7 +325,7 @@ def text_custom_question_view(request, question_id):
         return redirect('apps_text_custom_question_list')
     return render(request, 'apps/text_custom_question/view.html', {
         'question': question,
-        'choice_list': json.loads(question.choices.replace("'", '"'))
+        'choice_list': question.choices
     })
 
 
@@ -342,15 +346,14 @@ def image_custom_question_create(request):
             cleaned_data = form.cleaned_data
             image_choice = []
             for image in request.FILES.getlist('choices'):
-                saved_path = default_storage.save(f'custom_question/{image.name}', image)
-                image_choice.append(default_storage.url(saved_path))
+                image_choice.append(store_custom_question_image(image))
             answer_choice = []
             for answer in cleaned_data['answer_len']:
                 answer_choice.append(image_choice[answer])
             ImageCustomQuestion.objects.create(
                 question=form.cleaned_data['question'],
-                choices=json.dumps(image_choice),
-                answer=json.dumps(answer_choice),
+                choices=image_choice,
+                answer=answer_choice,
                 difficulty_level=form.cleaned_data['difficulty_level'],
                 category=form.cleaned_data['category']
             )
@@ -380,13 +383,12 @@ def image_custom_question_edit(request, question_id):
             # save image from form (choices)
             choices = []
             for image in request.FILES.getlist('choices'):
-                saved_path = default_storage.save(f'custom_question/{image.name}', image)
-                choices.append(default_storage.url(saved_path))
-            question.choices = json.dumps(choices)
+                choices.append(store_custom_question_image(image))
+            question.choices = choices
             answers = []
             for answer in cleaned_data['answer_len']:
                 answers.append(choices[answer])
-            question.answer = json.dumps(answers)
+            question.answer = answers
             question.difficulty_level = form.cleaned_data['difficulty_level']
             question.save()
             messages.success(request, 'Question updated successfully')
@@ -429,7 +431,7 @@ def image_custom_question_view(request, question_id):
         return redirect('apps_image_custom_question_list')
     return render(request, 'apps/image_custom_question/view.html', {
         'question': question,
-        'choice_list': json.loads(question.choices)
+        'choice_list': question.choices
     })
 
 
@@ -450,40 +452,37 @@ def user_profile(request, user_id):
     except User.DoesNotExist:
         messages.error(request, 'User not found')
         return redirect('apps_home')
+    user_rank, user_high_score = get_user_rank_and_highscore(user_id)
+    cursor = request.GET.get('cursor')
+    try:
+        history, next_cursor = get_game_history(user_obj.id, cursor)
+    except ValueError:
+        messages.error(request, 'Invalid history page')
+        return redirect('apps_user_profile', user_id=user_obj.id)
     return render(request, 'apps/user_profile.html', {
         'user_obj': user_obj,
-        'user_rank': get_user_rank(user_id),
-        'user_high_score': get_user_highscore(user_id),
-        'history': Game.objects.filter(user=user_obj, finished=True, completed=True).order_by('-end_time')
+        'user_rank': user_rank,
+        'user_high_score': user_high_score,
+        'history': history,
+        'is_first_page': not cursor,
+        'next_cursor': next_cursor
     })
 
 
 def play_history(request, game_id):
     try:
-        game = Game.objects.get(id=game_id)
+        game = Game.objects.select_related('user').get(id=game_id)
     except Game.DoesNotExist:
         messages.error(request, 'Game not found')
         return redirect('apps_home')
     if not (game.finished and game.completed):
         messages.error(request, 'Game not found')
         return redirect('apps_home')
-    question_history_list = []
-    for question in GameQuestion.objects.filter(game=game, answered=True).order_by('id'):
-        question_history_list.append({
-            'question': question.question.question,
-            'question_mode': question.question.question_mode,
-            'choices': json.loads(question.question.choice.replace("'", '"')),
-            'answer': question.question.answer,
-            'selected': question.selected,
-            'answered': question.answered,
-            'is_true': question.is_true,
-            'type': question.question.type,
-            'full_json': question.question.full_json
-        })
+    right, wrong = get_answer_count(game.id)
     return render(request, 'apps/play_history.html', {
         'game': game,
-        'question_list': question_history_list,
-        'right': GameQuestion.objects.filter(game=game, answered=True, is_true=True).count(),
-        'wrong': GameQuestion.objects.filter(game=game, answered=True, is_true=False).count(),
+        'question_list': get_question_history(game.id),
+        'right': right,
+        'wrong': wrong,
         'knowledge_base_url': KNOWLEDGE_BASE_URL
     })
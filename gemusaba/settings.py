@@ -128,6 +128,32 @@ else:
                 default=''),
         }}
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Use file or redis backend to share the cache between workers and nodes, see apps/cache.py
+
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+}
+CACHE_BACKEND = config('CACHE_BACKEND', default='locmem')
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND],
+        # Name of the local memory cache, directory of the file cache, or URL of the Redis server
+        'LOCATION': config(
+            'CACHE_LOCATION',
+            default=str(BASE_DIR / 'cache') if CACHE_BACKEND == 'file' else ''),
+        'KEY_PREFIX': config('CACHE_KEY_PREFIX', default='gemusaba'),
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=10000, cast=int)
+        } if CACHE_BACKEND != 'redis' else {},
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -334,7 +360,7 @@ if config('ENABLE_SENTRY', cast=bool, default=False):
                 # This will be used more in the future like sending email when on event, etc.
                 signals_spans=True,
                 # See how many cache hits/misses there are
-                cache_spans=False
+                cache_spans=True
             )
         ]
     )
@@ -0,0 +1,155 @@
+import logging
+import os
+import queue
+import threading
+from io import BytesIO
+
+from PIL import Image, ImageOps
+from decouple import config
+from django.core.files.base import ContentFile
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+# Avatar is resized to these sizes (in pixel, the longer side) in background after it's changed, the page request the
+# smallest size that is enough for where the avatar is shown instead of the full avatar
+AVATAR_SIZES = (64, 128, 256)
+# Uploaded avatar is downscaled to this size
+AVATAR_MAX_SIZE = 500
+# Format name -> (PIL format, file extension)
+AVATAR_FORMATS = {
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg'),
+}
+AVATAR_PROCESS_IN_BACKGROUND = config('AVATAR_PROCESS_IN_BACKGROUND', default=True, cast=bool)
+
+
+def get_thumbnail_name(avatar_name: str, size: int, image_format: str) -> str:
+    """
+    Get storage name of the avatar thumbnail, the name only depend on the avatar so the default avatar's thumbnails
+    are shared by all users
+    :param avatar_name: Storage name of the avatar
+    :param size: Size in AVATAR_SIZES
+    :param image_format: Format in AVATAR_FORMATS
+    :return: Storage name of the thumbnail
+    """
+    stem = os.path.splitext(avatar_name)[0].replace('avatars/', '', 1).replace('/', '_')
+    return f'avatars/thumbnails/{stem}_{size}.{AVATAR_FORMATS[image_format][1]}'
+
+
+def get_thumbnail_size(size: int) -> int:
+    """
+    Get the smallest thumbnail size that is not smaller than the requested size
+    :param size: Requested size in pixel
+    :return: Size in AVATAR_SIZES, the largest size if the requested size is larger than all sizes
+    """
+    return next((s for s in AVATAR_SIZES if s >= size), AVATAR_SIZES[-1])
+
+
+def encode_image(image: Image.Image, pil_format: str) -> bytes:
+    """
+    Encode the image in the format, transparency is flattened on white background for JPEG
+    :param image: PIL image
+    :param pil_format: PIL format name
+    :return: Encoded image
+    """
+    if pil_format == 'JPEG' and image.mode != 'RGB':
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        rgba = image.convert('RGBA')
+        background.paste(rgba, mask=rgba.split()[-1])
+        image = background
+    output = BytesIO()
+    image.save(output, format=pil_format, quality=85)
+    return output.getvalue()
+
+
+def build_avatar_thumbnails(storage, avatar_name: str, resize_original: bool = True) -> list:
+    """
+    Downscale the avatar and save its thumbnails in every size and format, thumbnails that already exist are kept
+    :param storage: Storage of the avatar
+    :param avatar_name: Storage name of the avatar
+    :param resize_original: Also downscale the avatar itself if it's larger than AVATAR_MAX_SIZE
+    :return: List of storage name of the created thumbnails
+    """
+    missing = [
+        (size, image_format) for size in AVATAR_SIZES for image_format in AVATAR_FORMATS
+        if not storage.exists(get_thumbnail_name(avatar_name, size, image_format))
+    ]
+    with storage.open(avatar_name, 'rb') as f:
+        image = Image.open(f)
+        image.load()
+    original_format = image.format or 'PNG'
+    image = ImageOps.exif_transpose(image)
+    if resize_original and (image.height > AVATAR_MAX_SIZE or image.width > AVATAR_MAX_SIZE):
+        image.thumbnail((AVATAR_MAX_SIZE, AVATAR_MAX_SIZE))
+        with storage.open(avatar_name, 'wb') as f:
+            f.write(encode_image(image, original_format))
+    created = []
+    for size, image_format in missing:
+        thumbnail = image.copy()
+        thumbnail.thumbnail((size, size))
+        name = get_thumbnail_name(avatar_name, size, image_format)
+        created.append(storage.save(name, ContentFile(encode_image(thumbnail, AVATAR_FORMATS[image_format][0]))))
+    return created
+
+
+def process_avatar(profile_id: int):
+    """
+    Build the thumbnails of the profile's current avatar and mark them as ready
+    :param profile_id: Profile ID
+    """
+    from users.models import Profile
+    profile = Profile.objects.filter(id=profile_id).first()
+    if profile is None or profile.avatar_thumbnail == profile.avatar.name:
+        return
+    avatar_name = profile.avatar.name
+    build_avatar_thumbnails(profile.avatar.storage, avatar_name, resize_original=avatar_name != Profile.DEFAULT_AVATAR)
+    # The avatar may be changed again while processing, its own processing will mark it
+    Profile.objects.filter(id=profile_id, avatar=avatar_name).update(avatar_thumbnail=avatar_name)
+
+
+class AvatarProcessor:
+    """
+    Process changed avatars in a background thread so saving the profile doesn't wait on resizing
+    """
+    def __init__(self, background: bool = AVATAR_PROCESS_IN_BACKGROUND):
+        """
+        :param background: Disable to process the avatar in the caller's thread
+        """
+        self.background = background
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+
+    def enqueue(self, profile_id: int):
+        """
+        Queue the avatar of the profile to be processed
+        :param profile_id: Profile ID
+        """
+        if not self.background:
+            process_avatar(profile_id)
+            return
+        self._ensure_worker()
+        self._queue.put(profile_id)
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='avatar-processor', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            profile_id = self._queue.get()
+            try:
+                close_old_connections()
+                process_avatar(profile_id)
+            except Exception as e:
+                logger.error(f'Error when processing avatar of profile {profile_id}: {e}')
+                logger.exception(e)
+            finally:
+                close_old_connections()
+                self._queue.task_done()
+
+
+avatar_processor = AvatarProcessor()
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-18 21:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='avatar_thumbnail',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
@@ -1,15 +1,20 @@
-from PIL import Image
 from decouple import config
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
+
+from users.avatar import avatar_processor, get_thumbnail_name, get_thumbnail_size
 
 CURRENT_URL = config('CURRENT_URL')
 
 
 class Profile(models.Model):
     """Profile model."""
+    DEFAULT_AVATAR = 'avatars/default.jpeg'
+
     user = models.OneToOneField(User, on_delete=models.CASCADE)
-    avatar = models.ImageField(upload_to='avatars/', default='avatars/default.jpeg')
+    avatar = models.ImageField(upload_to='avatars/', default=DEFAULT_AVATAR)
+    # Name of the avatar that the thumbnails are built for, see users/avatar.py
+    avatar_thumbnail = models.CharField(max_length=255, blank=True, default='')
 
     class Meta:
         """Meta class."""
@@ -20,14 +25,49 @@ class Profile(models.Model):
         """Return name."""
         return self.user.username + ' profile'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_avatar = instance.__dict__.get('avatar')
+        return instance
+
     def save(self, *args, **kwargs):
-        """Resize image on save"""
+        """Process the avatar in background when it's changed"""
         super().save(*args, **kwargs)
-        image = Image.open(self.avatar.path)
-        if image.height > 500 or image.width > 500:
-            output_size = (500, 500)
-            image.thumbnail(output_size)
-            image.save(self.avatar.path)
-
-    def get_full_avatar_url(self):
-        return CURRENT_URL + self.avatar.url
+        if self.avatar.name != getattr(self, '_loaded_avatar', None) and self.avatar.name != self.avatar_thumbnail:
+            profile_id = self.id
+            transaction.on_commit(lambda: avatar_processor.enqueue(profile_id))
+        self._loaded_avatar = self.avatar.name
+
+    def has_avatar_thumbnail(self) -> bool:
+        """Check that the thumbnails of the current avatar are ready"""
+        return bool(self.avatar_thumbnail) and self.avatar_thumbnail == self.avatar.name
+
+    def get_avatar_url(self, size: int = None, image_format: str = 'jpeg') -> str:
+        """
+        Get URL of the avatar
+        :param size: Size that the avatar is shown in pixel, the full avatar is used if not provided or the thumbnails
+                     are not ready yet
+        :param image_format: Format of the thumbnail (jpeg or webp)
+        :return: URL of the avatar
+        """
+        if size is None or not self.has_avatar_thumbnail():
+            return self.avatar.url
+        return self.avatar.storage.url(get_thumbnail_name(self.avatar.name, get_thumbnail_size(size), image_format))
+
+    def get_full_avatar_url(self, size: int = None, image_format: str = 'jpeg') -> str:
+        """
+        Get absolute URL of the avatar, see get_avatar_url
+        :param size: Size that the avatar is shown in pixel
+        :param image_format: Format of the thumbnail (jpeg or webp)
+        :return: Absolute URL of the avatar
+        """
+        return CURRENT_URL + self.get_avatar_url(size, image_format)
+
+    # Templates can't pass argument, these are the sizes used in the templates (doubled for high density screen)
+
+    def get_small_avatar_url(self) -> str:
+        return self.get_avatar_url(64, 'webp')
+
+    def get_large_avatar_url(self) -> str:
+        return self.get_avatar_url(256, 'webp')
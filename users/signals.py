@@ -2,7 +2,8 @@ from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
-from apps.utils import create_all_weighted
+from apps.models import LeaderboardEntry
+from apps.utils import create_weight_for_user
 from users.models import Profile
 
 
@@ -10,4 +11,5 @@ from users.models import Profile
 def create_profile(sender, instance, created, **kwargs):
     if created:
         Profile.objects.create(user=instance)
-        create_all_weighted()
+        LeaderboardEntry.objects.create(user=instance)
+        create_weight_for_user(instance)
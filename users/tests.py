@@ -1,6 +1,15 @@
+import shutil
+import tempfile
+from io import BytesIO
+
+from PIL import Image
 from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
 
 from apps.tests import BaseTestCase
+from users.avatar import avatar_processor, get_thumbnail_name, AVATAR_SIZES, AVATAR_FORMATS, \
+    AVATAR_PROCESS_IN_BACKGROUND
 
 
 class TestLogout(BaseTestCase):
@@ -295,4 +304,57 @@ class TestUserDetail(BaseTestCase):
         self.create_dummy_user()
         response = self.client.get('/users/users_management/manage/2')
         self.assertEqual(response.status_code, 302)
-        self.assertEqual(response.url, '/login/?next=/users/users_management/manage/2')
\ No newline at end of file
+        self.assertEqual(response.url, '/login/?next=/users/users_management/manage/2')
+
+class TestAvatarThumbnail(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        avatar_processor.background = False
+        self.addCleanup(setattr, avatar_processor, 'background', AVATAR_PROCESS_IN_BACKGROUND)
+
+    def upload_avatar(self, size=(800, 600)):
+        output = BytesIO()
+        Image.new('RGB', size, (0, 128, 0)).save(output, format='PNG')
+        profile = self.user.profile
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.avatar = SimpleUploadedFile('avatar.png', output.getvalue(), content_type='image/png')
+            profile.save()
+        profile.refresh_from_db()
+        return profile
+
+    def test_thumbnail_built_on_avatar_change(self):
+        profile = self.upload_avatar()
+        self.assertTrue(profile.has_avatar_thumbnail())
+        storage = profile.avatar.storage
+        for size in AVATAR_SIZES:
+            for image_format in AVATAR_FORMATS:
+                name = get_thumbnail_name(profile.avatar.name, size, image_format)
+                self.assertTrue(storage.exists(name))
+                with storage.open(name, 'rb') as f:
+                    self.assertEqual(max(Image.open(f).size), size)
+        # The original avatar is downscaled
+        with storage.open(profile.avatar.name, 'rb') as f:
+            self.assertEqual(Image.open(f).size, (500, 375))
+
+    def test_save_without_avatar_change(self):
+        profile = self.upload_avatar()
+        with self.captureOnCommitCallbacks() as callbacks:
+            profile.save()
+        self.assertEqual(callbacks, [])
+
+    def test_avatar_url(self):
+        profile = self.user.profile
+        profile.avatar = 'avatars/new.png'
+        # Thumbnails are not ready yet, the full avatar is used
+        self.assertEqual(profile.get_avatar_url(64), profile.avatar.url)
+        profile.avatar_thumbnail = 'avatars/new.png'
+        self.assertEqual(profile.get_avatar_url(40), '/media/avatars/thumbnails/new_64.jpg')
+        self.assertEqual(profile.get_avatar_url(100, 'webp'), '/media/avatars/thumbnails/new_128.webp')
+        self.assertEqual(profile.get_avatar_url(1000), '/media/avatars/thumbnails/new_256.jpg')
+        self.assertEqual(profile.get_avatar_url(), profile.avatar.url)
+        self.assertTrue(profile.get_full_avatar_url(64).endswith('/media/avatars/thumbnails/new_64.jpg'))